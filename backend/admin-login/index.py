@@ -7,13 +7,13 @@ Returns: HTTP response with auth token or error
 import json
 import secrets
 import hashlib
-import os
 from typing import Dict, Any, Optional
-import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_connection
+from response import compressed
 
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    return get_connection()
 
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
@@ -48,6 +48,7 @@ def update_admin_password(username: str, new_password_hash: str) -> bool:
     finally:
         conn.close()
 
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -1,15 +1,42 @@
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict
+from db import get_connection
+from visit_rollup import cached, visit_range, visit_summary
+from response import compressed
 
 SCHEMA = 't_p39135821_musician_site_projec'
 
+def with_connection(query: Callable[[Any], Any]) -> Any:
+    conn = get_connection()
+    try:
+        return query(conn)
+    finally:
+        conn.close()
+
+def parse_date(params: Dict[str, Any], name: str) -> date:
+    try:
+        return date.fromisoformat(params[name])
+    except ValueError:
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+def parse_days(value: Any) -> int:
+    if value is None:
+        return 30
+    try:
+        days = int(str(value).strip())
+    except ValueError:
+        raise ValueError('days must be an integer from 1 to 366')
+    return min(max(days, 1), 366)
+
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Получение детальной статистики посещений сайта за разные периоды
+    Получение детальной статистики посещений сайта за разные периоды.
+    Без параметров — сводка и посуточный ряд за days дней (по умолчанию 30),
+    с from/to — ряд за период по дням, неделям или месяцам.
+    unique_* и unique — оценка уникальных посетителей по HyperLogLog-скетчам
     '''
     method: str = event.get('httpMethod', 'GET')
 
@@ -43,58 +70,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
 
-    today = datetime.now().date()
-    week_ago = (today - timedelta(days=7)).isoformat()
-    month_ago = (today - timedelta(days=30)).isoformat()
-    today_str = today.isoformat()
-
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(f"""
-        SELECT
-            DATE(visited_at) as date,
-            COUNT(*) as visits
-        FROM {SCHEMA}.site_visits
-        WHERE visited_at >= '{month_ago}'
-        GROUP BY DATE(visited_at)
-        ORDER BY date DESC
-    """)
-    daily_stats = cursor.fetchall()
-
-    cursor.execute(f"SELECT COUNT(*) as total FROM {SCHEMA}.site_visits")
-    total_visits = cursor.fetchone()['total']
-
-    cursor.execute(f"SELECT COUNT(*) as cnt FROM {SCHEMA}.site_visits WHERE DATE(visited_at) = '{today_str}'")
-    today_visits = cursor.fetchone()['cnt']
-
-    cursor.execute(f"SELECT COUNT(*) as cnt FROM {SCHEMA}.site_visits WHERE visited_at >= '{week_ago}'")
-    week_visits = cursor.fetchone()['cnt']
-
-    cursor.execute(f"SELECT COUNT(*) as cnt FROM {SCHEMA}.site_visits WHERE visited_at >= '{month_ago}'")
-    month_visits = cursor.fetchone()['cnt']
-
-    cursor.close()
-    conn.close()
-
-    daily_data = [
-        {'date': str(row['date']), 'visits': row['visits']}
-        for row in daily_stats
-    ]
-
-    result = {
-        'summary': {
-            'today': today_visits,
-            'week': week_visits,
-            'month': month_visits,
-            'total': total_visits
-        },
-        'daily': daily_data
-    }
+    params = event.get('queryStringParameters') or {}
+    try:
+        if params.get('from') or params.get('to'):
+            # Произвольный период: ?from=YYYY-MM-DD&to=YYYY-MM-DD&granularity=day|week|month
+            date_to = parse_date(params, 'to') if params.get('to') else date.today()
+            date_from = parse_date(params, 'from') if params.get('from') else date_to - timedelta(days=30)
+            granularity = params.get('granularity', 'day')
+            key = ('range', date_from, date_to, granularity)
+            loader = lambda: {
+                'from': date_from.isoformat(),
+                'to': date_to.isoformat(),
+                'granularity': granularity,
+                **with_connection(lambda conn: visit_range(conn, date_from, date_to, granularity))
+            }
+        else:
+            days = parse_days(params.get('days'))
+            key = ('summary', days)
+            loader = lambda: with_connection(lambda conn: visit_summary(conn, days))
+        result, hit = cached(key, loader)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
 
     return {
         'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'X-Cache',
+            'X-Cache': 'HIT' if hit else 'MISS'
+        },
         'body': json.dumps(result),
         'isBase64Encoded': False
     }
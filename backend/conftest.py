@@ -0,0 +1,149 @@
+'''
+Business: Общие фикстуры для pytest-тестов backend-функций
+Args: TEST_DATABASE_URL — пустая или уже размеченная база Postgres для тестов с БД
+Returns: фикстуры database_url (схема с применёнными db_migrations) и http_stub (локальный HTTP-сервер)
+'''
+
+import glob
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(os.path.dirname(BACKEND_DIR), 'db_migrations')
+SCHEMA = 't_p39135821_musician_site_projec'
+
+
+def use_function_dir(function_dir: str) -> None:
+    '''
+    Каждая функция деплоится отдельно и импортирует свои db.py, response.py и т.п.
+    по короткому имени. Перед тестами функции её каталог ставится первым в sys.path,
+    а модули соседних функций выгружаются, чтобы не подхватить чужой db.py
+    '''
+    function_dir = os.path.abspath(function_dir)
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None) or ''
+        if path.startswith(BACKEND_DIR + os.sep) and not path.startswith(function_dir + os.sep) \
+                and os.path.dirname(path) != BACKEND_DIR:
+            del sys.modules[name]
+    if function_dir in sys.path:
+        sys.path.remove(function_dir)
+    sys.path.insert(0, function_dir)
+
+
+def pytest_collectstart(collector) -> None:
+    # Тесты лежат в <функция>/tests/, импорт тестового модуля идёт после этого хука
+    path = str(getattr(collector, 'path', '') or '')
+    if not path.endswith('.py'):
+        return
+    tests_dir = os.path.dirname(path)
+    if os.path.basename(tests_dir) == 'tests':
+        use_function_dir(os.path.dirname(tests_dir))
+
+
+@pytest.fixture(scope='session')
+def database_url() -> str:
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    psycopg2 = pytest.importorskip('psycopg2')
+    # Функции пишут имена таблиц без схемы, на платформе её задаёт search_path
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA},public'
+    os.environ['DATABASE_URL'] = url
+    conn = psycopg2.connect(url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # Миграции не идемпотентны, поэтому применённые запоминаются по имени файла
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cur.execute('CREATE TABLE IF NOT EXISTS public.test_applied_migrations (name TEXT PRIMARY KEY)')
+        cur.execute('SELECT name FROM public.test_applied_migrations')
+        applied = {row[0] for row in cur.fetchall()}
+        for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+            name = os.path.basename(path)
+            if name in applied:
+                continue
+            with open(path, encoding='utf-8') as f:
+                cur.execute(f.read())
+            cur.execute('INSERT INTO public.test_applied_migrations (name) VALUES (%s)', (name,))
+    conn.close()
+    return url
+
+
+class StubServer:
+    '''Локальный HTTP-сервер: маршрут -> функция (method, path, query, body) -> (status, headers, body)'''
+
+    def __init__(self):
+        self.routes: Dict[str, Callable[..., Tuple[int, Dict[str, str], Any]]] = {}
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                from urllib.parse import parse_qs, urlparse
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with stub._lock:
+                    stub.requests.append({'method': self.command, 'path': parsed.path,
+                                          'query': parse_qs(parsed.query), 'body': body})
+                route = stub.routes.get(parsed.path)
+                if route is None:
+                    status, headers, payload = 404, {}, b''
+                else:
+                    status, headers, payload = route(self.command, parsed.path, parse_qs(parsed.query), body)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode('utf-8')
+                    headers = {'Content-Type': 'application/json', **headers}
+                elif isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if not any(key.lower() == 'content-length' for key in headers):
+                    self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    if isinstance(payload, bytes):
+                        self.wfile.write(payload)
+                    else:
+                        for chunk in payload:
+                            self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент не дождался ответа — так тесты проверяют таймауты
+                    pass
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def calls(self, path: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [r for r in self.requests if path is None or r['path'] == path]
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def http_stub():
+    server = StubServer()
+    yield server
+    server.close()
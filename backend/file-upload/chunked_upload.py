@@ -0,0 +1,194 @@
+'''
+Business: Порционная загрузка больших файлов: init, куски с номером и смещением, finalize
+Args: conn — соединение с БД; id загрузки; байты куска, его номер и смещение
+Returns: позиция, с которой продолжать загрузку; после finalize — id готового медиафайла
+'''
+
+import os
+from typing import Any, Dict
+from psycopg2.extras import RealDictCursor
+from media_store import SCHEMA, claim_blob, detect_mime, point_media
+
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', str(2 * 1024 * 1024)))
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(200 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL', '86400'))
+
+
+class UploadConflict(ValueError):
+    '''Кусок не на своём месте: клиент должен продолжить с позиции из ответа'''
+
+    def __init__(self, message: str, position: Dict[str, Any]):
+        super().__init__(message)
+        self.position = position
+
+
+def _position(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'uploadId': session['id'],
+        'nextChunk': session['next_chunk'],
+        'nextOffset': session['received_bytes'],
+        'receivedBytes': session['received_bytes'],
+        'totalBytes': session['total_bytes'],
+        'chunkSize': UPLOAD_CHUNK_BYTES,
+        'complete': session['received_bytes'] == session['total_bytes']
+    }
+
+
+def _lock_session(cur, upload_id: str) -> Dict[str, Any]:
+    cur.execute(f'SELECT * FROM {SCHEMA}.upload_sessions WHERE id = %s FOR UPDATE', (upload_id,))
+    session = cur.fetchone()
+    if not session:
+        raise LookupError('Upload not found')
+    return dict(session)
+
+
+def init_upload(conn, upload_id: str, filename: str, content_type: str,
+                total_bytes: int, sha256: str = '') -> Dict[str, Any]:
+    if total_bytes <= 0 or total_bytes > UPLOAD_MAX_BYTES:
+        raise ValueError(f'File size must be between 1 and {UPLOAD_MAX_BYTES} bytes')
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Брошенные загрузки удаляются вместе с кусками при открытии новых,
+        # завершённые — когда повторный finalize по ним уже не придёт
+        cur.execute(f'''
+            DELETE FROM {SCHEMA}.upload_sessions
+            WHERE updated_at < NOW() - make_interval(secs => %s)
+        ''', (UPLOAD_SESSION_TTL,))
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.upload_sessions (id, filename, content_type, total_bytes, sha256)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING *
+        ''', (upload_id, filename, content_type, total_bytes, sha256.lower() or None))
+        session = dict(cur.fetchone())
+    conn.commit()
+    return _position(session)
+
+
+def upload_status(conn, upload_id: str) -> Dict[str, Any]:
+    '''Позиция для продолжения после обрыва и номера уже принятых кусков'''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'SELECT * FROM {SCHEMA}.upload_sessions WHERE id = %s', (upload_id,))
+        session = cur.fetchone()
+        cur.execute(f'''
+            SELECT COALESCE(array_agg(chunk_index ORDER BY chunk_index), '{{}}') AS chunks
+            FROM {SCHEMA}.upload_chunks WHERE upload_id = %s
+        ''', (upload_id,))
+        chunks = cur.fetchone()['chunks']
+    conn.rollback()
+    if not session:
+        raise LookupError('Upload not found')
+    return {**_position(dict(session)), 'receivedChunks': chunks, 'finalized': session['status'] == 'finalized'}
+
+
+def put_chunk(conn, upload_id: str, index: int, offset: int, payload: bytes) -> Dict[str, Any]:
+    '''
+    Принимает кусок строго по порядку. Повтор уже принятого куска (ответ до
+    клиента не дошёл) подтверждается без записи
+    '''
+    if not payload or len(payload) > UPLOAD_CHUNK_BYTES:
+        raise ValueError(f'Chunk must be between 1 and {UPLOAD_CHUNK_BYTES} bytes')
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        session = _lock_session(cur, upload_id)
+        if session['status'] != 'open':
+            conn.rollback()
+            raise ValueError('Upload is already finalized')
+        if index < session['next_chunk']:
+            cur.execute(f'''
+                SELECT byte_offset, byte_length FROM {SCHEMA}.upload_chunks
+                WHERE upload_id = %s AND chunk_index = %s
+            ''', (upload_id, index))
+            stored = cur.fetchone()
+            conn.rollback()
+            if stored and stored['byte_offset'] == offset and stored['byte_length'] == len(payload):
+                return _position(session)
+            raise UploadConflict(f'Chunk {index} was already received with a different range', _position(session))
+        if index != session['next_chunk'] or offset != session['received_bytes']:
+            conn.rollback()
+            raise UploadConflict(
+                f"Expected chunk {session['next_chunk']} at offset {session['received_bytes']}",
+                _position(session)
+            )
+        if offset + len(payload) > session['total_bytes']:
+            conn.rollback()
+            raise ValueError('Chunk goes past the declared file size')
+
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.upload_chunks (upload_id, chunk_index, byte_offset, byte_length, content)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', (upload_id, index, offset, len(payload), payload))
+        cur.execute(f'''
+            UPDATE {SCHEMA}.upload_sessions
+            SET received_bytes = received_bytes + %s, next_chunk = next_chunk + 1, updated_at = NOW()
+            WHERE id = %s
+            RETURNING *
+        ''', (len(payload), upload_id))
+        session = dict(cur.fetchone())
+    conn.commit()
+    return _position(session)
+
+
+def _finalized(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'fileId': session['id'],
+        'originalFilename': session['filename'],
+        'contentType': session['content_type'],
+        'sha256': session['sha256'],
+        'size': session['total_bytes']
+    }
+
+
+def finalize_upload(conn, upload_id: str, sha256: str = '') -> Dict[str, Any]:
+    '''
+    Сверяет sha256 и собирает куски в media_blobs на стороне БД: файл целиком
+    через функцию не проходит. Уже известное содержимое повторно не записывается.
+    Повторный finalize (ответ до клиента не дошёл) возвращает тот же результат
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        session = _lock_session(cur, upload_id)
+        if session['status'] == 'finalized':
+            conn.rollback()
+            if sha256 and sha256.lower() != session['sha256']:
+                raise ValueError('Upload was finalized with a different checksum')
+            return _finalized(session)
+        if session['status'] != 'open':
+            conn.rollback()
+            raise ValueError(f"Upload is {session['status']}")
+        if session['received_bytes'] != session['total_bytes']:
+            conn.rollback()
+            raise UploadConflict('Upload is incomplete', _position(session))
+        expected = (sha256 or session['sha256'] or '').lower()
+        if not expected:
+            conn.rollback()
+            raise ValueError('sha256 checksum is required to finalize')
+
+        assembled = f'''
+            SELECT string_agg(content, ''::bytea ORDER BY chunk_index) AS content
+            FROM {SCHEMA}.upload_chunks WHERE upload_id = %s
+        '''
+        cur.execute(f"SELECT encode(sha256(a.content), 'hex') AS sha256 FROM ({assembled}) a", (upload_id,))
+        actual = cur.fetchone()['sha256']
+        if actual != expected:
+            # Подтверждённые куски не совпали с файлом клиента — загрузку начинают заново
+            cur.execute(f'DELETE FROM {SCHEMA}.upload_sessions WHERE id = %s', (upload_id,))
+            conn.commit()
+            raise ValueError('Checksum mismatch, upload discarded')
+
+        cur.execute(f'''
+            SELECT substring(content from 1 for 16) AS head FROM {SCHEMA}.upload_chunks
+            WHERE upload_id = %s AND chunk_index = 0
+        ''', (upload_id,))
+        mime_type = detect_mime(bytes(cur.fetchone()['head']), session['content_type'])
+        claim_blob(cur, actual, f'''
+            INSERT INTO {SCHEMA}.media_blobs (sha256, content, byte_length, mime_type)
+            SELECT %s, a.content, %s, %s FROM ({assembled}) a
+        ''', (actual, session['total_bytes'], mime_type, upload_id))
+        point_media(conn, upload_id, session['content_type'], actual, session['total_bytes'], mime_type)
+        # Куски больше не нужны, сессия остаётся квитанцией для повторного finalize
+        cur.execute(f'DELETE FROM {SCHEMA}.upload_chunks WHERE upload_id = %s', (upload_id,))
+        cur.execute(f'''
+            UPDATE {SCHEMA}.upload_sessions SET status = 'finalized', sha256 = %s, updated_at = NOW()
+            WHERE id = %s
+            RETURNING *
+        ''', (actual, upload_id))
+        session = dict(cur.fetchone())
+    conn.commit()
+    return _finalized(session)
@@ -1,20 +1,104 @@
 '''
 Business: File upload to database storage (images, audio, documents)
-Args: event - dict with httpMethod, body (base64 file); context - object with request_id
-Returns: HTTP response with file ID for retrieval
+Args: event - dict with httpMethod, body (base64 file or chunk), action query parameter for chunked uploads; context - object with request_id
+Returns: HTTP response with file ID for retrieval; upload position for chunked uploads
 '''
 
+import base64
+import binascii
 import json
-import os
 import time
 import random
 import string
 from typing import Dict, Any
-import psycopg2
+from db import get_connection
+from media_store import decode_payload, save_media
+from chunked_upload import UploadConflict, finalize_upload, init_upload, put_chunk, upload_status
+from response import compressed
 
 def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    return get_connection()
 
+def json_response(status: int, body: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(body),
+        'isBase64Encoded': False
+    }
+
+def new_file_id() -> str:
+    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=7))
+    return f"{int(time.time() * 1000)}-{random_str}"
+
+def file_extension(filename: str) -> str:
+    return filename.split('.')[-1] if '.' in filename else 'bin'
+
+def read_chunk(event: Dict[str, Any]) -> bytes:
+    '''Кусок приходит сырыми байтами (isBase64Encoded) или JSON {"data": base64}'''
+    body = event.get('body') or ''
+    try:
+        if event.get('isBase64Encoded'):
+            return base64.b64decode(body)
+        return base64.b64decode(json.loads(body).get('data', ''))
+    except (binascii.Error, ValueError, AttributeError):
+        raise ValueError('Chunk data is not valid base64')
+
+def handle_chunked(event: Dict[str, Any], method: str, action: str, params: Dict[str, str]) -> Dict[str, Any]:
+    '''
+    POST ?action=init {filename, contentType, size, sha256} — открыть загрузку
+    PUT ?action=chunk&uploadId=&index=&offset= — очередной кусок
+    GET ?action=status&uploadId= — с какого куска продолжать после обрыва
+    POST ?action=finalize&uploadId= {sha256} — сверить хеш и собрать файл
+    '''
+    upload_id = params.get('uploadId', '')
+    conn = get_db_connection()
+    try:
+        if method == 'POST' and action == 'init':
+            body_data = json.loads(event.get('body') or '{}')
+            filename = body_data.get('filename')
+            if not filename:
+                return json_response(400, {'error': 'filename is required'})
+            result = init_upload(
+                conn, new_file_id(), filename,
+                body_data.get('contentType', 'application/octet-stream'),
+                int(body_data.get('size', 0)), body_data.get('sha256', '')
+            )
+            return json_response(201, result)
+        if not upload_id:
+            return json_response(400, {'error': 'uploadId is required'})
+        if method == 'PUT' and action == 'chunk':
+            result = put_chunk(conn, upload_id, int(params.get('index', -1)),
+                               int(params.get('offset', -1)), read_chunk(event))
+            return json_response(200, result)
+        if method == 'GET' and action == 'status':
+            return json_response(200, upload_status(conn, upload_id))
+        if method == 'POST' and action == 'finalize':
+            body_data = json.loads(event.get('body') or '{}')
+            result = finalize_upload(conn, upload_id, body_data.get('sha256', ''))
+            filename = f"{upload_id}.{file_extension(result['originalFilename'])}"
+            return json_response(200, {
+                'url': f"https://storage.poehali.dev/uploads/{filename}",
+                'filename': filename,
+                'fileId': upload_id,
+                'contentType': result['contentType'],
+                'sha256': result['sha256'],
+                'size': result['size']
+            })
+        return json_response(405, {'error': 'Method not allowed'})
+    except UploadConflict as e:
+        return json_response(409, {'error': str(e), **e.position})
+    except LookupError as e:
+        return json_response(404, {'error': str(e)})
+    except ValueError as e:
+        return json_response(400, {'error': str(e)})
+    finally:
+        conn.close()
+
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
     
@@ -23,7 +107,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
@@ -31,6 +115,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+    action = params.get('action')
+    if action:
+        return handle_chunked(event, method, action, params)
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -58,34 +147,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    file_extension = filename.split('.')[-1] if '.' in filename else 'bin'
-    random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=7))
-    unique_id = f"{int(time.time() * 1000)}-{random_str}"
+    try:
+        payload, mime_type = decode_payload(file_data, content_type)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    
+    extension = file_extension(filename)
+    unique_id = new_file_id()
     
     conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute('''
-                INSERT INTO t_p39135821_musician_site_projec.media_files (id, file_type, data)
-                VALUES (%s, %s, %s)
-            ''', (unique_id, content_type, file_data))
-            conn.commit()
-            
-            file_url = f"https://storage.poehali.dev/uploads/{unique_id}.{file_extension}"
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'url': file_url,
-                    'filename': f"{unique_id}.{file_extension}",
-                    'fileId': unique_id,
-                    'contentType': content_type
-                }),
-                'isBase64Encoded': False
-            }
+        save_media(conn, unique_id, content_type, payload, mime_type)
+        conn.commit()
+        
+        file_url = f"https://storage.poehali.dev/uploads/{unique_id}.{extension}"
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'url': file_url,
+                'filename': f"{unique_id}.{extension}",
+                'fileId': unique_id,
+                'contentType': content_type
+            }),
+            'isBase64Encoded': False
+        }
     finally:
         conn.close()
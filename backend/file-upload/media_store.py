@@ -0,0 +1,432 @@
+'''
+Business: Хранилище медиафайлов: media_files ссылается по sha256 на байты в media_blobs
+Args: conn — соединение с БД; id медиафайла; байты и MIME-тип при записи
+Returns: метаданные, байты целиком или диапазоном; отчёты конвертера и дедупликации
+'''
+
+import base64
+import binascii
+import hashlib
+import time
+from typing import Any, Dict, Optional, Tuple
+from psycopg2.extras import RealDictCursor
+
+SCHEMA = 't_p39135821_musician_site_projec'
+
+MAGIC_MIME_TYPES = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\xff\xfb', 'audio/mpeg'),
+    (b'\xff\xf3', 'audio/mpeg'),
+    (b'\xff\xf2', 'audio/mpeg'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+)
+
+
+def detect_mime(payload: bytes, file_type: str) -> str:
+    if file_type and '/' in file_type:
+        return file_type
+    for magic, mime in MAGIC_MIME_TYPES:
+        if payload.startswith(magic):
+            return mime
+    if payload[:4] == b'RIFF' and payload[8:12] == b'WEBP':
+        return 'image/webp'
+    if payload[:4] == b'RIFF' and payload[8:12] == b'WAVE':
+        return 'audio/wav'
+    return 'image/jpeg' if file_type == 'image' else 'audio/mpeg'
+
+
+def decode_payload(data: str, file_type: str) -> Tuple[bytes, str]:
+    '''Разбирает base64 или data:-URL от клиента в байты и MIME-тип'''
+    declared = ''
+    if data.startswith('data:'):
+        header, _, data = data.partition(',')
+        declared = header[len('data:'):].split(';')[0]
+    try:
+        payload = base64.b64decode(data, validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError('Media data is not valid base64')
+    return payload, declared or detect_mime(payload, file_type)
+
+
+def lock_blob(cur, content_hash: str) -> bool:
+    '''
+    Блокирует существующий блоб до конца транзакции. Сборщик берёт блобы через
+    FOR UPDATE SKIP LOCKED и не удалит этот, пока point_media не поднимет refcount
+    '''
+    cur.execute(f'SELECT 1 FROM {SCHEMA}.media_blobs WHERE sha256 = %s FOR KEY SHARE', (content_hash,))
+    return cur.fetchone() is not None
+
+
+def claim_blob(cur, content_hash: str, insert_sql: str, args: Tuple) -> bool:
+    '''
+    Блокирует уже сохранённое содержимое или записывает его запросом insert_sql
+    (INSERT INTO media_blobs ... без ON CONFLICT). True — если байты записаны сейчас
+    '''
+    for _ in range(3):
+        if lock_blob(cur, content_hash):
+            return False
+        cur.execute(f'{insert_sql} ON CONFLICT (sha256) DO NOTHING RETURNING sha256', args)
+        if cur.fetchone() is not None:
+            return True
+    raise Exception(f'Media blob {content_hash} is being swept concurrently, retry the write')
+
+
+def store_blob(conn, payload: bytes, mime_type: str) -> str:
+    '''
+    Кладёт байты в media_blobs и возвращает их sha256. Если такое содержимое
+    уже есть, байты в БД не отправляются вовсе
+    '''
+    content_hash = hashlib.sha256(payload).hexdigest()
+    with conn.cursor() as cur:
+        claim_blob(cur, content_hash, f'''
+            INSERT INTO {SCHEMA}.media_blobs (sha256, content, byte_length, mime_type)
+            VALUES (%s, %s, %s, %s)
+        ''', (content_hash, payload, len(payload), mime_type))
+    return content_hash
+
+
+def point_media(conn, media_id: str, file_type: str, content_hash: str, byte_length: int, mime_type: str) -> None:
+    '''Создаёт или перенаправляет запись media_files на блоб; refcount ведёт триггер'''
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.media_files (id, file_type, mime_type, content_hash, byte_length, content, data, created_at)
+            VALUES (%s, %s, %s, %s, %s, NULL, NULL, NOW())
+            ON CONFLICT (id) DO UPDATE
+            SET file_type = EXCLUDED.file_type, mime_type = EXCLUDED.mime_type,
+                content_hash = EXCLUDED.content_hash, byte_length = EXCLUDED.byte_length,
+                content = NULL, data = NULL
+        ''', (media_id, file_type, mime_type, content_hash, byte_length))
+
+
+def save_media(conn, media_id: str, file_type: str, payload: bytes, mime_type: str) -> str:
+    content_hash = store_blob(conn, payload, mime_type)
+    point_media(conn, media_id, file_type, content_hash, len(payload), mime_type)
+    return content_hash
+
+
+def promote_to_blob(conn, media_id: str, content_hash: str) -> bool:
+    '''
+    Переносит байты, записанные прямо в media_files.content, в media_blobs.
+    Возвращает False, если такое содержимое уже было и копия просто удалена
+    '''
+    with conn.cursor() as cur:
+        stored = claim_blob(cur, content_hash, f'''
+            INSERT INTO {SCHEMA}.media_blobs (sha256, content, byte_length, mime_type)
+            SELECT %s, content, byte_length, mime_type FROM {SCHEMA}.media_files
+            WHERE id = %s AND content IS NOT NULL
+        ''', (content_hash, media_id))
+        cur.execute(f'''
+            UPDATE {SCHEMA}.media_files SET content = NULL, content_hash = %s
+            WHERE id = %s AND content IS NOT NULL
+        ''', (content_hash, media_id))
+    return stored
+
+
+def save_media_reference(conn, media_id: str, file_type: str, url: str) -> None:
+    '''Запись без байтов: файл лежит во внешнем хранилище, в data — его URL'''
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.media_files (id, file_type, data, content, content_hash, byte_length, created_at)
+            VALUES (%s, %s, %s, NULL, NULL, NULL, NOW())
+            ON CONFLICT (id) DO UPDATE
+            SET file_type = EXCLUDED.file_type, data = EXCLUDED.data, content = NULL,
+                content_hash = NULL, byte_length = NULL
+        ''', (media_id, file_type, url))
+
+
+def get_media_meta(conn, media_id: str) -> Optional[Dict[str, Any]]:
+    '''Метаданные без чтения самого файла; для старых base64-записей — длина и паддинг'''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT id, file_type, mime_type, byte_length, created_at, content_hash,
+                   CASE WHEN data LIKE 'http%%' THEN data END AS url,
+                   CASE WHEN content IS NULL AND data LIKE 'data:%%' THEN position(',' in left(data, 256)) ELSE 0 END AS prefix_len,
+                   CASE WHEN content IS NULL THEN octet_length(data) END AS data_len,
+                   CASE WHEN content IS NULL THEN right(data, 2) END AS tail
+            FROM {SCHEMA}.media_files WHERE id = %s
+        ''', (media_id,))
+        meta = cur.fetchone()
+    if not meta:
+        return None
+    meta = dict(meta)
+    meta['legacy'] = meta['byte_length'] is None and not meta['url'] and not meta['content_hash']
+    if meta['legacy']:
+        b64_len = (meta['data_len'] or 0) - meta['prefix_len']
+        meta['byte_length'] = max(b64_len // 4 * 3 - (meta['tail'] or '').count('='), 0)
+    if not meta['mime_type']:
+        meta['mime_type'] = detect_mime(b'', meta['file_type'] or '')
+    return meta
+
+
+def read_media_range(conn, meta: Dict[str, Any], start: int, end: int) -> bytes:
+    '''Байты [start, end] включительно; из БД читается только нужное окно'''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if meta['content_hash']:
+            cur.execute(f'SELECT substring(content from %s for %s) AS chunk FROM {SCHEMA}.media_blobs WHERE sha256 = %s',
+                        (start + 1, end - start + 1, meta['content_hash']))
+            return bytes(cur.fetchone()['chunk'])
+        if not meta['legacy']:
+            cur.execute(f'SELECT substring(content from %s for %s) AS chunk FROM {SCHEMA}.media_files WHERE id = %s',
+                        (start + 1, end - start + 1, meta['id']))
+            return bytes(cur.fetchone()['chunk'])
+        # Каждые 3 байта — это 4 символа base64: читаем только выровненное окно
+        first_quantum = start // 3
+        last_quantum = end // 3
+        cur.execute(f'SELECT substring(data from %s for %s) AS chunk FROM {SCHEMA}.media_files WHERE id = %s',
+                    (meta['prefix_len'] + first_quantum * 4 + 1, (last_quantum - first_quantum + 1) * 4, meta['id']))
+        window = base64.b64decode(cur.fetchone()['chunk'])
+    offset = start - first_quantum * 3
+    return window[offset:offset + end - start + 1]
+
+
+def read_media(conn, media_id: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+    meta = get_media_meta(conn, media_id)
+    if not meta or meta['url'] or not meta['byte_length']:
+        return None
+    return read_media_range(conn, meta, 0, meta['byte_length'] - 1), meta
+
+
+def convert_legacy_media(conn, batch_size: int = 20, time_budget: float = 20.0,
+                         after: str = '') -> Dict[str, Any]:
+    '''
+    Переводит base64-записи в bytea порциями. Идёт по id, в памяти держит
+    только один файл; прерванный запуск продолжается с next_after
+    '''
+    started = time.monotonic()
+    converted = 0
+    converted_bytes = 0
+    failed = []
+    last_id = after
+    done = False
+
+    while time.monotonic() - started < time_budget:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id FROM {SCHEMA}.media_files
+                WHERE content IS NULL AND data IS NOT NULL AND data <> '' AND data NOT LIKE 'http%%'
+                  AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ''', (last_id, batch_size))
+            ids = [row['id'] for row in cur.fetchall()]
+        if not ids:
+            done = True
+            break
+
+        for media_id in ids:
+            if time.monotonic() - started >= time_budget:
+                break
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f'''
+                    SELECT data, file_type FROM {SCHEMA}.media_files
+                    WHERE id = %s AND content IS NULL AND content_hash IS NULL
+                ''', (media_id,))
+                row = cur.fetchone()
+                if row:
+                    try:
+                        payload, mime_type = decode_payload(row['data'], row['file_type'] or '')
+                        save_media(conn, media_id, row['file_type'], payload, mime_type)
+                        conn.commit()
+                        converted += 1
+                        converted_bytes += len(payload)
+                    except ValueError as e:
+                        conn.rollback()
+                        failed.append({'id': media_id, 'error': str(e)})
+            last_id = media_id
+
+    elapsed = time.monotonic() - started
+    return {
+        'converted': converted,
+        'converted_bytes': converted_bytes,
+        'failed': len(failed),
+        'failed_files': failed,
+        'next_after': last_id,
+        'done': done,
+        'elapsed_seconds': round(elapsed, 3)
+    }
+
+
+def dedupe_media(conn, batch_size: int = 20, time_budget: float = 20.0,
+                 after: str = '', dry_run: bool = False) -> Dict[str, Any]:
+    '''
+    Переводит записи с байтами в media_files.content в media_blobs. Хеш
+    считает сама БД, так что байты не покидают её. С dry_run только оценивает,
+    сколько байт освободится
+    '''
+    started = time.monotonic()
+    if dry_run:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT COALESCE(SUM(g.files), 0) AS files,
+                       COALESCE(SUM(g.files * g.bytes), 0) AS bytes,
+                       COUNT(*) AS distinct_payloads,
+                       COALESCE(SUM(CASE WHEN b.sha256 IS NULL THEN g.files - 1 ELSE g.files END * g.bytes), 0) AS reclaimable_bytes
+                FROM (
+                    SELECT encode(sha256(content), 'hex') AS sha256, COUNT(*) AS files, MAX(byte_length) AS bytes
+                    FROM {SCHEMA}.media_files
+                    WHERE content IS NOT NULL
+                    GROUP BY 1
+                ) g
+                LEFT JOIN {SCHEMA}.media_blobs b ON b.sha256 = g.sha256
+            ''')
+            report = {k: int(v) for k, v in cur.fetchone().items()}
+            cur.execute(f'''
+                SELECT COALESCE(SUM(m.byte_length), 0) AS referenced_bytes,
+                       (SELECT COALESCE(SUM(byte_length), 0) FROM {SCHEMA}.media_blobs) AS stored_bytes
+                FROM {SCHEMA}.media_files m
+                WHERE m.content_hash IS NOT NULL
+            ''')
+            report.update({k: int(v) for k, v in cur.fetchone().items()})
+        conn.rollback()
+        return {**report, 'dry_run': True, 'elapsed_seconds': round(time.monotonic() - started, 3)}
+
+    moved = 0
+    duplicates = 0
+    reclaimed = 0
+    last_id = after
+    done = False
+    while time.monotonic() - started < time_budget:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT id FROM {SCHEMA}.media_files
+                WHERE content IS NOT NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+            ''', (last_id, batch_size))
+            ids = [row['id'] for row in cur.fetchall()]
+        if not ids:
+            done = True
+            break
+        for media_id in ids:
+            if time.monotonic() - started >= time_budget:
+                break
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f'''
+                    SELECT encode(sha256(content), 'hex') AS sha256, byte_length
+                    FROM {SCHEMA}.media_files
+                    WHERE id = %s AND content IS NOT NULL
+                    FOR UPDATE
+                ''', (media_id,))
+                row = cur.fetchone()
+            if row:
+                if not promote_to_blob(conn, media_id, row['sha256']):
+                    duplicates += 1
+                    reclaimed += row['byte_length'] or 0
+                conn.commit()
+                moved += 1
+            last_id = media_id
+
+    return {
+        'moved': moved,
+        'duplicates': duplicates,
+        'bytes_reclaimed': reclaimed,
+        'next_after': last_id,
+        'done': done,
+        'dry_run': False,
+        'elapsed_seconds': round(time.monotonic() - started, 3)
+    }
+
+
+# Медиафайл нужен, пока на него ссылается трек, альбом (в том числе из кабинета
+# артиста в user-music), аватар пользователя или баннер профиля
+ORPHAN_CONDITION = f'''
+    NOT EXISTS (SELECT 1 FROM {SCHEMA}.tracks t WHERE {SCHEMA}.media_ref_id(t.file) = m.id)
+    AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.tracks t WHERE {SCHEMA}.media_ref_id(t.cover) = m.id)
+    AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.albums a WHERE {SCHEMA}.media_ref_id(a.cover) = m.id)
+    AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.users u WHERE {SCHEMA}.media_ref_id(u.avatar_url) = m.id)
+    AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.artist_profiles p WHERE {SCHEMA}.media_ref_id(p.banner_url) = m.id)
+'''
+
+
+def collect_orphan_media(conn, batch_size: int = 200, time_budget: float = 20.0, after: str = '',
+                         dry_run: bool = False, grace_seconds: int = 86400) -> Dict[str, Any]:
+    '''
+    Удаляет аудио и картинки, на которые ничего не ссылается, пачками по id
+    с коммитом после каждой — блокировки короткие, прерванный запуск
+    продолжается с next_after. Свежие файлы младше grace_seconds не трогаются:
+    загрузка могла ещё не дойти до сохранения трека
+    '''
+    started = time.monotonic()
+    stats = {'audio': 0, 'image': 0, 'bytes': 0, 'scanned': 0}
+    last_id = after
+    done = False
+
+    while time.monotonic() - started < time_budget:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f'''
+                SELECT m.id FROM {SCHEMA}.media_files m
+                WHERE m.id > %s
+                ORDER BY m.id
+                LIMIT %s
+            ''', (last_id, batch_size))
+            ids = [row['id'] for row in cur.fetchall()]
+            if not ids:
+                done = True
+                break
+            candidates = f'''
+                m.id = ANY(%s)
+                AND (m.file_type LIKE 'audio%%' OR m.file_type LIKE 'image%%')
+                AND m.created_at < NOW() - make_interval(secs => %s)
+                AND {ORPHAN_CONDITION}
+            '''
+            columns = "m.id, m.file_type, COALESCE(m.byte_length, octet_length(m.data), 0) AS bytes"
+            if dry_run:
+                cur.execute(f'SELECT {columns} FROM {SCHEMA}.media_files m WHERE {candidates}', (ids, grace_seconds))
+            else:
+                cur.execute(f'DELETE FROM {SCHEMA}.media_files m WHERE {candidates} RETURNING {columns}', (ids, grace_seconds))
+            orphans = cur.fetchall()
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        for orphan in orphans:
+            stats['audio' if orphan['file_type'].startswith('audio') else 'image'] += 1
+            stats['bytes'] += int(orphan['bytes'])
+        stats['scanned'] += len(ids)
+        last_id = ids[-1]
+
+    swept = {'blobs': 0, 'bytes': 0}
+    if not dry_run:
+        # Удалённые записи уменьшили refcount своих блобов; байты уходят вместе с последней ссылкой
+        swept = sweep_unreferenced_blobs(conn)
+        conn.commit()
+    return {
+        'orphans_audio': stats['audio'],
+        'orphans_image': stats['image'],
+        'orphan_bytes': stats['bytes'],
+        'scanned': stats['scanned'],
+        'blobs_deleted': swept['blobs'],
+        'bytes_reclaimed': swept['bytes'],
+        'next_after': last_id,
+        'done': done,
+        'dry_run': dry_run,
+        'elapsed_seconds': round(time.monotonic() - started, 3)
+    }
+
+
+def sweep_unreferenced_blobs(conn, limit: int = 500) -> Dict[str, int]:
+    '''
+    Удаляет блобы с нулевым refcount. Блобы, которые пишущая транзакция держит
+    через lock_blob, пропускаются (SKIP LOCKED); NOT EXISTS — страховка от рассинхрона refcount
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            WITH swept AS (
+                DELETE FROM {SCHEMA}.media_blobs b
+                WHERE b.sha256 IN (
+                    SELECT sha256 FROM {SCHEMA}.media_blobs
+                    WHERE refcount <= 0
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                AND NOT EXISTS (SELECT 1 FROM {SCHEMA}.media_files m WHERE m.content_hash = b.sha256)
+                RETURNING byte_length
+            )
+            SELECT COUNT(*) AS blobs, COALESCE(SUM(byte_length), 0) AS bytes FROM swept
+        ''', (limit,))
+        row = cur.fetchone()
+    return {'blobs': int(row['blobs']), 'bytes': int(row['bytes'])}
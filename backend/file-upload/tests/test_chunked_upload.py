@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import json
+import os
+
+import pytest
+
+import chunked_upload
+import index
+from db import get_connection
+from media_store import SCHEMA, read_media
+
+CHUNK = 1024
+
+
+@pytest.fixture
+def upload(monkeypatch, database_url):
+    '''Файл в 3,5 куска и открытая под него загрузка'''
+    monkeypatch.setattr(chunked_upload, 'UPLOAD_CHUNK_BYTES', CHUNK)
+    payload = b'ID3' + os.urandom(CHUNK * 3 + CHUNK // 2 - 3)
+    response = call('POST', 'init', body={'filename': 'track.mp3', 'contentType': 'audio/mpeg',
+                                          'size': len(payload), 'sha256': hashlib.sha256(payload).hexdigest()})
+    assert response['statusCode'] == 201
+    upload_id = json.loads(response['body'])['uploadId']
+    yield upload_id, payload
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.upload_sessions WHERE id = %s', (upload_id,))
+        cur.execute(f'DELETE FROM {SCHEMA}.media_files WHERE id = %s', (upload_id,))
+    conn.commit()
+    conn.close()
+
+
+def call(method, action, upload_id=None, body=None, raw=None, **params):
+    query = {'action': action, **{k: str(v) for k, v in params.items()}}
+    if upload_id:
+        query['uploadId'] = upload_id
+    event = {'httpMethod': method, 'queryStringParameters': query, 'headers': {}}
+    if raw is not None:
+        event.update(body=base64.b64encode(raw).decode('ascii'), isBase64Encoded=True)
+    else:
+        event['body'] = json.dumps(body or {})
+    return index.handler(event, None)
+
+
+def put(upload_id, payload, number):
+    start = number * CHUNK
+    return call('PUT', 'chunk', upload_id, raw=payload[start:start + CHUNK], index=number, offset=start)
+
+
+def status(upload_id):
+    response = call('GET', 'status', upload_id)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_interrupted_upload_resumes_and_finalize_is_idempotent(upload):
+    upload_id, payload = upload
+    for number in (0, 1):
+        assert put(upload_id, payload, number)['statusCode'] == 200
+
+    # Обрыв: клиент спрашивает, с чего продолжить
+    position = status(upload_id)
+    assert position['receivedChunks'] == [0, 1]
+    assert (position['nextChunk'], position['nextOffset']) == (2, 2 * CHUNK)
+    assert position['complete'] is False
+
+    for number in range(position['nextChunk'], 4):
+        assert put(upload_id, payload, number)['statusCode'] == 200
+    assert status(upload_id)['complete'] is True
+
+    first = call('POST', 'finalize', upload_id)
+    assert first['statusCode'] == 200
+    result = json.loads(first['body'])
+    assert result['fileId'] == upload_id
+    assert result['sha256'] == hashlib.sha256(payload).hexdigest()
+    assert result['size'] == len(payload)
+
+    # Ответ на finalize потерялся — повтор получает тот же результат, а не 404
+    second = call('POST', 'finalize', upload_id, body={'sha256': result['sha256']})
+    assert second['statusCode'] == 200
+    assert json.loads(second['body']) == result
+    assert status(upload_id)['finalized'] is True
+
+    conn = get_connection()
+    try:
+        stored, meta = read_media(conn, upload_id)
+        assert stored == payload
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.upload_chunks WHERE upload_id = %s', (upload_id,))
+            assert cur.fetchone()[0] == 0
+            cur.execute(f'SELECT refcount FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (result['sha256'],))
+            assert cur.fetchone()[0] == 1
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_duplicate_chunk_is_acknowledged_without_rewrite(upload):
+    upload_id, payload = upload
+    assert put(upload_id, payload, 0)['statusCode'] == 200
+    retry = put(upload_id, payload, 0)
+
+    assert retry['statusCode'] == 200
+    assert json.loads(retry['body'])['nextChunk'] == 1
+    assert status(upload_id)['receivedChunks'] == [0]
+
+
+def test_out_of_order_chunk_gets_resume_position(upload):
+    upload_id, payload = upload
+    assert put(upload_id, payload, 0)['statusCode'] == 200
+    skipped = put(upload_id, payload, 2)
+
+    assert skipped['statusCode'] == 409
+    body = json.loads(skipped['body'])
+    assert (body['nextChunk'], body['nextOffset']) == (1, CHUNK)
+    assert status(upload_id)['receivedChunks'] == [0]
+
+    # Тот же номер, но другое смещение — тоже конфликт, а не запись не на своё место
+    shifted = call('PUT', 'chunk', upload_id, raw=payload[CHUNK + 1:2 * CHUNK + 1], index=1, offset=CHUNK + 1)
+    assert shifted['statusCode'] == 409
+
+
+def test_finalize_rejects_incomplete_and_mismatched_uploads(upload):
+    upload_id, payload = upload
+    assert put(upload_id, payload, 0)['statusCode'] == 200
+    incomplete = call('POST', 'finalize', upload_id)
+    assert incomplete['statusCode'] == 409
+    assert json.loads(incomplete['body'])['nextChunk'] == 1
+
+    for number in range(1, 4):
+        put(upload_id, payload, number)
+    mismatch = call('POST', 'finalize', upload_id, body={'sha256': hashlib.sha256(b'other').hexdigest()})
+    assert mismatch['statusCode'] == 400
+    assert call('GET', 'status', upload_id)['statusCode'] == 404
@@ -0,0 +1,185 @@
+'''
+Business: Каталог для Telegram-бота: лёгкая выборка альбомов, готовые страницы и карточки в кеше
+Args: cursor — курсор БД (RealDictCursor); version — версия каталога; TELEGRAM_CATALOG_* из окружения
+Returns: страница каталога, карточка альбома и данные для заказа трека или альбома
+'''
+
+import html
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = 't_p39135821_musician_site_projec'
+TELEGRAM_CATALOG_PAGE_SIZE = int(os.environ.get('TELEGRAM_CATALOG_PAGE_SIZE', '8'))
+# Лимит Telegram — 4096 символов на сообщение; запас на заголовок страницы
+TELEGRAM_MESSAGE_BUDGET = 3800
+
+Page = Tuple[str, Optional[Dict[str, Any]]]
+
+_lock = threading.Lock()
+# Всё собранное относится к одной версии каталога: запись в каталог меняет версию,
+# и при следующем обращении кеш строится заново
+_cache: Dict[str, Any] = {'version': None, 'albums': None, 'pages': None, 'cards': {}, 'tracks': {}}
+_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+def _current(version: int) -> Dict[str, Any]:
+    with _lock:
+        if _cache['version'] != version:
+            if _cache['version'] is not None:
+                _stats['invalidations'] += 1
+            _cache.update({'version': version, 'albums': None, 'pages': None, 'cards': {}, 'tracks': {}})
+        return _cache
+
+
+def _count(hit: bool) -> None:
+    with _lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+
+def catalog_albums(cursor, version: int) -> Dict[str, Dict[str, Any]]:
+    '''Только то, что бот показывает: без описаний, обложек и списков треков'''
+    cache = _current(version)
+    albums = cache['albums']
+    _count(albums is not None)
+    if albums is None:
+        cursor.execute(f'''
+            SELECT a.id, a.title, a.artist, a.price,
+                   (SELECT COUNT(*) FROM {SCHEMA}.tracks t WHERE t.album_id = a.id) AS tracks_count
+            FROM {SCHEMA}.albums a
+            ORDER BY a.created_at DESC, a.id DESC
+        ''')
+        albums = {row['id']: dict(row) for row in cursor.fetchall()}
+        cache['albums'] = albums
+    return albums
+
+
+def _render_pages(albums: List[Dict[str, Any]]) -> List[Page]:
+    '''Страницы не длиннее TELEGRAM_CATALOG_PAGE_SIZE альбомов и лимита длины сообщения'''
+    chunks: List[List[Tuple[Dict[str, Any], str]]] = [[]]
+    size = 0
+    for album in albums:
+        entry = (f'🎼 <b>{html.escape(album["title"])}</b>\n'
+                 f'👤 {html.escape(album["artist"])}\n'
+                 f'💿 Треков: {album["tracks_count"]}\n'
+                 f'💰 {album["price"]} ₽\n\n')
+        if chunks[-1] and (len(chunks[-1]) >= TELEGRAM_CATALOG_PAGE_SIZE or size + len(entry) > TELEGRAM_MESSAGE_BUDGET):
+            chunks.append([])
+            size = 0
+        chunks[-1].append((album, entry))
+        size += len(entry)
+
+    pages: List[Page] = []
+    for number, chunk in enumerate(chunks):
+        title = '<b>🎵 Каталог альбомов</b>'
+        if len(chunks) > 1:
+            title += f' ({number + 1}/{len(chunks)})'
+        keyboard = [[{'text': f'🎧 {album["title"]}', 'callback_data': f'album_{album["id"]}'}]
+                    for album, _ in chunk]
+        navigation = []
+        if number > 0:
+            navigation.append({'text': '« Назад', 'callback_data': f'catalog_{number - 1}'})
+        if number < len(chunks) - 1:
+            navigation.append({'text': 'Вперёд »', 'callback_data': f'catalog_{number + 1}'})
+        if navigation:
+            keyboard.append(navigation)
+        pages.append((title + '\n\n' + ''.join(entry for _, entry in chunk), {'inline_keyboard': keyboard}))
+    return pages
+
+
+def catalog_page(cursor, version: int, page: int = 0) -> Tuple[Page, int]:
+    '''Готовая страница (текст, клавиатура) и её номер после ограничения диапазоном'''
+    cache = _current(version)
+    pages = cache['pages']
+    if pages is None:
+        albums = list(catalog_albums(cursor, version).values())
+        pages = _render_pages(albums) if albums else [('📁 Каталог пуст', None)]
+        cache['pages'] = pages
+    else:
+        _count(True)
+    page = min(max(page, 0), len(pages) - 1)
+    return pages[page], page
+
+
+def album_card(cursor, version: int, album_id: str) -> Optional[Page]:
+    '''Карточка альбома с треками и кнопками покупки'''
+    cache = _current(version)
+    card = cache['cards'].get(album_id)
+    _count(card is not None)
+    if card is not None:
+        return card
+    cursor.execute(f'''
+        SELECT a.title, a.artist, a.price, a.description,
+               t.id AS track_id, t.title AS track_title, t.duration, t.price AS track_price
+        FROM {SCHEMA}.albums a
+        LEFT JOIN {SCHEMA}.tracks t ON t.album_id = a.id
+        WHERE a.id = %s
+        ORDER BY COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id
+    ''', (album_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    album = rows[0]
+
+    msg = f'🎼 <b>{html.escape(album["title"])}</b>\n'
+    msg += f'👤 {html.escape(album["artist"])}\n'
+    msg += f'💰 Цена альбома: {album["price"]} ₽\n\n'
+    if album['description']:
+        msg += f'📝 {html.escape(album["description"])}\n\n'
+    msg += '<b>Треки:</b>\n'
+    keyboard: Dict[str, Any] = {'inline_keyboard': []}
+    for idx, row in enumerate((row for row in rows if row['track_id']), 1):
+        line = f'{idx}. {html.escape(row["track_title"])} - {row["duration"]} ({row["track_price"]} ₽)\n'
+        if len(msg) + len(line) <= TELEGRAM_MESSAGE_BUDGET:
+            msg += line
+        keyboard['inline_keyboard'].append([
+            {'text': f'🎵 Купить "{row["track_title"]}"', 'callback_data': f'buy_track_{row["track_id"]}'}
+        ])
+        cache['tracks'][row['track_id']] = {
+            'id': row['track_id'], 'title': row['track_title'],
+            'price': row['track_price'], 'album_title': album['title']
+        }
+    keyboard['inline_keyboard'].append([
+        {'text': f'💿 Купить весь альбом ({album["price"]} ₽)', 'callback_data': f'buy_album_{album_id}'}
+    ])
+    keyboard['inline_keyboard'].append([
+        {'text': '« Назад к каталогу', 'callback_data': 'catalog'}
+    ])
+    card = (msg, keyboard)
+    cache['cards'][album_id] = card
+    return card
+
+
+def track_offer(cursor, version: int, track_id: str) -> Optional[Dict[str, Any]]:
+    '''Трек для заказа: id, название, цена и альбом'''
+    cache = _current(version)
+    track = cache['tracks'].get(track_id)
+    _count(track is not None)
+    if track is None:
+        cursor.execute(f'''
+            SELECT t.id, t.title, t.price, a.title AS album_title
+            FROM {SCHEMA}.tracks t JOIN {SCHEMA}.albums a ON t.album_id = a.id
+            WHERE t.id = %s
+        ''', (track_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        track = dict(row)
+        cache['tracks'][track_id] = track
+    return track
+
+
+def album_offer(cursor, version: int, album_id: str) -> Optional[Dict[str, Any]]:
+    '''Альбом для заказа из той же выборки, что и страницы каталога'''
+    return catalog_albums(cursor, version).get(album_id)
+
+
+def bot_catalog_stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            **_stats,
+            'version': _cache['version'],
+            'pages': len(_cache['pages']) if _cache['pages'] is not None else None,
+            'cards': len(_cache['cards']),
+            'tracks': len(_cache['tracks'])
+        }
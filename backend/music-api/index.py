@@ -7,40 +7,143 @@ Returns: HTTP response dict с альбомами, треками, статис
 
 import json
 import os
-from typing import Dict, Any, List, Optional
-import psycopg2
+import time
+import base64
+import hashlib
+import html
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
+from db import get_connection, pool_stats
+from play_counter import counter_stats, flush_events, get_live_counts, record_event
+from response import compressed, compression_stats
+from media_ingest import ingest_url_to_db, ingest_url_to_s3
+from s3_migration import S3_MIGRATE_BATCH, S3_MIGRATE_WORKERS, migrate_audio, reset_checkpoint
+from telegram_queue import (
+    TELEGRAM_WORKER_BUDGET, drain_inline, enqueue_call, enqueue_message, queue_stats, receive_update, run_worker
+)
+from bot_catalog import album_card, album_offer, bot_catalog_stats, catalog_page, track_offer
+from order_notifications import (
+    dispatch_order_notifications, enqueue_order_notification, new_order_id, render_order
+)
+from media_store import (
+    collect_orphan_media, convert_legacy_media, decode_payload, dedupe_media, get_media_meta,
+    read_media, read_media_range, save_media, save_media_reference
+)
+
+CATALOG_CACHE_PATHS = ('albums', 'tracks', 'stats', '')
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '60'))
+CATALOG_CACHE_MAX_ENTRIES = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', '64'))
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', '5'))
+CATALOG_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+PAGE_MAX_LIMIT = 100
+# Ключи keyset-пагинации допускают NULL в track_order и created_at: и в ORDER BY,
+# и в условии курсора, и в индексах V0056 они берутся через COALESCE с этими значениями
+PAGE_NULL_ORDER = 0
+PAGE_NULL_TIME = datetime(1970, 1, 1)
+# Максимальный размер ответа track-stream на запрос с Range и окно чтения из БД для
+# запроса без Range: перемотка и докачка стоят памяти на кусок, а не на весь трек
+TRACK_STREAM_CHUNK_BYTES = int(os.environ.get('TRACK_STREAM_CHUNK_BYTES', str(1024 * 1024)))
+
+# Кеш живёт в модуле и переживает тёплые вызовы функции:
+# ключ -> (версия каталога, время истечения, готовое JSON-тело, ETag)
+_catalog_cache: 'OrderedDict[Tuple, Tuple[int, float, str, str]]' = OrderedDict()
+_catalog_version: Dict[str, Any] = {'value': None, 'checked_at': 0.0}
+_catalog_cache_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
 
 def get_db_connection():
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        raise Exception('DATABASE_URL not found')
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+    return get_connection(cursor_factory=RealDictCursor)
 
-def upload_to_s3(file_content: bytes, key: str, content_type: str) -> str:
-    import boto3
-    
-    s3 = boto3.client('s3',
-        endpoint_url='https://bucket.poehali.dev',
-        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-    )
-    
-    s3.put_object(
-        Bucket='files',
-        Key=key,
-        Body=file_content,
-        ContentType=content_type,
-        CacheControl='public, max-age=31536000',
-        Metadata={
-            'Access-Control-Allow-Origin': '*'
-        }
-    )
-    
-    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-    return cdn_url
+def catalog_cache_key(path: str, params: Dict[str, Any]) -> Tuple:
+    return (path,) + tuple(sorted((k, str(v)) for k, v in params.items() if k != 'path'))
+
+def known_catalog_version() -> Optional[int]:
+    if _catalog_version['value'] is None:
+        return None
+    if time.monotonic() - _catalog_version['checked_at'] >= CATALOG_VERSION_CHECK_INTERVAL:
+        return None
+    return _catalog_version['value']
+
+def get_catalog_version(cursor) -> int:
+    version = known_catalog_version()
+    if version is not None:
+        return version
+    cursor.execute('SELECT version FROM catalog_version WHERE id = 1')
+    row = cursor.fetchone()
+    _catalog_version['value'] = row['version'] if row else 0
+    _catalog_version['checked_at'] = time.monotonic()
+    return _catalog_version['value']
+
+def bump_catalog_version(cursor) -> None:
+    # Вызывается до commit() самой записи, чтобы версия менялась атомарно с каталогом
+    cursor.execute('''
+        INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE SET version = catalog_version.version + 1, updated_at = NOW()
+    ''')
+
+def invalidate_catalog_cache() -> None:
+    # Версию перечитаем из БД при следующем GET: локально её значение после записи неизвестно
+    _catalog_version['value'] = None
+    _catalog_version['checked_at'] = 0.0
+    _catalog_cache.clear()
+
+def catalog_cache_get(key: Tuple, version: int) -> Optional[Tuple[str, str]]:
+    entry = _catalog_cache.get(key)
+    if entry and entry[0] == version and entry[1] > time.monotonic():
+        _catalog_cache.move_to_end(key)
+        _catalog_cache_stats['hits'] += 1
+        return entry[2], entry[3]
+    if entry:
+        del _catalog_cache[key]
+    _catalog_cache_stats['misses'] += 1
+    return None
 
+def catalog_cache_put(key: Tuple, version: int, body: str, etag: str) -> None:
+    _catalog_cache[key] = (version, time.monotonic() + CATALOG_CACHE_TTL, body, etag)
+    _catalog_cache.move_to_end(key)
+    while len(_catalog_cache) > CATALOG_CACHE_MAX_ENTRIES:
+        _catalog_cache.popitem(last=False)
+        _catalog_cache_stats['evictions'] += 1
+
+def get_catalog_cache_stats() -> Dict[str, Any]:
+    lookups = _catalog_cache_stats['hits'] + _catalog_cache_stats['misses']
+    return {
+        **_catalog_cache_stats,
+        'hit_ratio': round(_catalog_cache_stats['hits'] / lookups, 4) if lookups else 0.0,
+        'entries': len(_catalog_cache),
+        'version': _catalog_version['value'],
+        'ttl_seconds': CATALOG_CACHE_TTL
+    }
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
+
+def catalog_response(body: str, etag: str, if_none_match: Optional[str], cache_status: str) -> Dict[str, Any]:
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, X-Cache',
+        'Cache-Control': CATALOG_CACHE_CONTROL,
+        'ETag': etag,
+        'X-Cache': cache_status
+    }
+    if etag_matches(if_none_match, etag):
+        return {'statusCode': 304, 'headers': headers, 'isBase64Encoded': False, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': False, 'body': body}
+
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -50,20 +153,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Range, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'isBase64Encoded': False,
             'body': ''
         }
     
-    path = (event.get('queryStringParameters') or {}).get('path', '')
+    query_params = event.get('queryStringParameters') or {}
+    path = query_params.get('path', '')
     print(f'[DEBUG] Method: {method}, Path: {path}')
     
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if_none_match = request_headers.get('if-none-match')
+    
+    cache_key = catalog_cache_key(path, query_params) if method == 'GET' and path in CATALOG_CACHE_PATHS else None
+    if cache_key:
+        version = known_catalog_version()
+        cached = catalog_cache_get(cache_key, version) if version is not None else None
+        if cached is not None:
+            return catalog_response(cached[0], cached[1], if_none_match, 'HIT')
+    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        if cache_key:
+            version = get_catalog_version(cursor)
+            cached = catalog_cache_get(cache_key, version)
+            if cached is not None:
+                cursor.close()
+                conn.close()
+                return catalog_response(cached[0], cached[1], if_none_match, 'HIT')
+        
         if path.startswith('blog/'):
             result = handle_blog(cursor, conn, event, method, path)
             cursor.close()
@@ -79,11 +201,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         if path == 'telegram' and method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            print(f'[DEBUG] Telegram webhook: {json.dumps(body)}')
-            result = handle_telegram_webhook(cursor, conn, body)
+            body = json.loads(event.get('body') or '{}')
+            print(f'[DEBUG] Telegram webhook: update {body.get("update_id")}')
+            # Обновление сначала сохраняется (повтор от Telegram отсеется по update_id),
+            # затем очередь разбирается не дольше TELEGRAM_INLINE_BUDGET и Telegram
+            # получает ответ: медленный Bot API не задерживает подтверждение дольше бюджета
+            try:
+                accepted = receive_update(conn, body)
+            except ValueError as e:
+                print(f'[WARN] Telegram webhook ignored: {e}')
+                accepted = False
             cursor.close()
             conn.close()
+            if accepted:
+                drain_inline(handle_telegram_webhook, dispatch_order_notifications)
             return {
                 'statusCode': 200,
                 'headers': {
@@ -91,12 +222,70 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Access-Control-Allow-Origin': '*'
                 },
                 'isBase64Encoded': False,
-                'body': json.dumps(result)
+                'body': json.dumps({'ok': True})
             }
         
         if method == 'GET':
-            if path == 'migrate-to-s3':
-                result = migrate_audio_to_s3(cursor, conn)
+            if path == 'telegram-worker':
+                # Вызывается планировщиком раз в минуту: досылает отложенные сообщения,
+                # повторы и дайджесты заказов, которые не уложились в разбор внутри вебхука
+                cursor.close()
+                conn.close()
+                result = run_worker(handle_telegram_webhook,
+                                    time_budget=min(float(query_params.get('budget', TELEGRAM_WORKER_BUDGET)), 25),
+                                    dispatch=dispatch_order_notifications)
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps(result, default=str)
+                }
+            elif path == 'migrate-to-s3':
+                if query_params.get('reset') == '1':
+                    reset_checkpoint(conn, 'audio')
+                result = migrate_audio(
+                    conn,
+                    workers=int(query_params.get('workers', S3_MIGRATE_WORKERS)),
+                    batch_size=min(int(query_params.get('batch', S3_MIGRATE_BATCH)), 100)
+                )
+                cursor.close()
+                conn.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps(result, default=str)
+                }
+            elif path == 'convert-media':
+                result = convert_legacy_media(
+                    conn,
+                    batch_size=min(int(query_params.get('batch', 20)), 100),
+                    after=query_params.get('after', '')
+                )
+                cursor.close()
+                conn.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps(result, default=str)
+                }
+            elif path == 'media-dedup':
+                result = dedupe_media(
+                    conn,
+                    batch_size=min(int(query_params.get('batch', 20)), 100),
+                    after=query_params.get('after', ''),
+                    dry_run=query_params.get('dry_run') == '1'
+                )
                 cursor.close()
                 conn.close()
                 return {
@@ -121,6 +310,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False,
                     'body': json.dumps(result, default=str)
                 }
+            elif path in ('albums', 'tracks') and 'cursor' in query_params:
+                # Постраничный режим: {items, next_cursor}; без cursor — прежний массив
+                album_id = query_params.get('album_id') if path == 'tracks' else None
+                try:
+                    after = decode_page_cursor(query_params.get('cursor'), 3 if album_id else 2)
+                    limit = parse_page_limit(query_params.get('limit'), 50 if album_id else 100)
+                except ValueError as e:
+                    cursor.close()
+                    conn.close()
+                    return error_response(str(e), 400)
+                if path == 'albums':
+                    items, next_cursor = get_albums_page(cursor, after, limit)
+                else:
+                    items, next_cursor = get_tracks_page(cursor, album_id, after, limit)
+                result = {'items': items, 'next_cursor': next_cursor}
             elif path == 'albums':
                 result = get_albums(cursor)
             elif path == 'tracks':
@@ -149,62 +353,37 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 media_file_id = file_key
                 if not file_key.startswith('audio_'):
-                    safe_track_id = file_key.replace("'", "''")
-                    cursor.execute(f"SELECT file FROM tracks WHERE id = '{safe_track_id}'")
+                    cursor.execute('SELECT file FROM tracks WHERE id = %s', (file_key,))
                     track_result = cursor.fetchone()
                     if not track_result or not track_result.get('file'):
                         return error_response('Track not found', 404)
                     media_file_id = track_result['file']
                 
-                safe_key = media_file_id.replace("'", "''")
-                cursor.execute(f"SELECT data, file_type FROM media_files WHERE id = '{safe_key}'")
-                result = cursor.fetchone()
-                
-                if not result or not result.get('data'):
-                    return error_response('Audio file not found', 404)
-                
-                audio_data = result['data']
-                
-                if audio_data.startswith('https://cdn.poehali.dev/'):
-                    cursor.close()
-                    conn.close()
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'isBase64Encoded': False,
-                        'body': json.dumps({'url': audio_data, 'type': 'redirect'})
-                    }
-                
-                if audio_data.startswith('data:audio/'):
-                    audio_data = audio_data.split(',', 1)[1]
-                
+                response = stream_media_file(conn, media_file_id, request_headers.get('range'))
                 cursor.close()
                 conn.close()
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'audio/mpeg',
-                        'Access-Control-Allow-Origin': '*',
-                        'Cache-Control': 'public, max-age=31536000'
-                    },
-                    'isBase64Encoded': True,
-                    'body': audio_data
-                }
+                return response
             elif path == 'stats':
                 track_id = event.get('queryStringParameters', {}).get('track_id')
                 result = get_stats(cursor, track_id)
+            elif path == 'cache-stats':
+                result = {
+                    **get_catalog_cache_stats(),
+                    'db_pool': pool_stats(),
+                    'play_counter': counter_stats(),
+                    'compression': compression_stats(),
+                    'telegram': queue_stats(),
+                    'bot_catalog': bot_catalog_stats()
+                }
             elif path == 'tracks/top':
                 username = event.get('queryStringParameters', {}).get('username')
-                limit = int(event.get('queryStringParameters', {}).get('limit', 5))
+                limit = min(int(event.get('queryStringParameters', {}).get('limit', 5)), PAGE_MAX_LIMIT)
                 result = get_top_tracks(cursor, username, limit)
             elif path == 'media':
                 media_id = event.get('queryStringParameters', {}).get('id')
                 if not media_id:
                     return error_response('Media ID is required', 400)
-                result = get_media_file(cursor, media_id)
+                result = get_media_file(conn, media_id)
                 if not result:
                     return error_response('Media file not found', 404)
                 return {
@@ -219,15 +398,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             else:
                 result = get_all_data(cursor)
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'isBase64Encoded': False,
-                'body': json.dumps(result, default=str)
-            }
+            body = json.dumps(result, default=str)
+            etag = make_etag(body)
+            if cache_key:
+                catalog_cache_put(cache_key, version, body, etag)
+            cursor.close()
+            conn.close()
+            return catalog_response(body, etag, if_none_match, 'MISS' if cache_key else 'BYPASS')
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -235,9 +412,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             if path == 'album':
                 result = create_album(cursor, conn, body)
+                invalidate_catalog_cache()
             elif path == 'track':
                 print(f'[DEBUG] Creating track with data: {body}')
                 result = create_track(cursor, conn, body)
+                invalidate_catalog_cache()
             elif path == 'media':
                 media_id = body.get('id')
                 file_type = body.get('file_type', 'audio')
@@ -247,19 +426,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 print(f'[DEBUG] Saving media file: {media_id}, type: {file_type}, size: {len(data)}')
                 
                 if data.startswith('http://') or data.startswith('https://'):
-                    import urllib.request
-                    print(f'[DEBUG] Downloading media from Yandex.Disk: {data[:100]}...')
+                    print(f'[DEBUG] Streaming media from Yandex.Disk to S3: {data[:100]}...')
                     try:
-                        req = urllib.request.Request(data, headers={'User-Agent': 'Mozilla/5.0'})
-                        with urllib.request.urlopen(req, timeout=45) as response:
-                            file_content = response.read()
-                            print(f'[DEBUG] Downloaded {len(file_content)} bytes, uploading to S3...')
-                            
-                            s3_key = f'audio/{media_id}.mp3'
-                            s3_url = upload_to_s3(file_content, s3_key, 'audio/mpeg')
-                            print(f'[DEBUG] Uploaded to S3: {s3_url}')
-                            
-                            data = s3_url
+                        uploaded = ingest_url_to_s3(data, media_id, file_type)
+                        print(f"[DEBUG] Uploaded to S3: {uploaded['url']} ({uploaded['bytes']} bytes)")
+                        data = uploaded['url']
                     except Exception as e:
                         print(f'[ERROR] Failed to download/upload media: {str(e)}')
                         cursor.close()
@@ -280,6 +451,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             elif path == 'stat':
                 result = update_stat(cursor, conn, body)
+            elif path == 'stats/flush':
+                result = {'flushed': flush_events(conn)}
             elif path == 'order':
                 result = create_web_order(cursor, conn, body)
                 cursor.close()
@@ -319,6 +492,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 result = update_track(cursor, conn, item_id, body)
             else:
                 return error_response('Invalid path', 400)
+            invalidate_catalog_cache()
             
             return {
                 'statusCode': 200,
@@ -335,7 +509,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             item_id = query_params.get('id')
 
             if path == 'cleanup-audio':
-                result = cleanup_unused_audio(cursor, conn)
+                result = cleanup_unused_audio(conn, query_params)
                 cursor.close()
                 conn.close()
                 return {
@@ -357,6 +531,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 result = delete_track(cursor, conn, item_id)
             else:
                 return error_response('Invalid path', 400)
+            invalidate_catalog_cache()
             
             return {
                 'statusCode': 200,
@@ -399,40 +574,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': error_msg})
         }
 
-def cleanup_unused_audio(cursor, conn) -> Dict[str, Any]:
-    cursor.execute('''
-        SELECT COUNT(*) as count FROM media_files
-        WHERE file_type IN ('audio', 'audio/mpeg')
-        AND id NOT IN (SELECT file FROM tracks WHERE file IS NOT NULL)
-    ''')
-    count_result = cursor.fetchone()
-    audio_count = count_result['count'] if count_result else 0
-
-    cursor.execute('''
-        DELETE FROM media_files
-        WHERE file_type IN ('audio', 'audio/mpeg')
-        AND id NOT IN (SELECT file FROM tracks WHERE file IS NOT NULL)
-    ''')
-
-    cursor.execute('''
-        SELECT COUNT(*) as count FROM media_files
-        WHERE file_type IN ('image', 'image/jpeg', 'image/png')
-        AND id NOT IN (SELECT cover FROM albums WHERE cover IS NOT NULL)
-        AND id NOT IN (SELECT cover FROM tracks WHERE cover IS NOT NULL AND cover NOT LIKE 'http%')
-    ''')
-    img_result = cursor.fetchone()
-    img_count = img_result['count'] if img_result else 0
-
-    cursor.execute('''
-        DELETE FROM media_files
-        WHERE file_type IN ('image', 'image/jpeg', 'image/png')
-        AND id NOT IN (SELECT cover FROM albums WHERE cover IS NOT NULL)
-        AND id NOT IN (SELECT cover FROM tracks WHERE cover IS NOT NULL AND cover NOT LIKE 'http%')
-    ''')
-
-    conn.commit()
-    total = audio_count + img_count
-    return {'deleted': total, 'message': f'Удалено {audio_count} аудио и {img_count} картинок'}
+def cleanup_unused_audio(conn, query_params: Dict[str, str]) -> Dict[str, Any]:
+    dry_run = query_params.get('dry_run') == '1'
+    result = collect_orphan_media(
+        conn,
+        batch_size=min(int(query_params.get('batch', 200)), 1000),
+        after=query_params.get('after', ''),
+        dry_run=dry_run
+    )
+    audio_count = result['orphans_audio']
+    img_count = result['orphans_image']
+    verb = 'Найдено' if dry_run else 'Удалено'
+    return {
+        **result,
+        'deleted': 0 if dry_run else audio_count + img_count,
+        'message': f'{verb} {audio_count} аудио и {img_count} картинок'
+    }
 
 
 def handle_blog(cursor, conn, event: Dict[str, Any], method: str, path: str) -> Dict[str, Any]:
@@ -497,73 +654,131 @@ def handle_blog(cursor, conn, event: Dict[str, Any], method: str, path: str) ->
     else:
         raise Exception('Invalid blog path or method')
 
+def encode_page_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_page_cursor(page_cursor: Optional[str], size: int) -> Optional[List[Any]]:
+    if not page_cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(page_cursor + '=' * (-len(page_cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size or None in values:
+        raise ValueError('Invalid cursor')
+    return values
+
+def page_time(value: Optional[datetime]) -> datetime:
+    return value or PAGE_NULL_TIME
+
+def parse_page_limit(value: Optional[str], default: int) -> int:
+    try:
+        limit = int(value) if value else default
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return max(1, min(limit, PAGE_MAX_LIMIT))
+
 def get_albums(cursor) -> List[Dict]:
-    print('[DEBUG] Getting albums...')
-    cursor.execute('''
+    return get_albums_page(cursor)[0]
+
+def get_albums_page(cursor, after: Optional[List[Any]] = None, limit: int = 100) -> Tuple[List[Dict], Optional[str]]:
+    # Keyset по (created_at, id): страница читается по индексу idx_albums_created_id
+    # без OFFSET, поэтому стоимость не зависит от размера каталога
+    where = "WHERE (COALESCE(a.created_at, TIMESTAMP 'epoch'), a.id) < (%s::timestamp, %s)" if after else ''
+    cursor.execute(f'''
         SELECT a.id, a.title, a.artist, a.cover, a.price, a.description, a.year, a.created_at, a.updated_at,
-               COUNT(t.id) as tracks_count
+               (SELECT COUNT(*) FROM tracks t WHERE t.album_id = a.id) as tracks_count
         FROM albums a
-        LEFT JOIN tracks t ON a.id = t.album_id
-        GROUP BY a.id, a.title, a.artist, a.cover, a.price, a.description, a.year, a.created_at, a.updated_at
-        ORDER BY a.created_at DESC
-        LIMIT 100
-    ''')
-    albums_raw = cursor.fetchall()
-    print(f'[DEBUG] Found {len(albums_raw)} albums')
-    
-    albums = []
-    for album_row in albums_raw:
-        try:
-            album = dict(album_row)
-            album_id = str(album['id']).replace("'", "''")
-            print(f'[DEBUG] Getting tracks for album: {album_id}')
-            cursor.execute(f"""
-                SELECT t.id, t.album_id, t.title, t.duration, t.price, t.cover, t.track_order, t.created_at,
-                       COALESCE(ts.plays_count, 0) as plays_count
-                FROM tracks t
-                LEFT JOIN track_stats ts ON t.id = ts.track_id
-                WHERE t.album_id = '{album_id}'
-                ORDER BY t.track_order, t.created_at
-                LIMIT 50
-            """)
-            tracks_raw = cursor.fetchall()
-            
-            album['trackList'] = [dict(track) for track in tracks_raw] if tracks_raw else []
-            print(f'[DEBUG] Found {len(tracks_raw) if tracks_raw else 0} tracks for album {album_id}')
-            albums.append(album)
-        except Exception as e:
-            print(f'[ERROR] Failed to get tracks for album: {e}')
-            album = dict(album_row)
-            album['trackList'] = []
-            albums.append(album)
-    
-    print(f'[DEBUG] Returning albums with tracks')
-    return albums
+        {where}
+        ORDER BY COALESCE(a.created_at, TIMESTAMP 'epoch') DESC, a.id DESC
+        LIMIT %s
+    ''', (*(after or []), limit + 1))
+    albums = [dict(album_row) for album_row in cursor.fetchall()]
+    next_cursor = None
+    if len(albums) > limit:
+        albums = albums[:limit]
+        next_cursor = encode_page_cursor([page_time(albums[-1]['created_at']), albums[-1]['id']])
+    if not albums:
+        return [], None
+    
+    # Треки всех альбомов одним запросом вместо отдельного SELECT на каждый альбом
+    track_lists = get_track_lists(cursor, [album['id'] for album in albums])
+    for album in albums:
+        album['trackList'] = track_lists.get(album['id'], [])
+    
+    return albums, next_cursor
 
-def get_tracks(cursor, album_id: Optional[str] = None) -> List[Dict]:
-    if album_id:
-        safe_id = album_id.replace("'", "''")
-        cursor.execute(f"""
+def get_track_lists(cursor, album_ids: List[str]) -> Dict[str, List[Dict]]:
+    cursor.execute('''
+        SELECT id, album_id, title, duration, price, cover, track_order, created_at, plays_count
+        FROM (
             SELECT t.id, t.album_id, t.title, t.duration, t.price, t.cover, t.track_order, t.created_at,
-                   COALESCE(ts.plays_count, 0) as plays_count
+                   COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) as plays_count,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY t.album_id
+                       ORDER BY COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id
+                   ) as rn
             FROM tracks t
             LEFT JOIN track_stats ts ON t.id = ts.track_id
-            WHERE t.album_id = '{safe_id}'
-            ORDER BY t.track_order, t.created_at
-            LIMIT 50
-        """)
+            LEFT JOIN pending_track_stats ps ON t.id = ps.track_id
+            WHERE t.album_id = ANY(%s)
+        ) ranked
+        WHERE rn <= 50
+        ORDER BY album_id, rn
+    ''', (list(album_ids),))
+    
+    track_lists: Dict[str, List[Dict]] = {}
+    for track in cursor.fetchall():
+        track_lists.setdefault(track['album_id'], []).append(dict(track))
+    return track_lists
+
+def get_tracks(cursor, album_id: Optional[str] = None) -> List[Dict]:
+    return get_tracks_page(cursor, album_id)[0]
+
+def get_tracks_page(cursor, album_id: Optional[str] = None, after: Optional[List[Any]] = None,
+                    limit: Optional[int] = None) -> Tuple[List[Dict], Optional[str]]:
+    if album_id:
+        # Keyset по (track_order, created_at, id) внутри альбома — индекс idx_tracks_album_order
+        limit = limit or 50
+        where = 'WHERE t.album_id = %s'
+        args: List[Any] = [album_id]
+        if after:
+            where += " AND (COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id)" \
+                     " > (%s, %s::timestamp, %s)"
+            args.extend(after)
+        order = "COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id"
     else:
-        cursor.execute("""
-            SELECT t.id, t.album_id, t.title, t.duration, t.price, t.cover, t.track_order, t.created_at,
-                   COALESCE(ts.plays_count, 0) as plays_count
-            FROM tracks t
-            LEFT JOIN track_stats ts ON t.id = ts.track_id
-            ORDER BY t.created_at DESC
-            LIMIT 100
-        """)
+        # Keyset по (created_at, id) по всему каталогу — индекс idx_tracks_created_id
+        limit = limit or 100
+        where = "WHERE (COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id) < (%s::timestamp, %s)" if after else ''
+        args = list(after or [])
+        order = "COALESCE(t.created_at, TIMESTAMP 'epoch') DESC, t.id DESC"
     
-    tracks_raw = cursor.fetchall()
-    return [dict(track) for track in tracks_raw] if tracks_raw else []
+    cursor.execute(f'''
+        SELECT t.id, t.album_id, t.title, t.duration, t.price, t.cover, t.track_order, t.created_at,
+               COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) as plays_count
+        FROM tracks t
+        LEFT JOIN track_stats ts ON t.id = ts.track_id
+        LEFT JOIN pending_track_stats ps ON t.id = ps.track_id
+        {where}
+        ORDER BY {order}
+        LIMIT %s
+    ''', (*args, limit + 1))
+    
+    tracks = [dict(track) for track in cursor.fetchall()]
+    next_cursor = None
+    if len(tracks) > limit:
+        tracks = tracks[:limit]
+        last = tracks[-1]
+        if album_id:
+            order_value = PAGE_NULL_ORDER if last['track_order'] is None else last['track_order']
+            key = [order_value, page_time(last['created_at']), last['id']]
+        else:
+            key = [page_time(last['created_at']), last['id']]
+        next_cursor = encode_page_cursor(key)
+    return tracks, next_cursor
 
 def get_track_file(cursor, track_id: str) -> Optional[Dict]:
     safe_id = track_id.replace("'", "''")
@@ -578,73 +793,176 @@ def get_track_file(cursor, track_id: str) -> Optional[Dict]:
     # Frontend должен использовать track-stream для получения аудио
     return {'file': file_ref}
 
-def get_media_file(cursor, media_id: str) -> Optional[Dict]:
-    safe_id = media_id.replace("'", "''")
-    cursor.execute(f"SELECT * FROM media_files WHERE id = '{safe_id}'")
-    return cursor.fetchone()
+def get_media_file(conn, media_id: str) -> Optional[Dict]:
+    meta = get_media_meta(conn, media_id)
+    if not meta:
+        return None
+    data = meta['url'] or ''
+    if not data:
+        stored = read_media(conn, media_id)
+        if stored:
+            data = f"data:{meta['mime_type']};base64,{base64.b64encode(stored[0]).decode('ascii')}"
+    return {
+        'id': meta['id'],
+        'file_type': meta['file_type'],
+        'mime_type': meta['mime_type'],
+        'byte_length': meta['byte_length'],
+        'data': data,
+        'created_at': meta['created_at']
+    }
+
+def parse_range_header(range_header: Optional[str], total: int) -> Optional[Tuple[int, int]]:
+    # Поддерживаются bytes=a-b, bytes=a- и bytes=-n; из нескольких диапазонов берётся первый
+    if not range_header or not range_header.strip().startswith('bytes='):
+        return None
+    spec = range_header.strip()[len('bytes='):].split(',')[0].strip()
+    start_str, _, end_str = spec.partition('-')
+    try:
+        if not start_str:
+            suffix = int(end_str)
+            if suffix <= 0:
+                raise ValueError('Unsatisfiable range')
+            return max(total - suffix, 0), total - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else total - 1
+    except ValueError:
+        raise ValueError('Unsatisfiable range')
+    if start >= total or end < start:
+        raise ValueError('Unsatisfiable range')
+    return start, min(end, total - 1)
+
+def encode_media_body(conn, meta: Dict[str, Any], total: int) -> str:
+    # Окно кратно 3 байтам: base64 соседних окон склеивается без паддинга в середине
+    window = max(TRACK_STREAM_CHUNK_BYTES - TRACK_STREAM_CHUNK_BYTES % 3, 3)
+    parts = []
+    for start in range(0, total, window):
+        end = min(start + window, total) - 1
+        parts.append(base64.b64encode(read_media_range(conn, meta, start, end)).decode('ascii'))
+    return ''.join(parts)
+
+def stream_media_file(conn, media_file_id: str, range_header: Optional[str]) -> Dict[str, Any]:
+    meta = get_media_meta(conn, media_file_id)
+    if not meta:
+        return error_response('Audio file not found', 404)
+    
+    if meta['url']:
+        if meta['url'].startswith('https://cdn.poehali.dev/'):
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'isBase64Encoded': False,
+                'body': json.dumps({'url': meta['url'], 'type': 'redirect'})
+            }
+        return error_response('Audio file not found', 404)
+    
+    total = meta['byte_length']
+    if not total:
+        return error_response('Audio file not found', 404)
+    
+    content_type = meta['mime_type'] if meta['mime_type'].startswith('audio/') else 'audio/mpeg'
+    headers = {
+        'Content-Type': content_type,
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, Content-Length, Accept-Ranges',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=31536000'
+    }
+    
+    try:
+        byte_range = parse_range_header(range_header, total)
+    except ValueError:
+        return {
+            'statusCode': 416,
+            'headers': {**headers, 'Content-Range': f'bytes */{total}'},
+            'isBase64Encoded': False,
+            'body': ''
+        }
+    
+    if byte_range is None:
+        # Без Range — целиком и 200 (206 без Range запрещён RFC 9110): сайт скачивает
+        # трек через fetch и сохраняет тело. Из БД файл читается окнами по
+        # TRACK_STREAM_CHUNK_BYTES, в памяти держится только base64 ответа
+        headers['Content-Length'] = str(total)
+        return {'statusCode': 200, 'headers': headers, 'isBase64Encoded': True,
+                'body': encode_media_body(conn, meta, total)}
+    
+    start, end = byte_range
+    end = min(end, start + TRACK_STREAM_CHUNK_BYTES - 1)
+    chunk = read_media_range(conn, meta, start, end)
+    
+    headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+    headers['Content-Length'] = str(len(chunk))
+    return {
+        'statusCode': 206,
+        'headers': headers,
+        'isBase64Encoded': True,
+        'body': base64.b64encode(chunk).decode('ascii')
+    }
 
 def get_cdn_url(file_key: str) -> str:
     aws_key = os.environ.get('AWS_ACCESS_KEY_ID', '')
     return f"https://cdn.poehali.dev/projects/{aws_key}/bucket/{file_key}.mp3"
 
 def get_top_tracks(cursor, username: Optional[str] = None, limit: int = 5) -> List[Dict]:
+    # Первые N строк берутся из track_leaderboard по индексу, остальные таблицы
+    # подключаются только к ним — время ответа не растёт вместе с каталогом
     if username:
-        safe_username = username.replace("'", "''")
-        cursor.execute(f'''
-            SELECT 
-                t.id,
-                t.title,
-                t.duration,
-                t.price,
-                COALESCE(ts.plays_count, 0) as plays_count,
-                t.album_id,
-                a.title as album_title,
-                u.username,
-                ap.display_name,
-                a.cover
-            FROM tracks t
-            LEFT JOIN track_stats ts ON t.id = ts.track_id
-            LEFT JOIN albums a ON t.album_id = a.id
-            LEFT JOIN users u ON t.user_id = u.id
-            LEFT JOIN artist_profiles ap ON u.id = ap.user_id
-            WHERE u.username = '{safe_username}'
-            ORDER BY COALESCE(ts.plays_count, 0) DESC
-            LIMIT {limit}
-        ''')
+        where = 'WHERE lb.user_id = (SELECT id FROM users WHERE username = %s)'
+        args: List[Any] = [username, limit]
     else:
-        cursor.execute(f'''
-            SELECT 
-                t.id,
-                t.title,
-                t.duration,
-                t.price,
-                COALESCE(ts.plays_count, 0) as plays_count,
-                t.album_id,
-                a.title as album_title,
-                u.username,
-                ap.display_name,
-                a.cover
-            FROM tracks t
-            LEFT JOIN track_stats ts ON t.id = ts.track_id
-            LEFT JOIN albums a ON t.album_id = a.id
-            LEFT JOIN users u ON t.user_id = u.id
-            LEFT JOIN artist_profiles ap ON u.id = ap.user_id
-            ORDER BY COALESCE(ts.plays_count, 0) DESC
-            LIMIT {limit}
-        ''')
+        where = ''
+        args = [limit]
+    cursor.execute(f'''
+        WITH top AS (
+            SELECT lb.track_id, lb.plays_count, lb.created_at
+            FROM track_leaderboard lb
+            {where}
+            ORDER BY lb.plays_count DESC, COALESCE(lb.created_at, TIMESTAMP 'epoch') DESC, lb.track_id DESC
+            LIMIT %s
+        )
+        SELECT 
+            t.id,
+            t.title,
+            t.duration,
+            t.price,
+            top.plays_count + COALESCE(ps.plays_count, 0) as plays_count,
+            t.album_id,
+            a.title as album_title,
+            u.username,
+            ap.display_name,
+            a.cover
+        FROM top
+        JOIN tracks t ON t.id = top.track_id
+        LEFT JOIN pending_track_stats ps ON t.id = ps.track_id
+        LEFT JOIN albums a ON t.album_id = a.id
+        LEFT JOIN users u ON t.user_id = u.id
+        LEFT JOIN artist_profiles ap ON u.id = ap.user_id
+        ORDER BY top.plays_count DESC, COALESCE(top.created_at, TIMESTAMP 'epoch') DESC, top.track_id DESC
+    ''', args)
     
     return cursor.fetchall()
 
 def get_stats(cursor, track_id: Optional[str] = None) -> Dict:
+    # Ещё не сброшенные события из play_events добавляются к track_stats на лету
     if track_id:
-        safe_id = track_id.replace("'", "''")
-        cursor.execute(f"SELECT * FROM track_stats WHERE track_id = '{safe_id}'")
+        cursor.execute('''
+            SELECT ts.id, ts.track_id,
+                   COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) as plays_count,
+                   COALESCE(ts.downloads_count, 0) + COALESCE(ps.downloads_count, 0) as downloads_count,
+                   ts.last_played_at, ts.last_downloaded_at, ts.created_at, ts.updated_at
+            FROM track_stats ts
+            LEFT JOIN pending_track_stats ps ON ts.track_id = ps.track_id
+            WHERE ts.track_id = %s
+        ''', (track_id,))
         return cursor.fetchone() or {}
     else:
         cursor.execute('''
             SELECT 
-                COALESCE(SUM(plays_count), 0) as total_plays,
-                COALESCE(SUM(downloads_count), 0) as total_downloads,
+                COALESCE(SUM(plays_count), 0) + (SELECT COALESCE(SUM(plays_count), 0) FROM pending_track_stats) as total_plays,
+                COALESCE(SUM(downloads_count), 0) + (SELECT COALESCE(SUM(downloads_count), 0) FROM pending_track_stats) as total_downloads,
                 COUNT(*) as tracked_tracks
             FROM track_stats
         ''')
@@ -652,12 +970,13 @@ def get_stats(cursor, track_id: Optional[str] = None) -> Dict:
         
         cursor.execute('''
             SELECT t.id, t.title, 
-                   COALESCE(ts.plays_count, 0) as plays_count, 
-                   COALESCE(ts.downloads_count, 0) as downloads_count
+                   COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) as plays_count, 
+                   COALESCE(ts.downloads_count, 0) + COALESCE(ps.downloads_count, 0) as downloads_count
             FROM track_stats ts
             JOIN tracks t ON ts.track_id = t.id
-            WHERE ts.plays_count > 0
-            ORDER BY ts.plays_count DESC
+            LEFT JOIN pending_track_stats ps ON ts.track_id = ps.track_id
+            WHERE COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) > 0
+            ORDER BY COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) DESC
             LIMIT 10
         ''')
         top_tracks = cursor.fetchall()
@@ -679,22 +998,16 @@ def get_all_data(cursor) -> Dict:
     }
 
 def save_media_file(cursor, conn, file_id: str, file_type: str, data: str) -> str:
-    if not data or len(data) < 100:
+    if data and (data.startswith('http://') or data.startswith('https://')):
+        save_media_reference(conn, file_id, file_type, data)
+        conn.commit()
         return file_id
     
-    safe_id = file_id.replace("'", "''")
-    safe_type = file_type.replace("'", "''")
-    safe_data = data.replace("'", "''")
-    now = datetime.now().isoformat()
-    
-    cursor.execute(f"SELECT id FROM media_files WHERE id = '{safe_id}'")
-    existing = cursor.fetchone()
-    
-    if existing:
-        cursor.execute(f"UPDATE media_files SET data = '{safe_data}', file_type = '{safe_type}' WHERE id = '{safe_id}'")
-    else:
-        cursor.execute(f"INSERT INTO media_files (id, file_type, data, created_at) VALUES ('{safe_id}', '{safe_type}', '{safe_data}', '{now}')")
+    if not data or len(data) < 100:
+        return file_id
     
+    payload, mime_type = decode_payload(data, file_type)
+    save_media(conn, file_id, file_type, payload, mime_type)
     conn.commit()
     return file_id
 
@@ -725,8 +1038,9 @@ def create_album(cursor, conn, data: Dict) -> Dict:
         VALUES ('{album_id}', '{title}', '{artist}', {cover_value}, {price}, '{description}', {year_value}, 0, '{now}', NULL)
         RETURNING *
     ''')
-    conn.commit()
     result = cursor.fetchone()
+    bump_catalog_version(cursor)
+    conn.commit()
     print(f'[DEBUG] Album created successfully: {result}')
     return result
 
@@ -744,22 +1058,14 @@ def create_track(cursor, conn, data: Dict) -> Dict:
     file_id = None
     if file_data:
         if file_data.startswith('http://') or file_data.startswith('https://'):
-            import urllib.request
-            import base64
             print(f'[DEBUG] Downloading audio from Yandex.Disk: {file_data[:100]}...')
             try:
-                req = urllib.request.Request(file_data, headers={'User-Agent': 'Mozilla/5.0'})
-                with urllib.request.urlopen(req, timeout=45) as response:
-                    content_type = response.headers.get('Content-Type', '')
-                    file_content = response.read()
-                    print(f'[DEBUG] Downloaded {len(file_content)} bytes, Content-Type: {content_type}')
-                    if 'text/html' in content_type or (len(file_content) > 10 and file_content[:15].lower().startswith(b'<!doctype')):
-                        raise Exception('Ссылка ведёт на страницу, а не на аудиофайл. Используйте прямую ссылку на скачивание MP3.')
-                    audio_data_b64 = base64.b64encode(file_content).decode('utf-8')
-                    file_id = f"audio_{track_id}"
-                    save_media_file(cursor, conn, file_id, 'audio', audio_data_b64)
-                    print(f'[DEBUG] Audio cached as base64 in media_files')
+                file_id = f"audio_{track_id}"
+                stored = ingest_url_to_db(conn, file_data, file_id, 'audio')
+                conn.commit()
+                print(f"[DEBUG] Audio stored as bytea in media_files: {stored['bytes']} bytes, sha256 {stored['sha256']}")
             except Exception as e:
+                conn.rollback()
                 print(f'[ERROR] Failed to download audio during track creation: {str(e)}')
                 raise Exception(f'Не удалось загрузить аудиофайл: {str(e)}')
         elif file_data.startswith('data:'):
@@ -783,7 +1089,6 @@ def create_track(cursor, conn, data: Dict) -> Dict:
         RETURNING *
     ''')
     new_track = cursor.fetchone()
-    conn.commit()
     
     if album_id:
         cursor.execute(f'''
@@ -791,7 +1096,8 @@ def create_track(cursor, conn, data: Dict) -> Dict:
             SET tracks_count = tracks_count + 1, updated_at = '{now}'
             WHERE id = '{album_id}'
         ''')
-        conn.commit()
+    bump_catalog_version(cursor)
+    conn.commit()
     
     return new_track
 
@@ -820,8 +1126,10 @@ def update_album(cursor, conn, album_id: str, data: Dict) -> Dict:
         WHERE id = '{safe_id}'
         RETURNING *
     ''')
+    result = cursor.fetchone()
+    bump_catalog_version(cursor)
     conn.commit()
-    return cursor.fetchone()
+    return result
 
 def update_track(cursor, conn, track_id: str, data: Dict) -> Dict:
     safe_id = track_id.replace("'", "''")
@@ -835,22 +1143,14 @@ def update_track(cursor, conn, track_id: str, data: Dict) -> Dict:
     file_id = None
     if file_data:
         if file_data.startswith('http://') or file_data.startswith('https://'):
-            import urllib.request
-            import base64
             print(f'[DEBUG] Downloading audio from Yandex.Disk: {file_data[:100]}...')
             try:
-                req = urllib.request.Request(file_data, headers={'User-Agent': 'Mozilla/5.0'})
-                with urllib.request.urlopen(req, timeout=45) as response:
-                    content_type = response.headers.get('Content-Type', '')
-                    file_content = response.read()
-                    print(f'[DEBUG] Downloaded {len(file_content)} bytes, Content-Type: {content_type}')
-                    if 'text/html' in content_type or (len(file_content) > 10 and file_content[:15].lower().startswith(b'<!doctype')):
-                        raise Exception('Ссылка ведёт на страницу, а не на аудиофайл. Используйте прямую ссылку на скачивание MP3.')
-                    audio_data_b64 = base64.b64encode(file_content).decode('utf-8')
-                    file_id = f"audio_{track_id}"
-                    save_media_file(cursor, conn, file_id, 'audio', audio_data_b64)
-                    print(f'[DEBUG] Audio cached as base64 in media_files')
+                file_id = f"audio_{track_id}"
+                stored = ingest_url_to_db(conn, file_data, file_id, 'audio')
+                conn.commit()
+                print(f"[DEBUG] Audio stored as bytea in media_files: {stored['bytes']} bytes, sha256 {stored['sha256']}")
             except Exception as e:
+                conn.rollback()
                 print(f'[ERROR] Failed to download audio during track update: {str(e)}')
                 raise Exception(f'Не удалось загрузить аудиофайл: {str(e)}')
         elif file_data.startswith('data:'):
@@ -866,54 +1166,22 @@ def update_track(cursor, conn, track_id: str, data: Dict) -> Dict:
         WHERE id = '{safe_id}'
         RETURNING *
     ''')
+    result = cursor.fetchone()
+    bump_catalog_version(cursor)
     conn.commit()
-    return cursor.fetchone()
+    return result
 
 def update_stat(cursor, conn, data: Dict) -> Dict:
-    track_id = data['track_id'].replace("'", "''")
-    stat_type = data.get('type', 'play')
-    now = datetime.now().isoformat()
-    
-    cursor.execute(f"SELECT * FROM track_stats WHERE track_id = '{track_id}'")
-    existing = cursor.fetchone()
-    
-    if existing:
-        if stat_type == 'play':
-            cursor.execute(f'''
-                UPDATE track_stats 
-                SET plays_count = plays_count + 1, last_played_at = '{now}', updated_at = '{now}'
-                WHERE track_id = '{track_id}'
-                RETURNING *
-            ''')
-        else:
-            cursor.execute(f'''
-                UPDATE track_stats 
-                SET downloads_count = downloads_count + 1, last_downloaded_at = '{now}', updated_at = '{now}'
-                WHERE track_id = '{track_id}'
-                RETURNING *
-            ''')
-    else:
-        if stat_type == 'play':
-            cursor.execute(f'''
-                INSERT INTO track_stats (track_id, plays_count, last_played_at, created_at)
-                VALUES ('{track_id}', 1, '{now}', '{now}')
-                RETURNING *
-            ''')
-        else:
-            cursor.execute(f'''
-                INSERT INTO track_stats (track_id, downloads_count, last_downloaded_at, created_at)
-                VALUES ('{track_id}', 1, '{now}', '{now}')
-                RETURNING *
-            ''')
-    
-    conn.commit()
-    return cursor.fetchone()
+    kind = 'play' if data.get('type', 'play') == 'play' else 'download'
+    record_event(conn, data['track_id'], kind)
+    return get_live_counts(conn, data['track_id'])
 
 def delete_album(cursor, conn, album_id: str) -> Dict:
     safe_id = album_id.replace("'", "''")
     
     cursor.execute(f"DELETE FROM tracks WHERE album_id = '{safe_id}'")
     cursor.execute(f"DELETE FROM albums WHERE id = '{safe_id}'")
+    bump_catalog_version(cursor)
     conn.commit()
     
     return {'success': True, 'deleted_album_id': album_id}
@@ -922,6 +1190,7 @@ def delete_track(cursor, conn, track_id: str) -> Dict:
     safe_id = track_id.replace("'", "''")
     
     cursor.execute(f"DELETE FROM tracks WHERE id = '{safe_id}'")
+    bump_catalog_version(cursor)
     conn.commit()
     
     return {'success': True, 'deleted_track_id': track_id}
@@ -937,41 +1206,8 @@ def error_response(message: str, status_code: int) -> Dict:
         'body': json.dumps({'error': message})
     }
 
-def send_telegram_message(chat_id: int, text: str, reply_markup: Dict = None) -> bool:
-    import urllib.request
-    import urllib.parse
-    
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    if not token:
-        print('[ERROR] TELEGRAM_BOT_TOKEN not found')
-        return False
-    
-    url = f'https://api.telegram.org/bot{token}/sendMessage'
-    
-    data = {
-        'chat_id': chat_id,
-        'text': text,
-        'parse_mode': 'HTML'
-    }
-    
-    if reply_markup:
-        data['reply_markup'] = json.dumps(reply_markup)
-    
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(data).encode('utf-8'),
-        headers={'Content-Type': 'application/json'}
-    )
-    
-    try:
-        with urllib.request.urlopen(req) as response:
-            return response.status == 200
-    except Exception as e:
-        print(f'[ERROR] Failed to send message: {e}')
-        return False
-
 def create_order(cursor, conn, user_id: int, username: str, first_name: str, items: List[Dict], total: int) -> str:
-    order_id = f'order_{int(datetime.now().timestamp() * 1000)}'
+    order_id = new_order_id()
     items_json = json.dumps(items, ensure_ascii=False).replace("'", "''")
     safe_username = (username or '').replace("'", "''")
     safe_first_name = (first_name or '').replace("'", "''")
@@ -980,8 +1216,7 @@ def create_order(cursor, conn, user_id: int, username: str, first_name: str, ite
         INSERT INTO orders (id, user_id, username, first_name, items, total_price, status)
         VALUES ('{order_id}', {user_id}, '{safe_username}', '{safe_first_name}', '{items_json}', {total}, 'pending')
     ''')
-    conn.commit()
-    
+    # Коммит — вместе с ответом бота и отметкой об обработке обновления
     return order_id
 
 def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
@@ -999,28 +1234,10 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
 <b>Команды:</b>
 /catalog - Посмотреть каталог альбомов
 /help - Помощь'''
-            send_telegram_message(chat_id, msg)
+            enqueue_message(cursor, chat_id, msg)
         elif text == '/catalog':
-            albums = get_albums(cursor)
-            
-            if not albums:
-                send_telegram_message(chat_id, '📁 Каталог пуст')
-                return {'ok': True}
-            
-            msg = '<b>🎵 Каталог альбомов:</b>\n\n'
-            keyboard = {'inline_keyboard': []}
-            
-            for album in albums:
-                msg += f'🎼 <b>{album["title"]}</b>\n'
-                msg += f'👤 {album["artist"]}\n'
-                msg += f'💿 Треков: {album["tracks_count"]}\n'
-                msg += f'💰 {album["price"]} ₽\n\n'
-                
-                keyboard['inline_keyboard'].append([
-                    {'text': f'🎧 {album["title"]}', 'callback_data': f'album_{album["id"]}'}
-                ])
-            
-            send_telegram_message(chat_id, msg, keyboard)
+            (msg, keyboard), _ = catalog_page(cursor, get_catalog_version(cursor))
+            enqueue_message(cursor, chat_id, msg, keyboard)
         elif text == '/help':
             msg = '''<b>Помощь по боту:</b>
 
@@ -1028,9 +1245,9 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
 /start - Начать работу с ботом
 
 Для покупки выберите альбом из каталога.'''
-            send_telegram_message(chat_id, msg)
+            enqueue_message(cursor, chat_id, msg)
         else:
-            send_telegram_message(chat_id, 'Используйте /catalog для просмотра каталога')
+            enqueue_message(cursor, chat_id, 'Используйте /catalog для просмотра каталога')
     
     elif 'callback_query' in body:
         callback = body['callback_query']
@@ -1038,68 +1255,36 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
         data = callback['data']
         user = callback['from']
         
+        version = get_catalog_version(cursor)
+        
         if data == 'catalog':
-            albums = get_albums(cursor)
-            msg = '<b>🎵 Каталог альбомов:</b>\n\n'
-            keyboard = {'inline_keyboard': []}
-            
-            for album in albums:
-                msg += f'🎼 <b>{album["title"]}</b>\n'
-                msg += f'👤 {album["artist"]}\n'
-                msg += f'💰 {album["price"]} ₽\n\n'
-                
-                keyboard['inline_keyboard'].append([
-                    {'text': f'🎧 {album["title"]}', 'callback_data': f'album_{album["id"]}'}
-                ])
+            (msg, keyboard), _ = catalog_page(cursor, version)
+            enqueue_message(cursor, chat_id, msg, keyboard)
             
-            send_telegram_message(chat_id, msg, keyboard)
+        elif data.startswith('catalog_'):
+            # Листание каталога правит то же сообщение, а не шлёт новое
+            (msg, keyboard), _ = catalog_page(cursor, version, int(data.replace('catalog_', '') or 0))
+            payload = {'chat_id': chat_id, 'message_id': callback['message']['message_id'], 'text': msg, 'parse_mode': 'HTML'}
+            if keyboard:
+                payload['reply_markup'] = keyboard
+            enqueue_call(cursor, chat_id, 'editMessageText', payload)
             
         elif data.startswith('album_'):
             album_id = data.replace('album_', '')
-            safe_id = album_id.replace("'", "''")
-            cursor.execute(f"SELECT * FROM albums WHERE id = '{safe_id}'")
-            album = cursor.fetchone()
+            card = album_card(cursor, version, album_id)
             
-            if not album:
-                send_telegram_message(chat_id, '❌ Альбом не найден')
+            if not card:
+                enqueue_message(cursor, chat_id, '❌ Альбом не найден')
                 return {'ok': True}
             
-            tracks = get_tracks(cursor, album_id)
-            
-            msg = f'🎼 <b>{album["title"]}</b>\n'
-            msg += f'👤 {album["artist"]}\n'
-            msg += f'💰 Цена альбома: {album["price"]} ₽\n\n'
-            
-            if album.get('description'):
-                msg += f'📝 {album["description"]}\n\n'
-            
-            msg += '<b>Треки:</b>\n'
-            
-            keyboard = {'inline_keyboard': []}
-            
-            for idx, track in enumerate(tracks, 1):
-                msg += f'{idx}. {track["title"]} - {track["duration"]} ({track["price"]} ₽)\n'
-                keyboard['inline_keyboard'].append([
-                    {'text': f'🎵 Купить "{track["title"]}"', 'callback_data': f'buy_track_{track["id"]}'}
-                ])
-            
-            keyboard['inline_keyboard'].append([
-                {'text': f'💿 Купить весь альбом ({album["price"]} ₽)', 'callback_data': f'buy_album_{album_id}'}
-            ])
-            keyboard['inline_keyboard'].append([
-                {'text': '« Назад к каталогу', 'callback_data': 'catalog'}
-            ])
-            
-            send_telegram_message(chat_id, msg, keyboard)
+            enqueue_message(cursor, chat_id, card[0], card[1])
             
         elif data.startswith('buy_track_'):
             track_id = data.replace('buy_track_', '')
-            safe_id = track_id.replace("'", "''")
-            cursor.execute(f"SELECT t.*, a.title as album_title FROM tracks t JOIN albums a ON t.album_id = a.id WHERE t.id = '{safe_id}'")
-            track = cursor.fetchone()
+            track = track_offer(cursor, version, track_id)
             
             if not track:
-                send_telegram_message(chat_id, '❌ Трек не найден')
+                enqueue_message(cursor, chat_id, '❌ Трек не найден')
                 return {'ok': True}
             
             items = [{
@@ -1116,8 +1301,8 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
 
 Номер заказа: <code>{order_id}</code>
 
-🎵 Трек: {track['title']}
-💿 Альбом: {track['album_title']}
+🎵 Трек: {html.escape(track['title'])}
+💿 Альбом: {html.escape(track['album_title'])}
 💰 Сумма: {track['price']} ₽
 
 Для оплаты свяжитесь с администратором'''
@@ -1126,16 +1311,14 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
                 {'text': '« Назад к каталогу', 'callback_data': 'catalog'}
             ]]}
             
-            send_telegram_message(chat_id, msg, keyboard)
+            enqueue_message(cursor, chat_id, msg, keyboard)
             
         elif data.startswith('buy_album_'):
             album_id = data.replace('buy_album_', '')
-            safe_id = album_id.replace("'", "''")
-            cursor.execute(f"SELECT * FROM albums WHERE id = '{safe_id}'")
-            album = cursor.fetchone()
+            album = album_offer(cursor, version, album_id)
             
             if not album:
-                send_telegram_message(chat_id, '❌ Альбом не найден')
+                enqueue_message(cursor, chat_id, '❌ Альбом не найден')
                 return {'ok': True}
             
             items = [{
@@ -1152,8 +1335,8 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
 
 Номер заказа: <code>{order_id}</code>
 
-💿 Альбом: {album['title']}
-👤 Исполнитель: {album['artist']}
+💿 Альбом: {html.escape(album['title'])}
+👤 Исполнитель: {html.escape(album['artist'])}
 💰 Сумма: {album['price']} ₽
 
 Для оплаты свяжитесь с администратором'''
@@ -1162,132 +1345,35 @@ def handle_telegram_webhook(cursor, conn, body: Dict) -> Dict:
                 {'text': '« Назад к каталогу', 'callback_data': 'catalog'}
             ]]}
             
-            send_telegram_message(chat_id, msg, keyboard)
+            enqueue_message(cursor, chat_id, msg, keyboard)
     
     return {'ok': True}
 
 def create_web_order(cursor, conn, data: Dict) -> Dict:
-    order_id = f'order_{int(datetime.now().timestamp() * 1000)}'
-    name = data.get('name', '').replace("'", "''")
-    telegram = data.get('telegram', '').replace("'", "''")
-    email = data.get('email', '').replace("'", "''")
+    order_id = new_order_id()
+    name = data.get('name', '')
+    telegram = data.get('telegram', '')
+    email = data.get('email', '')
     items = data.get('items', [])
     total = data.get('total', 0)
     
-    items_json = json.dumps(items, ensure_ascii=False).replace("'", "''")
-    
-    cursor.execute(f'''
+    # Заказ и уведомление владельцу — одна транзакция. В Telegram уведомление уходит
+    # после send_after плановым telegram-worker или разбором во вебхуке бота:
+    # оформление заказа Bot API не вызывает вовсе
+    cursor.execute('''
         INSERT INTO orders (id, user_id, username, first_name, items, total_price, status, telegram_username, contact_info)
-        VALUES ('{order_id}', 0, '{telegram}', '{name}', '{items_json}', {total}, 'pending', '{telegram}', '{email}')
-    ''')
+        VALUES (%s, 0, %s, %s, %s, %s, 'pending', %s, %s)
+    ''', (order_id, telegram, name, json.dumps(items, ensure_ascii=False), total, telegram, email))
+    enqueue_order_notification(cursor, order_id, render_order(order_id, name, telegram, items, total))
     conn.commit()
     
-    msg = f'''✅ <b>Новый заказ с сайта!</b>
-
-Номер заказа: <code>{order_id}</code>
-👤 Покупатель: {name}
-📱 Telegram: @{telegram}
-
-<b>Заказ:</b>
-'''
-    
-    for item in items:
-        msg += f'• {item.get("title")} '
-        if item.get('quantity', 1) > 1:
-            msg += f'x{item.get("quantity")} '
-        msg += f'({item.get("price")} ₽)\n'
-    
-    msg += f'\n💰 <b>Итого: {total} ₽</b>\n\n'
-    msg += 'Свяжитесь с покупателем для уточнения деталей оплаты.'
-    
-    try:
-        import urllib.request
-        import urllib.parse
-        
-        token = os.environ.get('TELEGRAM_BOT_TOKEN')
-        owner_chat_id = os.environ.get('TELEGRAM_OWNER_CHAT_ID')
-        
-        if token and owner_chat_id:
-            url = f'https://api.telegram.org/bot{token}/sendMessage'
-            data_to_send = {
-                'chat_id': owner_chat_id,
-                'text': msg,
-                'parse_mode': 'HTML'
-            }
-            
-            req = urllib.request.Request(
-                url,
-                data=json.dumps(data_to_send).encode('utf-8'),
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            with urllib.request.urlopen(req) as response:
-                response_data = json.loads(response.read().decode('utf-8'))
-                print(f'[DEBUG] Notification sent to owner: {response_data}')
-        else:
-            print(f'[WARN] Missing TELEGRAM_BOT_TOKEN or TELEGRAM_OWNER_CHAT_ID')
-    except Exception as e:
-        print(f'[WARN] Failed to send Telegram notification: {e}')
-        import traceback
-        print(f'[ERROR] Traceback: {traceback.format_exc()}')
-    
     return {
         'success': True,
         'order_id': order_id,
         'message': 'Заказ успешно создан!'
     }
 
-def migrate_audio_to_s3(cursor, conn) -> Dict:
-    import base64
-    
-    cursor.execute("SELECT id, data FROM media_files WHERE file_type = 'audio' AND data NOT LIKE 'https://cdn.poehali.dev/%' LIMIT 5")
-    audio_files = cursor.fetchall()
-    
-    migrated = 0
-    failed = []
-    
-    for file_record in audio_files:
-        file_id = file_record['id']
-        base64_data = file_record['data']
-        
-        try:
-            print(f'[DEBUG] Migrating {file_id} to S3...')
-            
-            if base64_data.startswith('data:audio/'):
-                base64_data = base64_data.split(',', 1)[1]
-            
-            file_content = base64.b64decode(base64_data)
-            print(f'[DEBUG] Decoded {len(file_content)} bytes')
-            
-            s3_key = f'audio/{file_id}.mp3'
-            s3_url = upload_to_s3(file_content, s3_key, 'audio/mpeg')
-            print(f'[DEBUG] Uploaded to S3: {s3_url}')
-            
-            safe_id = file_id.replace("'", "''")
-            safe_url = s3_url.replace("'", "''")
-            cursor.execute(f"UPDATE media_files SET data = '{safe_url}' WHERE id = '{safe_id}'")
-            conn.commit()
-            
-            migrated += 1
-            print(f'[DEBUG] ✓ Migrated {file_id} to S3')
-        except Exception as e:
-            print(f'[ERROR] Failed to migrate {file_id}: {str(e)}')
-            failed.append({'id': file_id, 'error': str(e)})
-            import traceback
-            print(traceback.format_exc())
-    
-    return {
-        'success': True,
-        'migrated': migrated,
-        'failed': len(failed),
-        'failed_files': failed,
-        'remaining': 'call again to migrate more files'
-    }
-
 def convert_urls_to_base64(cursor, conn) -> Dict:
-    import urllib.request
-    import base64
-    
     cursor.execute("SELECT id, data FROM media_files WHERE file_type = 'audio' AND data LIKE 'http%'")
     url_files = cursor.fetchall()
     
@@ -1300,17 +1386,13 @@ def convert_urls_to_base64(cursor, conn) -> Dict:
         
         try:
             print(f'[DEBUG] Converting {file_id}: {url[:100]}...')
-            req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-            with urllib.request.urlopen(req, timeout=45) as response:
-                file_content = response.read()
-                audio_data_b64 = base64.b64encode(file_content).decode('utf-8')
-                safe_id = file_id.replace("'", "''")
-                cursor.execute(f"UPDATE media_files SET data = '{audio_data_b64.replace(chr(39), chr(39)*2)}' WHERE id = '{safe_id}'")
-                conn.commit()
-                converted += 1
-                print(f'[DEBUG] ✓ Converted {file_id} ({len(file_content)} bytes)')
+            stored = ingest_url_to_db(conn, url, file_id, 'audio')
+            conn.commit()
+            converted += 1
+            print(f"[DEBUG] ✓ Converted {file_id} ({stored['bytes']} bytes)")
         except Exception as e:
             print(f'[ERROR] Failed to convert {file_id}: {str(e)}')
+            conn.rollback()
             failed.append({'id': file_id, 'error': str(e)})
     
     return {
@@ -1318,4 +1400,4 @@ def convert_urls_to_base64(cursor, conn) -> Dict:
         'converted': converted,
         'failed': len(failed),
         'failed_files': failed
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,104 @@
+'''
+Business: Потоковая загрузка медиафайла по URL прямо в media_files или S3
+Args: conn — соединение с БД; URL файла, id медиафайла и его тип
+Returns: id, размер, sha256 и MIME-тип загруженного файла; URL в S3 при выгрузке туда
+'''
+
+import hashlib
+import os
+import urllib.request
+from typing import Any, Dict
+from media_store import SCHEMA, claim_blob, detect_mime, point_media
+from s3_migration import AUDIO_EXTENSIONS, put_object
+
+INGEST_CHUNK_BYTES = int(os.environ.get('INGEST_CHUNK_BYTES', str(1024 * 1024)))
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', str(200 * 1024 * 1024)))
+INGEST_TIMEOUT = float(os.environ.get('INGEST_TIMEOUT', '45'))
+# Первых байт хватает и на сигнатуру формата, и на распознавание HTML-страницы
+SNIFF_BYTES = 512
+
+
+class IngestStream:
+    '''
+    Файловый объект поверх HTTP-ответа: отдаёт уже прочитанное начало,
+    затем остальное; по пути считает sha256 и размер и обрывает слишком большой файл
+    '''
+
+    def __init__(self, response, head: bytes):
+        self._response = response
+        self._head = head
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = INGEST_CHUNK_BYTES
+        chunk = self._head[:size]
+        self._head = self._head[len(chunk):]
+        if len(chunk) < size:
+            chunk += self._response.read(size - len(chunk))
+        self.size += len(chunk)
+        if self.size > INGEST_MAX_BYTES:
+            raise ValueError(f'Файл больше {INGEST_MAX_BYTES // 1024 // 1024} МБ')
+        self.sha256.update(chunk)
+        return chunk
+
+
+def open_media_url(url: str, file_type: str):
+    '''Открывает URL и проверяет начало файла; возвращает (ответ, поток, MIME-тип)'''
+    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    response = urllib.request.urlopen(req, timeout=INGEST_TIMEOUT)
+    try:
+        content_type = response.headers.get('Content-Type', '')
+        head = response.read(SNIFF_BYTES)
+        if 'text/html' in content_type or head.lstrip()[:15].lower().startswith((b'<!doctype', b'<html')):
+            raise ValueError('Ссылка ведёт на страницу, а не на аудиофайл. Используйте прямую ссылку на скачивание MP3.')
+        if not head:
+            raise ValueError('Файл по ссылке пустой')
+    except Exception:
+        response.close()
+        raise
+    return response, IngestStream(response, head), detect_mime(head, file_type)
+
+
+def ingest_url_to_db(conn, url: str, media_id: str, file_type: str = 'audio') -> Dict[str, Any]:
+    '''
+    Складывает файл порциями по INGEST_CHUNK_BYTES в media_ingest_chunks и в конце
+    одним запросом собирает их в media_blobs: в памяти одновременно только одна
+    порция, а каждый байт пишется в БД по разу. Всё в одной транзакции, коммит — за вызывающим
+    '''
+    response, stream, mime_type = open_media_url(url, file_type)
+    with response, conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.media_ingest_chunks WHERE media_id = %s', (media_id,))
+        chunk_index = 0
+        while True:
+            chunk = stream.read(INGEST_CHUNK_BYTES)
+            if not chunk:
+                break
+            cur.execute(f'''
+                INSERT INTO {SCHEMA}.media_ingest_chunks (media_id, chunk_index, content)
+                VALUES (%s, %s, %s)
+            ''', (media_id, chunk_index, chunk))
+            chunk_index += 1
+        # Хеш известен только после чтения всего файла: если такое содержимое
+        # уже есть, собранные куски просто отбрасываются
+        content_hash = stream.sha256.hexdigest()
+        stored = claim_blob(cur, content_hash, f'''
+            INSERT INTO {SCHEMA}.media_blobs (sha256, content, byte_length, mime_type)
+            SELECT %s, string_agg(content, ''::bytea ORDER BY chunk_index), %s, %s
+            FROM {SCHEMA}.media_ingest_chunks WHERE media_id = %s
+        ''', (content_hash, stream.size, mime_type, media_id))
+        cur.execute(f'DELETE FROM {SCHEMA}.media_ingest_chunks WHERE media_id = %s', (media_id,))
+    point_media(conn, media_id, file_type, content_hash, stream.size, mime_type)
+    return {'id': media_id, 'bytes': stream.size, 'sha256': content_hash, 'mime_type': mime_type,
+            'deduplicated': not stored}
+
+
+def ingest_url_to_s3(url: str, media_id: str, file_type: str = 'audio') -> Dict[str, Any]:
+    '''Отправляет файл в S3 по мере скачивания; большие файлы уходят multipart-ом'''
+    response, stream, mime_type = open_media_url(url, file_type)
+    with response:
+        extension = AUDIO_EXTENSIONS.get(mime_type, mime_type.split('/')[-1])
+        s3_url = put_object(stream, f'{file_type}/{media_id}.{extension}', mime_type)
+    return {'id': media_id, 'bytes': stream.size, 'sha256': stream.sha256.hexdigest(),
+            'mime_type': mime_type, 'url': s3_url}
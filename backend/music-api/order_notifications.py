@@ -0,0 +1,112 @@
+'''
+Business: Уведомления владельцу о заказах с сайта через outbox: заказ не ждёт Telegram
+Args: cursor/conn — БД; TELEGRAM_OWNER_CHAT_ID, ORDER_DIGEST_WINDOW, ORDER_DIGEST_MAX из окружения
+Returns: id нового заказа; число переданных в очередь Telegram уведомлений, созревших к разбору
+'''
+
+import html
+import os
+import secrets
+import time
+from typing import Any, Dict, List
+from psycopg2.extras import RealDictCursor
+from telegram_queue import enqueue_message
+
+SCHEMA = 't_p39135821_musician_site_projec'
+# Заказы, пришедшие в пределах окна, уходят владельцу одним сообщением
+ORDER_DIGEST_WINDOW = float(os.environ.get('ORDER_DIGEST_WINDOW', '10'))
+ORDER_DIGEST_MAX = int(os.environ.get('ORDER_DIGEST_MAX', '20'))
+TELEGRAM_MESSAGE_BUDGET = 3800
+
+
+def new_order_id() -> str:
+    '''Время в мс для порядка и случайный хвост: одновременные заказы не совпадут'''
+    return f'order_{int(time.time() * 1000)}_{secrets.token_hex(4)}'
+
+
+def render_order(order_id: str, name: str, telegram: str, items: List[Dict[str, Any]], total: Any) -> str:
+    text = f'Номер заказа: <code>{order_id}</code>\n'
+    text += f'👤 Покупатель: {html.escape(name)}\n'
+    text += f'📱 Telegram: @{html.escape(telegram)}\n\n'
+    text += '<b>Заказ:</b>\n'
+    for item in items:
+        text += f'• {html.escape(str(item.get("title")))} '
+        if item.get('quantity', 1) > 1:
+            text += f'x{item.get("quantity")} '
+        text += f'({item.get("price")} ₽)\n'
+    text += f'\n💰 <b>Итого: {total} ₽</b>'
+    return text
+
+
+def enqueue_order_notification(cursor, order_id: str, text: str) -> None:
+    '''Запись уведомления со сроком отправки через ORDER_DIGEST_WINDOW; коммит — вместе с заказом'''
+    cursor.execute(f'''
+        INSERT INTO {SCHEMA}.order_notifications (order_id, text, send_after)
+        VALUES (%s, %s, NOW() + make_interval(secs => %s))
+    ''', (order_id, text, ORDER_DIGEST_WINDOW))
+
+
+def compose_messages(texts: List[str]) -> List[str]:
+    '''Один заказ — сообщение как раньше; несколько — дайджест в пределах лимита длины'''
+    footer = '\n\nСвяжитесь с покупателем для уточнения деталей оплаты.'
+    if len(texts) == 1:
+        return ['✅ <b>Новый заказ с сайта!</b>\n\n' + texts[0] + footer]
+    chunks: List[List[str]] = [[]]
+    size = 0
+    for text in texts:
+        if chunks[-1] and size + len(text) > TELEGRAM_MESSAGE_BUDGET:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(text)
+        size += len(text) + 3
+    return [f'✅ <b>Новых заказов с сайта: {len(chunk)}</b>\n\n' + '\n\n— — —\n\n'.join(chunk) + footer
+            for chunk in chunks]
+
+
+def dispatch_order_notifications(conn, deadline: float) -> int:
+    '''
+    Сводит накопившиеся уведомления в сообщения владельцу и ставит их в telegram_outbox
+    в той же транзакции, где уведомления помечаются отправленными. Пока не наступил
+    send_after самого старого и их меньше ORDER_DIGEST_MAX, ничего не делает: всплеск
+    заказов соберёт в один дайджест следующий разбор очереди, а не ожидание в потоке
+    '''
+    owner_chat_id = os.environ.get('TELEGRAM_OWNER_CHAT_ID')
+    if not owner_chat_id:
+        print('[WARN] TELEGRAM_OWNER_CHAT_ID not set, order notifications stay pending')
+        return 0
+    dispatched = 0
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        while time.monotonic() < deadline:
+            cur.execute(f'''
+                SELECT COUNT(*) AS pending, MIN(send_after) <= NOW() AS due
+                FROM {SCHEMA}.order_notifications WHERE status = 'pending'
+            ''')
+            row = cur.fetchone()
+            conn.rollback()
+            if not row['pending'] or (not row['due'] and row['pending'] < ORDER_DIGEST_MAX):
+                break
+
+            cur.execute(f'''
+                SELECT id, order_id, text FROM {SCHEMA}.order_notifications
+                WHERE status = 'pending'
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (ORDER_DIGEST_MAX,))
+            notifications = cur.fetchall()
+            if not notifications:
+                conn.rollback()
+                break
+            for text in compose_messages([n['text'] for n in notifications]):
+                enqueue_message(cur, int(owner_chat_id), text)
+            cur.execute(f'''
+                UPDATE {SCHEMA}.order_notifications SET status = 'dispatched', dispatched_at = NOW()
+                WHERE id = ANY(%s)
+            ''', ([n['id'] for n in notifications],))
+            cur.execute(f'''
+                UPDATE {SCHEMA}.orders SET notification_sent = true, updated_at = NOW()
+                WHERE id = ANY(%s)
+            ''', ([n['order_id'] for n in notifications],))
+            conn.commit()
+            dispatched += len(notifications)
+    return dispatched
@@ -0,0 +1,107 @@
+'''
+Business: Отложенная запись счётчиков прослушиваний и скачиваний треков
+Args: conn — соединение с БД; track_id и тип события (play/download)
+Returns: актуальные счётчики трека с учётом ещё не сброшенных событий
+'''
+
+import os
+import time
+from typing import Any, Dict
+from psycopg2.extras import RealDictCursor
+
+SCHEMA = 't_p39135821_musician_site_projec'
+PLAY_FLUSH_BATCH = int(os.environ.get('PLAY_FLUSH_BATCH', '50'))
+PLAY_FLUSH_INTERVAL = float(os.environ.get('PLAY_FLUSH_INTERVAL', '10'))
+PLAY_FLUSH_MAX_EVENTS = int(os.environ.get('PLAY_FLUSH_MAX_EVENTS', '5000'))
+
+_state: Dict[str, Any] = {'since_flush': 0, 'last_flush': time.monotonic()}
+_stats: Dict[str, int] = {'recorded': 0, 'flushes': 0, 'flushed_events': 0}
+
+
+def record_event(conn, track_id: str, kind: str = 'play') -> None:
+    '''
+    Событие пишется в append-only play_events без блокировки строки track_stats;
+    в track_stats оно попадает при следующем сбросе
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f'INSERT INTO {SCHEMA}.play_events (track_id, kind) VALUES (%s, %s)', (track_id, kind))
+    conn.commit()
+    _stats['recorded'] += 1
+    _state['since_flush'] += 1
+    if (_state['since_flush'] >= PLAY_FLUSH_BATCH
+            or time.monotonic() - _state['last_flush'] >= PLAY_FLUSH_INTERVAL):
+        flush_events(conn)
+
+
+def flush_events(conn, max_events: int = PLAY_FLUSH_MAX_EVENTS) -> int:
+    '''
+    Переносит накопленные события в track_stats одним upsert-ом по всем трекам.
+    SKIP LOCKED позволяет нескольким экземплярам функции сбрасывать параллельно
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            WITH moved AS (
+                DELETE FROM {SCHEMA}.play_events
+                WHERE id IN (
+                    SELECT id FROM {SCHEMA}.play_events
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING track_id, kind, created_at
+            ), totals AS (
+                SELECT track_id,
+                       COUNT(*) FILTER (WHERE kind = 'play') AS plays,
+                       COUNT(*) FILTER (WHERE kind = 'download') AS downloads,
+                       MAX(created_at) FILTER (WHERE kind = 'play') AS last_played_at,
+                       MAX(created_at) FILTER (WHERE kind = 'download') AS last_downloaded_at,
+                       COUNT(*) AS events
+                FROM moved
+                GROUP BY track_id
+            ), upserted AS (
+                INSERT INTO {SCHEMA}.track_stats
+                    (track_id, plays_count, downloads_count, last_played_at, last_downloaded_at, created_at, updated_at)
+                SELECT track_id, plays, downloads, last_played_at, last_downloaded_at, NOW(), NOW()
+                FROM totals
+                ON CONFLICT (track_id) DO UPDATE SET
+                    plays_count = COALESCE({SCHEMA}.track_stats.plays_count, 0) + EXCLUDED.plays_count,
+                    downloads_count = COALESCE({SCHEMA}.track_stats.downloads_count, 0) + EXCLUDED.downloads_count,
+                    last_played_at = COALESCE(EXCLUDED.last_played_at, {SCHEMA}.track_stats.last_played_at),
+                    last_downloaded_at = COALESCE(EXCLUDED.last_downloaded_at, {SCHEMA}.track_stats.last_downloaded_at),
+                    updated_at = NOW()
+                RETURNING track_id
+            )
+            SELECT COALESCE(SUM(events), 0) AS flushed FROM totals
+        ''', (max_events,))
+        flushed = int(cur.fetchone()['flushed'])
+    conn.commit()
+    _state['since_flush'] = 0
+    _state['last_flush'] = time.monotonic()
+    _stats['flushes'] += 1
+    _stats['flushed_events'] += flushed
+    return flushed
+
+
+def get_live_counts(conn, track_id: str) -> Dict[str, Any]:
+    '''Счётчики из track_stats плюс ещё не сброшенные события'''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT %s AS track_id,
+                   COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) AS plays_count,
+                   COALESCE(ts.downloads_count, 0) + COALESCE(ps.downloads_count, 0) AS downloads_count,
+                   ts.last_played_at, ts.last_downloaded_at
+            FROM (SELECT 1) one
+            LEFT JOIN {SCHEMA}.track_stats ts ON ts.track_id = %s
+            LEFT JOIN {SCHEMA}.pending_track_stats ps ON ps.track_id = %s
+        ''', (track_id, track_id, track_id))
+        return dict(cur.fetchone())
+
+
+def counter_stats() -> Dict[str, Any]:
+    return {
+        **_stats,
+        'since_flush': _state['since_flush'],
+        'seconds_since_flush': round(time.monotonic() - _state['last_flush'], 3),
+        'flush_batch': PLAY_FLUSH_BATCH,
+        'flush_interval': PLAY_FLUSH_INTERVAL
+    }
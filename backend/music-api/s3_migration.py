@@ -0,0 +1,241 @@
+'''
+Business: Перенос аудио из media_files в S3 пулом потоков с чекпоинтом между вызовами
+Args: S3_ENDPOINT_URL, S3_BUCKET, S3_PUBLIC_URL, S3_MIGRATE_* из окружения; соединение с БД
+Returns: отчёт о переносе — сколько файлов и байт, скорость, позиция для продолжения
+'''
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from psycopg2.extras import RealDictCursor
+from db import DB_POOL_MAX, get_connection
+from media_store import get_media_meta, read_media_range, save_media_reference
+
+SCHEMA = 't_p39135821_musician_site_projec'
+
+# Эндпоинт и публичный адрес переопределяются, чтобы гонять перенос на moto или MinIO
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL', '')
+S3_MIGRATE_WORKERS = int(os.environ.get('S3_MIGRATE_WORKERS', '3'))
+S3_MIGRATE_BATCH = int(os.environ.get('S3_MIGRATE_BATCH', '12'))
+S3_MIGRATE_TIME_BUDGET = float(os.environ.get('S3_MIGRATE_TIME_BUDGET', '20'))
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNK = int(os.environ.get('S3_MULTIPART_CHUNK', str(8 * 1024 * 1024)))
+
+AUDIO_EXTENSIONS = {
+    'audio/mpeg': 'mp3',
+    'audio/ogg': 'ogg',
+    'audio/flac': 'flac',
+    'audio/wav': 'wav'
+}
+
+_client_lock = threading.Lock()
+_client = None
+
+
+def get_s3_client():
+    '''Один клиент boto3 на экземпляр функции: клиенты потокобезопасны'''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                _client = boto3.client('s3',
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+                )
+    return _client
+
+
+def public_url(key: str) -> str:
+    if S3_PUBLIC_URL:
+        return f"{S3_PUBLIC_URL.rstrip('/')}/{key}"
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+def _transfer_config():
+    from boto3.s3.transfer import TransferConfig
+    # Параллельность — на уровне файлов, поэтому части одного файла идут в потоке воркера
+    return TransferConfig(
+        multipart_threshold=S3_MULTIPART_THRESHOLD,
+        multipart_chunksize=S3_MULTIPART_CHUNK,
+        max_concurrency=1,
+        use_threads=False
+    )
+
+
+def put_object(fileobj, key: str, content_type: str, client=None) -> str:
+    '''Загрузка файла; начиная с S3_MULTIPART_THRESHOLD — multipart по S3_MULTIPART_CHUNK'''
+    (client or get_s3_client()).upload_fileobj(
+        fileobj, S3_BUCKET, key,
+        ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': 'public, max-age=31536000',
+            'Metadata': {'Access-Control-Allow-Origin': '*'}
+        },
+        Config=_transfer_config()
+    )
+    return public_url(key)
+
+
+class MediaReader:
+    '''Файловый объект поверх media_files: читает из БД окнами, не загружая файл целиком'''
+
+    def __init__(self, conn, meta: Dict[str, Any]):
+        self._conn = conn
+        self._meta = meta
+        self._pos = 0
+        self.size = meta['byte_length']
+
+    def read(self, size: int = -1) -> bytes:
+        if self._pos >= self.size:
+            return b''
+        if size is None or size < 0:
+            size = self.size - self._pos
+        end = min(self._pos + size, self.size) - 1
+        chunk = read_media_range(self._conn, self._meta, self._pos, end)
+        self._pos = end + 1
+        return chunk
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self._pos, 2: self.size}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        # s3transfer закрывает файл после одиночного PUT; соединение закрывает migrate_file
+        pass
+
+
+def migrate_file(media_id: str, client=None) -> Dict[str, Any]:
+    '''Переносит один файл в собственном соединении из пула — воркеры не делят курсоры'''
+    conn = get_connection()
+    try:
+        meta = get_media_meta(conn, media_id)
+        if not meta or meta['url'] or not meta['byte_length']:
+            raise Exception('Media file is empty')
+        extension = AUDIO_EXTENSIONS.get(meta['mime_type'], 'mp3')
+        url = put_object(MediaReader(conn, meta), f'audio/{media_id}.{extension}', meta['mime_type'], client)
+        save_media_reference(conn, media_id, 'audio', url)
+        conn.commit()
+        return {'id': media_id, 'bytes': meta['byte_length'], 'url': url}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def load_checkpoint(conn, job: str) -> Dict[str, Any]:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.s3_migration_checkpoints (job) VALUES (%s)
+            ON CONFLICT (job) DO NOTHING
+        ''', (job,))
+        cur.execute(f'SELECT * FROM {SCHEMA}.s3_migration_checkpoints WHERE job = %s', (job,))
+        checkpoint = dict(cur.fetchone())
+    conn.commit()
+    return checkpoint
+
+
+def save_checkpoint(conn, job: str, last_id: str, migrated: int, failed: int, uploaded: int, done: bool) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            UPDATE {SCHEMA}.s3_migration_checkpoints
+            SET last_id = %s,
+                migrated_count = migrated_count + %s,
+                failed_count = failed_count + %s,
+                bytes_uploaded = bytes_uploaded + %s,
+                done = %s,
+                updated_at = NOW()
+            WHERE job = %s
+        ''', (last_id, migrated, failed, uploaded, done, job))
+    conn.commit()
+
+
+def reset_checkpoint(conn, job: str) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.s3_migration_checkpoints WHERE job = %s', (job,))
+    conn.commit()
+
+
+def migrate_audio(conn, workers: int = S3_MIGRATE_WORKERS, batch_size: int = S3_MIGRATE_BATCH,
+                  time_budget: float = S3_MIGRATE_TIME_BUDGET, job: str = 'audio',
+                  client=None) -> Dict[str, Any]:
+    '''
+    Идёт по media_files в порядке id пачками; пачка загружается параллельно,
+    после неё чекпоинт сдвигается на последний id. Упавшие файлы не блокируют
+    перенос — они попадают в failed_files и повторяются на следующем проходе
+    '''
+    # Одно соединение занято вызывающим, остальные достаются воркерам
+    workers = max(1, min(workers, DB_POOL_MAX - 1))
+    started = time.monotonic()
+    checkpoint = load_checkpoint(conn, job)
+    # Завершённый проход начинается заново: перенесённые файлы фильтр уже не выберет,
+    # а добавленные после прохода и упавшие будут обработаны
+    last_id = '' if checkpoint['done'] else checkpoint['last_id']
+    migrated = 0
+    uploaded = 0
+    failed: List[Dict[str, str]] = []
+    done = False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while not done and time.monotonic() - started < time_budget:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(f'''
+                    SELECT id FROM {SCHEMA}.media_files
+                    WHERE file_type = 'audio'
+                      AND (content IS NOT NULL OR content_hash IS NOT NULL
+                           OR (data <> '' AND data NOT LIKE 'http%%'))
+                      AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                ''', (last_id, batch_size))
+                ids = [row['id'] for row in cur.fetchall()]
+            conn.commit()
+            if not ids:
+                done = True
+                save_checkpoint(conn, job, last_id, 0, 0, 0, True)
+                break
+
+            futures = [(media_id, executor.submit(migrate_file, media_id, client)) for media_id in ids]
+            batch_migrated = 0
+            batch_bytes = 0
+            batch_failed = 0
+            for media_id, future in futures:
+                try:
+                    result = future.result()
+                    batch_migrated += 1
+                    batch_bytes += result['bytes']
+                    print(f"[DEBUG] ✓ Migrated {media_id} to S3 ({result['bytes']} bytes)")
+                except Exception as e:
+                    print(f'[ERROR] Failed to migrate {media_id}: {str(e)}')
+                    batch_failed += 1
+                    failed.append({'id': media_id, 'error': str(e)})
+            last_id = ids[-1]
+            save_checkpoint(conn, job, last_id, batch_migrated, batch_failed, batch_bytes, False)
+            migrated += batch_migrated
+            uploaded += batch_bytes
+
+    elapsed = time.monotonic() - started
+    return {
+        'success': True,
+        'migrated': migrated,
+        'failed': len(failed),
+        'failed_files': failed,
+        'bytes_uploaded': uploaded,
+        'workers': workers,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(migrated / elapsed, 3) if elapsed else 0.0,
+        'mb_per_second': round(uploaded / 1024 / 1024 / elapsed, 3) if elapsed else 0.0,
+        'checkpoint': last_id,
+        'done': done,
+        'remaining': None if done else 'call again to resume from checkpoint'
+    }
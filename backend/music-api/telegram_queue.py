@@ -0,0 +1,343 @@
+'''
+Business: Очереди Telegram-бота: входящие обновления с дедупликацией по update_id и исходящие сообщения
+Args: conn — соединение с БД; TELEGRAM_BOT_TOKEN, TELEGRAM_API_URL, TELEGRAM_* лимиты и бюджеты из окружения
+Returns: receive_update — принято ли новое обновление; run_worker и drain_inline — отчёт об обработке и отправке
+'''
+
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable, Dict, List, Optional
+from psycopg2.extras import Json, RealDictCursor
+from db import get_connection
+
+SCHEMA = 't_p39135821_musician_site_projec'
+# Переопределяется, чтобы гонять воркер против локальной заглушки Bot API
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_TIMEOUT = float(os.environ.get('TELEGRAM_TIMEOUT', '10'))
+# Лимиты Bot API: около 30 сообщений в секунду всего и одно в секунду в один чат
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_INTERVAL = float(os.environ.get('TELEGRAM_CHAT_INTERVAL', '1'))
+TELEGRAM_SEND_MAX_ATTEMPTS = int(os.environ.get('TELEGRAM_SEND_MAX_ATTEMPTS', '5'))
+TELEGRAM_UPDATE_MAX_ATTEMPTS = int(os.environ.get('TELEGRAM_UPDATE_MAX_ATTEMPTS', '3'))
+TELEGRAM_OUTBOX_BATCH = int(os.environ.get('TELEGRAM_OUTBOX_BATCH', '20'))
+TELEGRAM_WORKER_BUDGET = float(os.environ.get('TELEGRAM_WORKER_BUDGET', '20'))
+# Очередь разбирается прямо в вызове вебхука, до ответа, но не дольше этого бюджета:
+# после ответа экземпляр функции могут заморозить. Отложенное (окно чата, повторы,
+# дайджест заказов) досылает маршрут telegram-worker по расписанию
+TELEGRAM_WORKER_INLINE = os.environ.get('TELEGRAM_WORKER_INLINE', '1') == '1'
+TELEGRAM_INLINE_BUDGET = float(os.environ.get('TELEGRAM_INLINE_BUDGET', '2'))
+
+_local = threading.local()
+_lock = threading.Lock()
+_inline_lock = threading.Lock()
+_rate: Dict[str, Any] = {'global_next': 0.0, 'chats': {}}
+_stats: Dict[str, int] = {
+    'received': 0,
+    'duplicates': 0,
+    'processed': 0,
+    'update_errors': 0,
+    'dead_lettered': 0,
+    'sent': 0,
+    'retried': 0,
+    'rate_limited': 0,
+    'failed': 0
+}
+
+
+def receive_update(conn, update: Dict[str, Any]) -> bool:
+    '''Сохраняет обновление; False — такое update_id уже было (повтор от Telegram)'''
+    update_id = update.get('update_id')
+    if update_id is None:
+        raise ValueError('update_id is required')
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.telegram_updates (update_id, payload) VALUES (%s, %s)
+            ON CONFLICT (update_id) DO NOTHING
+        ''', (update_id, Json(update)))
+        accepted = cur.rowcount == 1
+    conn.commit()
+    with _lock:
+        _stats['received' if accepted else 'duplicates'] += 1
+    return accepted
+
+
+def enqueue_call(cursor, chat_id: int, method: str, payload: Dict[str, Any]) -> None:
+    '''Ставит вызов Bot API в очередь; уходит при коммите транзакции вызывающего'''
+    cursor.execute(f'''
+        INSERT INTO {SCHEMA}.telegram_outbox (chat_id, method, payload) VALUES (%s, %s, %s)
+    ''', (chat_id, method, Json(payload)))
+
+
+def enqueue_message(cursor, chat_id: int, text: str, reply_markup: Optional[Dict] = None) -> None:
+    payload: Dict[str, Any] = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
+    if reply_markup:
+        payload['reply_markup'] = reply_markup
+    enqueue_call(cursor, chat_id, 'sendMessage', payload)
+
+
+def _api_connection() -> http.client.HTTPConnection:
+    '''Keep-alive соединение с Bot API на поток'''
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        parsed = urllib.parse.urlparse(TELEGRAM_API_URL)
+        connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        conn = connection_class(parsed.netloc, timeout=TELEGRAM_TIMEOUT)
+        _local.conn = conn
+    return conn
+
+
+def _drop_connection() -> None:
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def call_api(method: str, payload: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+    '''
+    Вызов Bot API. Ответ — JSON Telegram с полем status; сетевые ошибки
+    поднимаются как OSError / HTTPException. С deadline (time.monotonic) таймаут
+    сокета не выходит за него, и повтора после него нет
+    '''
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not token:
+        raise RuntimeError('TELEGRAM_BOT_TOKEN not found')
+    path = f"{urllib.parse.urlparse(TELEGRAM_API_URL).path.rstrip('/')}/bot{token}/{method}"
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    for attempt in range(2):
+        timeout = TELEGRAM_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise TimeoutError('Telegram time budget exhausted')
+        conn = _api_connection()
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            data = response.read()
+            break
+        except (http.client.HTTPException, OSError) as e:
+            _drop_connection()
+            # Простаивавшее соединение могло закрыться — одна попытка на новом
+            if attempt or isinstance(e, TimeoutError):
+                raise
+    if response.will_close:
+        _drop_connection()
+    try:
+        result = json.loads(data.decode('utf-8'))
+    except ValueError:
+        result = {'ok': False, 'description': data[:200].decode('utf-8', 'replace')}
+    result['status'] = response.status
+    return result
+
+
+def _take_slot(chat_id: int, retry_after: float = 0.0) -> None:
+    # Время окон — настенное: отложенные сообщения одного чата получают одинаковый
+    # next_attempt_at и при следующей выборке идут в прежнем порядке id
+    now = time.time()
+    _rate['global_next'] = max(_rate['global_next'], now) + 1 / TELEGRAM_GLOBAL_RATE
+    _rate['chats'][chat_id] = now + max(TELEGRAM_CHAT_INTERVAL, retry_after)
+    # Словарь чатов не растёт бесконечно: прошедшие окна не нужны
+    if len(_rate['chats']) > 1000:
+        _rate['chats'] = {k: v for k, v in _rate['chats'].items() if v > now}
+
+
+def _reschedule(cur, message_id: int, at: float, **fields: Any) -> None:
+    assignments = ''.join(f', {name} = %s' for name in fields)
+    cur.execute(f'''
+        UPDATE {SCHEMA}.telegram_outbox SET next_attempt_at = to_timestamp(%s){assignments} WHERE id = %s
+    ''', (at, *fields.values(), message_id))
+
+
+def _send_one(cur, message: Dict[str, Any], deadline: float) -> None:
+    chat_id = message['chat_id']
+    chat_next = _rate['chats'].get(chat_id, 0.0)
+    if chat_next > time.time():
+        # Чат ещё в своём окне — сообщение вернётся в выборку, когда окно пройдёт
+        _reschedule(cur, message['id'], chat_next)
+        return
+    global_wait = _rate['global_next'] - time.time()
+    if global_wait > 0:
+        time.sleep(min(global_wait, max(deadline - time.monotonic(), 0)))
+        if time.monotonic() >= deadline:
+            return
+
+    attempts = message['attempts'] + 1
+    try:
+        # Отправка не переживает бюджет разбора: не дождались ответа — это
+        # обычная неудачная попытка, повтор будет по расписанию
+        result = call_api(message['method'], message['payload'], deadline)
+    except Exception as e:
+        result = {'ok': False, 'status': 0, 'description': str(e)}
+    retry_after = float((result.get('parameters') or {}).get('retry_after', 0))
+    _take_slot(chat_id, retry_after)
+
+    if result.get('ok'):
+        cur.execute(f'''
+            UPDATE {SCHEMA}.telegram_outbox
+            SET status = 'sent', attempts = %s, sent_at = NOW(), last_error = NULL WHERE id = %s
+        ''', (attempts, message['id']))
+        _stats['sent'] += 1
+        return
+
+    error = f"{result.get('status')}: {result.get('description', '')}"[:500]
+    status = result.get('status') or 0
+    if status == 429:
+        # Флуд-контроль: ждём сколько сказал Telegram, попытка не засчитывается
+        _stats['rate_limited'] += 1
+        _reschedule(cur, message['id'], _rate['chats'][chat_id], last_error=error)
+        return
+    # 4xx кроме 429 (бот заблокирован, неверный запрос) повтором не исправить
+    if 400 <= status < 500 or attempts >= TELEGRAM_SEND_MAX_ATTEMPTS:
+        _stats['failed'] += 1
+        print(f'[ERROR] Telegram {message["method"]} to {chat_id} failed: {error}')
+        cur.execute(f'''
+            UPDATE {SCHEMA}.telegram_outbox SET status = 'failed', attempts = %s, last_error = %s WHERE id = %s
+        ''', (attempts, error, message['id']))
+        return
+    _stats['retried'] += 1
+    _reschedule(cur, message['id'], time.time() + min(2 ** attempts, 300), attempts=attempts, last_error=error)
+
+
+def drain_outbox(conn, deadline: float, wait_deferred: bool = True) -> int:
+    '''
+    Отправляет созревшие сообщения по порядку id, пачками по TELEGRAM_OUTBOX_BATCH.
+    С wait_deferred ждёт и отложенные, если они созревают до deadline
+    '''
+    handled = 0
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        while time.monotonic() < deadline:
+            cur.execute(f'''
+                SELECT id, chat_id, method, payload, attempts FROM {SCHEMA}.telegram_outbox
+                WHERE status = 'pending' AND next_attempt_at <= NOW()
+                ORDER BY next_attempt_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ''', (TELEGRAM_OUTBOX_BATCH,))
+            batch = cur.fetchall()
+            if not batch:
+                # Ближайшее отложенное сообщение ждём, если оно успевает в бюджет
+                cur.execute(f'''
+                    SELECT EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()) AS wait
+                    FROM {SCHEMA}.telegram_outbox WHERE status = 'pending'
+                ''')
+                wait = cur.fetchone()['wait']
+                conn.rollback()
+                if not wait_deferred or wait is None or time.monotonic() + float(wait) >= deadline:
+                    break
+                time.sleep(max(float(wait), 0.05))
+                continue
+            for message in batch:
+                if time.monotonic() >= deadline:
+                    break
+                _send_one(cur, message, deadline)
+                handled += 1
+            conn.commit()
+    return handled
+
+
+def process_updates(conn, handle_update: Callable, deadline: float) -> int:
+    '''
+    Обрабатывает сохранённые обновления по одному в транзакции: ответы бота
+    попадают в outbox вместе с отметкой об обработке, поэтому сбой не даёт дублей.
+    Упавшее обновление откладывается до следующего запуска и не держит очередь;
+    после TELEGRAM_UPDATE_MAX_ATTEMPTS попыток оно остаётся в статусе failed
+    '''
+    processed = 0
+    failed: List[int] = []
+    while time.monotonic() < deadline:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f'''
+            SELECT update_id, payload, attempts FROM {SCHEMA}.telegram_updates
+            WHERE status = 'pending' AND update_id <> ALL(%s::bigint[])
+            ORDER BY update_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ''', (failed,))
+        update = cursor.fetchone()
+        if not update:
+            conn.rollback()
+            cursor.close()
+            break
+        try:
+            handle_update(cursor, conn, update['payload'])
+            cursor.execute(f'''
+                UPDATE {SCHEMA}.telegram_updates SET status = 'done', processed_at = NOW() WHERE update_id = %s
+            ''', (update['update_id'],))
+            conn.commit()
+            processed += 1
+            with _lock:
+                _stats['processed'] += 1
+        except Exception as e:
+            conn.rollback()
+            print(f'[ERROR] Telegram update {update["update_id"]} failed: {e}')
+            attempts = update['attempts'] + 1
+            cursor.execute(f'''
+                UPDATE {SCHEMA}.telegram_updates
+                SET attempts = %s, last_error = %s, status = %s,
+                    processed_at = CASE WHEN %s THEN NOW() END
+                WHERE update_id = %s
+            ''', (attempts, str(e)[:500], 'failed' if attempts >= TELEGRAM_UPDATE_MAX_ATTEMPTS else 'pending',
+                  attempts >= TELEGRAM_UPDATE_MAX_ATTEMPTS, update['update_id']))
+            conn.commit()
+            failed.append(update['update_id'])
+            with _lock:
+                _stats['update_errors'] += 1
+                if attempts >= TELEGRAM_UPDATE_MAX_ATTEMPTS:
+                    _stats['dead_lettered'] += 1
+        finally:
+            cursor.close()
+    return processed
+
+
+def run_worker(handle_update: Callable, time_budget: float = TELEGRAM_WORKER_BUDGET,
+               dispatch: Optional[Callable] = None, wait_deferred: bool = True) -> Dict[str, Any]:
+    '''
+    Обработка входящих, затем dispatch(conn, deadline) — другие источники
+    сообщений, — затем отправка исходящих в пределах time_budget секунд
+    '''
+    started = time.monotonic()
+    deadline = started + time_budget
+    conn = get_connection()
+    try:
+        processed = process_updates(conn, handle_update, deadline)
+        dispatched = dispatch(conn, deadline) if dispatch else 0
+        sent = drain_outbox(conn, deadline, wait_deferred)
+    finally:
+        conn.close()
+    return {
+        'processed': processed,
+        'dispatched': dispatched,
+        'handled_messages': sent,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        'stats': queue_stats()
+    }
+
+
+def drain_inline(handle_update: Callable, dispatch: Optional[Callable] = None) -> Optional[Dict[str, Any]]:
+    '''
+    Разбирает очереди в текущем вызове, пока не истечёт TELEGRAM_INLINE_BUDGET, и
+    не ждёт отложенных сообщений. Если разбор в этом экземпляре уже идёт, не делает ничего
+    '''
+    if not TELEGRAM_WORKER_INLINE or not _inline_lock.acquire(blocking=False):
+        return None
+    try:
+        return run_worker(handle_update, TELEGRAM_INLINE_BUDGET, dispatch, wait_deferred=False)
+    except Exception as e:
+        # Сбой разбора не должен превращаться в ошибку вебхука: иначе Telegram повторит доставку
+        print(f'[ERROR] Telegram inline drain failed: {e}')
+        return None
+    finally:
+        _inline_lock.release()
+
+
+def queue_stats() -> Dict[str, Any]:
+    with _lock:
+        return {**_stats, 'inline_running': _inline_lock.locked()}
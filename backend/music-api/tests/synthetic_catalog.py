@@ -0,0 +1,41 @@
+'''Синтетический каталог для замеров: альбомы новее любых настоящих, чтобы занять первые страницы'''
+
+from datetime import datetime, timedelta
+
+PREFIX = 'synthetic_'
+STARTED = datetime(2099, 1, 1)
+
+
+def seed(conn, albums: int = 100, tracks_per_album: int = 10) -> list:
+    album_ids = []
+    with conn.cursor() as cur:
+        drop(cur)
+        for a in range(albums):
+            album_id = f'{PREFIX}album_{a:03d}'
+            album_ids.append(album_id)
+            created_at = STARTED + timedelta(minutes=a)
+            cur.execute('''
+                INSERT INTO albums (id, title, artist, description, price, created_at)
+                VALUES (%s, %s, 'Synthetic Artist', %s, 500, %s)
+            ''', (album_id, f'Album {a}', f'Description of album {a} ' * 5, created_at))
+            for t in range(tracks_per_album):
+                track_id = f'{PREFIX}track_{a:03d}_{t:02d}'
+                cur.execute('''
+                    INSERT INTO tracks (id, album_id, title, duration, price, track_order, created_at)
+                    VALUES (%s, %s, %s, '3:30', 129, %s, %s)
+                ''', (track_id, album_id, f'Track {t} of album {a}', t, created_at))
+                cur.execute('INSERT INTO track_stats (track_id, plays_count) VALUES (%s, %s)', (track_id, a * t))
+    conn.commit()
+    return album_ids
+
+
+def drop(cur) -> None:
+    cur.execute(f"DELETE FROM track_stats WHERE track_id LIKE '{PREFIX}%%'")
+    cur.execute(f"DELETE FROM tracks WHERE id LIKE '{PREFIX}%%'")
+    cur.execute(f"DELETE FROM albums WHERE id LIKE '{PREFIX}%%'")
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        drop(cur)
+    conn.commit()
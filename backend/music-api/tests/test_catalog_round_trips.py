@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from psycopg2.extras import RealDictCursor
+
+import db
+import index
+import synthetic_catalog
+
+ALBUMS = 100
+RUNS = 5
+
+
+class CountingCursor:
+    '''Считает запросы к БД: каждый execute — один обмен с сервером'''
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.round_trips = 0
+
+    def execute(self, *args, **kwargs):
+        self.round_trips += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@pytest.fixture(scope='module')
+def catalog(database_url):
+    conn = db.get_connection()
+    album_ids = synthetic_catalog.seed(conn, ALBUMS)
+    yield album_ids
+    synthetic_catalog.cleanup(conn)
+    conn.close()
+
+
+def albums_one_query_per_album(cursor):
+    '''Прежний get_albums: список альбомов и отдельный SELECT треков на каждый'''
+    cursor.execute('''
+        SELECT a.id, a.title, a.artist, a.cover, a.price, a.description, a.year, a.created_at, a.updated_at,
+               (SELECT COUNT(*) FROM tracks t WHERE t.album_id = a.id) as tracks_count
+        FROM albums a
+        ORDER BY a.created_at DESC, a.id DESC
+        LIMIT 100
+    ''')
+    albums = [dict(row) for row in cursor.fetchall()]
+    for album in albums:
+        cursor.execute('''
+            SELECT t.id, t.album_id, t.title, t.duration, t.price, t.cover, t.track_order, t.created_at,
+                   COALESCE(ts.plays_count, 0) as plays_count
+            FROM tracks t
+            LEFT JOIN track_stats ts ON t.id = ts.track_id
+            WHERE t.album_id = %s
+            ORDER BY t.track_order, t.created_at
+            LIMIT 50
+        ''', (album['id'],))
+        album['trackList'] = [dict(row) for row in cursor.fetchall()]
+    return albums
+
+
+def measure(load):
+    '''Лучшее время из RUNS прогонов на соединении из пула и число обменов за прогон'''
+    best = None
+    for _ in range(RUNS):
+        conn = db.get_connection()
+        try:
+            cursor = CountingCursor(conn.cursor(cursor_factory=RealDictCursor))
+            started = time.perf_counter()
+            albums = load(cursor)
+            elapsed = time.perf_counter() - started
+            conn.rollback()
+        finally:
+            conn.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return albums, cursor.round_trips, best
+
+
+def test_album_catalog_is_two_round_trips(catalog):
+    before, before_trips, before_time = measure(albums_one_query_per_album)
+    after, after_trips, after_time = measure(index.get_albums)
+    print(f'\n[BENCH] get_albums, {ALBUMS} albums: per-album queries {before_trips} round trips '
+          f'{before_time * 1000:.1f} ms; single track query {after_trips} round trips {after_time * 1000:.1f} ms')
+
+    assert [album['id'] for album in after] == sorted(catalog, reverse=True)
+    assert before_trips == 1 + ALBUMS
+    assert after_trips == 2
+    # Та же форма ответа: альбомы и их trackList совпадают с прежней сборкой
+    for old, new in zip(before, after):
+        assert [t['id'] for t in new['trackList']] == [t['id'] for t in old['trackList']]
+        assert [t['plays_count'] for t in new['trackList']] == [t['plays_count'] for t in old['trackList']]
+    assert after_time < before_time
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import tracemalloc
+
+import pytest
+
+import media_ingest
+from db import get_connection
+from media_store import SCHEMA, read_media
+
+CHUNK = 256 * 1024
+CHUNKS = 64
+
+
+@pytest.fixture
+def conn(database_url):
+    conn = get_connection()
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {SCHEMA}.media_files WHERE id LIKE 'ingest_test_%%'")
+    conn.commit()
+    conn.close()
+
+
+def serve_file(http_stub, payload_chunk: bytes, chunks: int) -> str:
+    '''Отдаёт файл из chunks одинаковых кусков потоком, не собирая его в памяти теста'''
+    def route(method, path, query, body):
+        return 200, {'Content-Type': 'audio/mpeg', 'Content-Length': str(len(payload_chunk) * chunks)}, \
+            (payload_chunk for _ in range(chunks))
+    http_stub.routes['/track.mp3'] = route
+    return f'{http_stub.url}/track.mp3'
+
+
+def test_ingest_memory_is_bounded_by_chunk_size(monkeypatch, conn, http_stub):
+    monkeypatch.setattr(media_ingest, 'INGEST_CHUNK_BYTES', CHUNK)
+    payload_chunk = b'ID3' + os.urandom(CHUNK - 3)
+    url = serve_file(http_stub, payload_chunk, CHUNKS)
+
+    tracemalloc.start()
+    try:
+        result = media_ingest.ingest_url_to_db(conn, url, 'ingest_test_big', 'audio')
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    conn.commit()
+
+    total = CHUNK * CHUNKS
+    assert result['bytes'] == total
+    # Файл в 64 раза больше порции, а пик памяти — несколько порций
+    # (сама порция и её экранированная копия в тексте запроса)
+    assert peak < 8 * CHUNK, f'peak {peak} bytes for a {total}-byte file'
+
+    expected = hashlib.sha256()
+    for _ in range(CHUNKS):
+        expected.update(payload_chunk)
+    assert result['sha256'] == expected.hexdigest()
+    stored, meta = read_media(conn, 'ingest_test_big')
+    assert hashlib.sha256(stored).hexdigest() == expected.hexdigest()
+    assert meta['mime_type'] == 'audio/mpeg'
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.media_ingest_chunks WHERE media_id = 'ingest_test_big'")
+        assert cur.fetchone()[0] == 0
+
+
+def test_same_content_is_stored_once(monkeypatch, conn, http_stub):
+    monkeypatch.setattr(media_ingest, 'INGEST_CHUNK_BYTES', CHUNK)
+    url = serve_file(http_stub, b'ID3' + os.urandom(CHUNK - 3), 3)
+
+    first = media_ingest.ingest_url_to_db(conn, url, 'ingest_test_a', 'audio')
+    second = media_ingest.ingest_url_to_db(conn, url, 'ingest_test_b', 'audio')
+    conn.commit()
+
+    assert first['deduplicated'] is False
+    assert second['deduplicated'] is True
+    assert first['sha256'] == second['sha256']
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT refcount FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (first['sha256'],))
+        assert cur.fetchone()[0] == 2
+
+
+def test_html_page_is_rejected(conn, http_stub):
+    http_stub.routes['/page'] = lambda *args: (200, {'Content-Type': 'text/html'}, '<!DOCTYPE html><html></html>')
+    with pytest.raises(ValueError):
+        media_ingest.ingest_url_to_db(conn, f'{http_stub.url}/page', 'ingest_test_html', 'audio')
@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import pytest
+
+from db import get_connection
+from media_store import SCHEMA, point_media, store_blob, sweep_unreferenced_blobs
+
+
+@pytest.fixture
+def connections(database_url):
+    writer = get_connection()
+    sweeper = get_connection()
+    yield writer, sweeper
+    for conn in (writer, sweeper):
+        conn.rollback()
+    with writer.cursor() as cur:
+        cur.execute(f"DELETE FROM {SCHEMA}.media_files WHERE id LIKE 'blob_test_%%'")
+    writer.commit()
+    writer.close()
+    sweeper.close()
+
+
+def orphan_blob(conn, payload: bytes) -> str:
+    '''Блоб без ссылок, как его оставляет удалённый медиафайл'''
+    content_hash = store_blob(conn, payload, 'audio/mpeg')
+    conn.commit()
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT refcount FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (content_hash,))
+        assert cur.fetchone()[0] == 0
+    conn.commit()
+    return content_hash
+
+
+def test_sweep_skips_blob_claimed_by_open_write(connections):
+    writer, sweeper = connections
+    payload = os.urandom(4096)
+    content_hash = orphan_blob(writer, payload)
+
+    # Запись нашла готовый блоб, но ещё не сослалась на него
+    assert store_blob(writer, payload, 'audio/mpeg') == content_hash
+    sweep_unreferenced_blobs(sweeper)
+    sweeper.commit()
+    assert content_hash in _remaining_orphans(sweeper)
+    sweeper.commit()
+
+    point_media(writer, 'blob_test_claimed', 'audio', content_hash, len(payload), 'audio/mpeg')
+    writer.commit()
+
+    with writer.cursor() as cur:
+        cur.execute(f'SELECT refcount, byte_length FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (content_hash,))
+        assert cur.fetchone() == (1, len(payload))
+    writer.commit()
+
+
+def test_sweep_removes_unclaimed_orphans(connections):
+    writer, sweeper = connections
+    payload = os.urandom(4096)
+    content_hash = orphan_blob(writer, payload)
+
+    sweep_unreferenced_blobs(sweeper)
+    sweeper.commit()
+
+    with writer.cursor() as cur:
+        cur.execute(f'SELECT 1 FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (content_hash,))
+        assert cur.fetchone() is None
+    writer.commit()
+
+
+def test_store_blob_recreates_swept_content(connections):
+    writer, sweeper = connections
+    payload = os.urandom(4096)
+    orphan_blob(writer, payload)
+    sweep_unreferenced_blobs(sweeper)
+    sweeper.commit()
+
+    content_hash = store_blob(writer, payload, 'audio/mpeg')
+    point_media(writer, 'blob_test_recreated', 'audio', content_hash, len(payload), 'audio/mpeg')
+    writer.commit()
+
+    assert content_hash == hashlib.sha256(payload).hexdigest()
+    with writer.cursor() as cur:
+        cur.execute(f'SELECT refcount FROM {SCHEMA}.media_blobs WHERE sha256 = %s', (content_hash,))
+        assert cur.fetchone()[0] == 1
+    writer.commit()
+
+
+def _remaining_orphans(conn):
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT sha256 FROM {SCHEMA}.media_blobs WHERE refcount <= 0')
+        return {row[0] for row in cur.fetchall()}
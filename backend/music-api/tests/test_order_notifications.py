@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+
+import pytest
+
+import index
+import order_notifications
+import telegram_queue
+from db import get_connection
+from order_notifications import SCHEMA, dispatch_order_notifications
+
+TOKEN = 'test-token'
+SEND_PATH = f'/bot{TOKEN}/sendMessage'
+OWNER_CHAT_ID = 777
+
+
+@pytest.fixture
+def owner_bot(monkeypatch, http_stub, database_url):
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', TOKEN)
+    monkeypatch.setenv('TELEGRAM_OWNER_CHAT_ID', str(OWNER_CHAT_ID))
+    monkeypatch.setattr(order_notifications, 'ORDER_DIGEST_WINDOW', 10)
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_API_URL', http_stub.url)
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_WORKER_INLINE', True)
+    monkeypatch.setattr(telegram_queue, '_local', threading.local())
+    monkeypatch.setattr(telegram_queue, '_rate', {'global_next': 0.0, 'chats': {}})
+    http_stub.bot_delay = 0.0
+
+    def send_message(method, path, query, body):
+        time.sleep(http_stub.bot_delay)
+        return 200, {}, {'ok': True, 'result': {}}
+
+    http_stub.routes[SEND_PATH] = send_message
+    clear()
+    yield http_stub
+    clear()
+
+
+def clear():
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.order_notifications')
+        cur.execute(f'DELETE FROM {SCHEMA}.telegram_outbox')
+        cur.execute(f"DELETE FROM {SCHEMA}.orders WHERE contact_info = 'digest-test@example.com'")
+    conn.commit()
+    conn.close()
+
+
+def query(sql):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            return cur.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def place_order(name):
+    started = time.monotonic()
+    response = index.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'path': 'order'},
+        'headers': {},
+        'body': json.dumps({'name': name, 'telegram': 'buyer', 'email': 'digest-test@example.com',
+                            'items': [{'title': 'Album', 'price': 500, 'quantity': 1}], 'total': 500})
+    }, None)
+    return response, time.monotonic() - started
+
+
+def owner_messages(stub):
+    return [json.loads(call['body']) for call in stub.calls(SEND_PATH)]
+
+
+def test_checkout_does_not_wait_for_digest_window(owner_bot):
+    first, first_elapsed = place_order('Анна')
+    second, second_elapsed = place_order('Борис')
+
+    assert first['statusCode'] == second['statusCode'] == 201
+    # Окно дайджеста 10 с, но оформление заказа его не ждёт
+    assert max(first_elapsed, second_elapsed) < 2
+    assert owner_messages(owner_bot) == []
+    assert query(f"SELECT COUNT(*) FROM {SCHEMA}.order_notifications WHERE status = 'pending'") == [(2,)]
+
+
+def test_checkout_does_not_call_bot_api(monkeypatch, owner_bot):
+    # Окно уже прошло, а Bot API отвечает дольше таймаута: заказ всё равно не ждёт
+    monkeypatch.setattr(order_notifications, 'ORDER_DIGEST_WINDOW', 0)
+    owner_bot.bot_delay = 3
+    response, elapsed = place_order('Анна')
+
+    assert response['statusCode'] == 201
+    assert elapsed < 1
+    assert owner_messages(owner_bot) == []
+    assert query(f"SELECT status FROM {SCHEMA}.order_notifications") == [('pending',)]
+
+
+def run_worker():
+    return telegram_queue.run_worker(index.handle_telegram_webhook, time_budget=5,
+                                     dispatch=dispatch_order_notifications)
+
+
+def test_due_notifications_go_out_as_one_digest(owner_bot):
+    place_order('Анна')
+    place_order('Борис')
+    # Окно прошло: следующий разбор очереди (здесь — плановый воркер) отправляет дайджест
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"UPDATE {SCHEMA}.order_notifications SET send_after = NOW() - INTERVAL '1 second'")
+    conn.commit()
+    conn.close()
+
+    report = run_worker()
+
+    assert report['dispatched'] == 2
+    messages = owner_messages(owner_bot)
+    assert len(messages) == 1
+    assert messages[0]['chat_id'] == OWNER_CHAT_ID
+    assert 'Новых заказов с сайта: 2' in messages[0]['text']
+    assert 'Анна' in messages[0]['text'] and 'Борис' in messages[0]['text']
+    assert query(f"SELECT DISTINCT status FROM {SCHEMA}.order_notifications") == [('dispatched',)]
+    assert query(f"SELECT DISTINCT notification_sent FROM {SCHEMA}.orders "
+                 f"WHERE contact_info = 'digest-test@example.com'") == [(True,)]
+
+
+def test_full_digest_is_sent_before_window(monkeypatch, owner_bot):
+    monkeypatch.setattr(order_notifications, 'ORDER_DIGEST_MAX', 3)
+    for name in ('Анна', 'Борис', 'Вера'):
+        place_order(name)
+    assert owner_messages(owner_bot) == []
+
+    # Окно ещё идёт, но дайджест полон — воркер не ждёт send_after
+    assert run_worker()['dispatched'] == 3
+    messages = owner_messages(owner_bot)
+    assert len(messages) == 1
+    assert 'Новых заказов с сайта: 3' in messages[0]['text']
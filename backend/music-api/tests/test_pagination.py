@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import index
+from db import get_connection
+
+ALBUM_ID = 'page_test_album'
+# (id, track_order, created_at): NULL в обоих ключах и одинаковые значения
+TRACKS = [
+    ('page_test_t1', 1, '2024-01-01 10:00'),
+    ('page_test_t2', None, '2024-01-01 10:00'),
+    ('page_test_t3', 1, None),
+    ('page_test_t4', None, None),
+    ('page_test_t5', 2, '2024-01-02 10:00'),
+    ('page_test_t6', 1, '2024-01-01 10:00'),
+    ('page_test_t7', 0, '2024-01-03 10:00'),
+]
+ALBUMS = [(ALBUM_ID, '2024-01-01 10:00'), ('page_test_album_null', None), ('page_test_album_null2', None)]
+
+
+@pytest.fixture
+def catalog(database_url):
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cleanup(cur)
+        for album_id, created_at in ALBUMS:
+            cur.execute('INSERT INTO albums (id, title, artist, created_at) VALUES (%s, %s, %s, %s)',
+                        (album_id, album_id, 'Test', created_at))
+        for track_id, track_order, created_at in TRACKS:
+            cur.execute('''
+                INSERT INTO tracks (id, album_id, title, duration, track_order, created_at)
+                VALUES (%s, %s, %s, '3:00', %s, %s)
+            ''', (track_id, ALBUM_ID, track_id, track_order, created_at))
+        index.bump_catalog_version(cur)
+    conn.commit()
+    index.invalidate_catalog_cache()
+    yield
+    with conn.cursor() as cur:
+        cleanup(cur)
+        index.bump_catalog_version(cur)
+    conn.commit()
+    conn.close()
+    index.invalidate_catalog_cache()
+
+
+def cleanup(cur):
+    cur.execute("DELETE FROM tracks WHERE id LIKE 'page_test_%%'")
+    cur.execute("DELETE FROM albums WHERE id LIKE 'page_test_%%'")
+
+
+def walk(path, limit, **params):
+    '''Все страницы подряд по next_cursor'''
+    seen = []
+    page_cursor = ''
+    for _ in range(100):
+        response = index.handler({
+            'httpMethod': 'GET',
+            'queryStringParameters': {'path': path, 'cursor': page_cursor, 'limit': str(limit), **params},
+            'headers': {}
+        }, None)
+        assert response['statusCode'] == 200
+        page = json.loads(response['body'])
+        assert len(page['items']) <= limit
+        seen.extend(item['id'] for item in page['items'])
+        page_cursor = page['next_cursor']
+        if not page_cursor:
+            return seen
+    raise AssertionError('pagination did not terminate')
+
+
+def test_album_tracks_with_nulls_are_all_paged(catalog):
+    # NULL track_order — как 0, NULL created_at — раньше любой даты
+    expected = ['page_test_t4', 'page_test_t2', 'page_test_t7', 'page_test_t3',
+                'page_test_t1', 'page_test_t6', 'page_test_t5']
+    for limit in (1, 2, 3):
+        assert walk('tracks', limit, album_id=ALBUM_ID) == expected
+
+
+def test_catalog_tracks_and_albums_with_nulls_are_all_paged(catalog):
+    tracks = [track_id for track_id in walk('tracks', 2) if track_id.startswith('page_test_')]
+    assert sorted(tracks) == sorted(track_id for track_id, _, _ in TRACKS)
+    # Новые первыми, строки без даты — в конце
+    assert tracks[-2:] == ['page_test_t4', 'page_test_t3']
+
+    albums = [album_id for album_id in walk('albums', 1) if album_id.startswith('page_test_')]
+    assert albums == [ALBUM_ID, 'page_test_album_null2', 'page_test_album_null']
+
+
+def test_cursor_with_null_is_rejected(catalog):
+    page_cursor = index.encode_page_cursor([None, 'page_test_t1'])
+    response = index.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': {'path': 'tracks', 'cursor': page_cursor},
+        'headers': {}
+    }, None)
+    assert response['statusCode'] == 400
@@ -0,0 +1,73 @@
+import base64
+import gzip
+
+import pytest
+
+import db
+import index
+import response
+import synthetic_catalog
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 5, 11)
+RUNS = 5
+
+
+@pytest.fixture(scope='module')
+def catalog(database_url):
+    conn = db.get_connection()
+    synthetic_catalog.seed(conn)
+    yield
+    synthetic_catalog.cleanup(conn)
+    conn.close()
+
+
+def get_albums(accept_encoding=None):
+    headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+    return index.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': {'path': 'albums'},
+        'headers': headers
+    }, None)
+
+
+def measure(encoding):
+    '''Тело ответа, процессорное время и сэкономленные байты — лучшее из RUNS по compression_stats'''
+    best_ms, saved, body = None, 0, None
+    for _ in range(RUNS):
+        before = response.compression_stats()
+        result = get_albums(encoding)
+        after = response.compression_stats()
+        assert result['headers']['Content-Encoding'] == encoding
+        cpu_ms = after['cpu_ms'] - before['cpu_ms']
+        best_ms = cpu_ms if best_ms is None else min(best_ms, cpu_ms)
+        saved = after['bytes_saved'] - before['bytes_saved']
+        body = base64.b64decode(result['body'])
+    return body, best_ms, saved
+
+
+def test_compression_levels_trade_cpu_for_bytes(monkeypatch, catalog):
+    plain = get_albums()
+    raw = plain['body'].encode('utf-8')
+    assert not plain.get('isBase64Encoded')
+    assert len(raw) > 100 * 1024
+
+    variants = [('gzip', 'RESPONSE_GZIP_LEVEL', level, gzip.decompress) for level in GZIP_LEVELS]
+    if response.brotli is not None:
+        variants += [('br', 'RESPONSE_BROTLI_QUALITY', quality, response.brotli.decompress)
+                     for quality in BROTLI_QUALITIES]
+
+    lines = []
+    saved_by_variant = {}
+    for encoding, setting, value, decompress in variants:
+        monkeypatch.setattr(response, setting, value)
+        body, cpu_ms, saved = measure(encoding)
+        assert decompress(body) == raw
+        assert saved == len(raw) - len(body)
+        saved_by_variant[(encoding, value)] = saved
+        lines.append(f'{encoding}:{value} {cpu_ms:.2f} ms cpu, {saved} bytes saved ({len(body) / len(raw):.1%})')
+    print(f'\n[BENCH] albums response {len(raw)} bytes: ' + '; '.join(lines))
+
+    # Каталог — повторяющийся JSON: даже самый быстрый уровень сжимает его в разы
+    assert all(saved > len(raw) // 2 for saved in saved_by_variant.values())
+    assert saved_by_variant[('gzip', 9)] >= saved_by_variant[('gzip', 1)]
@@ -0,0 +1,124 @@
+import os
+import time
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+import s3_migration
+from db import get_connection
+from media_store import SCHEMA, save_media
+
+MB = 1024 * 1024
+JOB = 'test-audio'
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setattr(s3_migration, 'S3_BUCKET', 'migration-test')
+    monkeypatch.setattr(s3_migration, 'S3_PUBLIC_URL', 'https://cdn.test/bucket')
+    # 5 МБ — минимальный размер части multipart, меньше S3 не принимает
+    monkeypatch.setattr(s3_migration, 'S3_MULTIPART_THRESHOLD', 5 * MB)
+    monkeypatch.setattr(s3_migration, 'S3_MULTIPART_CHUNK', 5 * MB)
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1',
+                              aws_access_key_id='test', aws_secret_access_key='test')
+        client.create_bucket(Bucket='migration-test')
+        yield client
+
+
+@pytest.fixture
+def audio_files(database_url):
+    files = {
+        'audio_mig_1_small': os.urandom(200 * 1024),
+        'audio_mig_2_large': os.urandom(11 * MB),
+        'audio_mig_3_small': os.urandom(300 * 1024),
+    }
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {SCHEMA}.media_files WHERE file_type = 'audio'")
+        cur.execute(f'DELETE FROM {SCHEMA}.s3_migration_checkpoints WHERE job = %s', (JOB,))
+    for media_id, payload in files.items():
+        save_media(conn, media_id, 'audio', payload, 'audio/mpeg')
+    conn.commit()
+    yield files
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.media_files WHERE id = ANY(%s)', (list(files),))
+        cur.execute(f'DELETE FROM {SCHEMA}.s3_migration_checkpoints WHERE job = %s', (JOB,))
+    conn.commit()
+    conn.close()
+
+
+class SlowClient:
+    '''Клиент, который тратит время на загрузку — чтобы проход упёрся в бюджет времени'''
+
+    def __init__(self, client, delay: float):
+        self._client = client
+        self._delay = delay
+        self.keys = []
+
+    def upload_fileobj(self, fileobj, bucket, key, **kwargs):
+        time.sleep(self._delay)
+        self.keys.append(key)
+        return self._client.upload_fileobj(fileobj, bucket, key, **kwargs)
+
+
+def read_media_url(media_id: str) -> str:
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT data FROM {SCHEMA}.media_files WHERE id = %s', (media_id,))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_large_file_goes_multipart_and_small_file_single_put(s3, audio_files):
+    conn = get_connection()
+    try:
+        report = s3_migration.migrate_audio(conn, workers=2, batch_size=10, job=JOB, client=s3)
+    finally:
+        conn.close()
+
+    assert report['done'] is True
+    assert report['migrated'] == 3
+    assert report['failed'] == 0
+    assert report['bytes_uploaded'] == sum(len(p) for p in audio_files.values())
+
+    for media_id, payload in audio_files.items():
+        obj = s3.get_object(Bucket='migration-test', Key=f'audio/{media_id}.mp3')
+        assert obj['Body'].read() == payload
+        assert obj['ContentType'] == 'audio/mpeg'
+        assert read_media_url(media_id) == f'https://cdn.test/bucket/audio/{media_id}.mp3'
+
+    # ETag multipart-объекта — хеш от хешей частей с суффиксом "-<число частей>"
+    large = s3.head_object(Bucket='migration-test', Key='audio/audio_mig_2_large.mp3')
+    assert large['ETag'].strip('"').endswith('-3')
+    small = s3.head_object(Bucket='migration-test', Key='audio/audio_mig_1_small.mp3')
+    assert '-' not in small['ETag'].strip('"')
+
+
+def test_interrupted_pass_resumes_from_checkpoint(s3, audio_files):
+    slow = SlowClient(s3, delay=0.3)
+    conn = get_connection()
+    try:
+        first = s3_migration.migrate_audio(conn, workers=1, batch_size=1, time_budget=0.1, job=JOB, client=slow)
+        assert first['done'] is False
+        assert first['migrated'] == 1
+        assert first['checkpoint'] == 'audio_mig_1_small'
+        assert slow.keys == ['audio/audio_mig_1_small.mp3']
+
+        resumed = SlowClient(s3, delay=0)
+        second = s3_migration.migrate_audio(conn, workers=2, batch_size=10, job=JOB, client=resumed)
+        assert second['done'] is True
+        assert second['migrated'] == 2
+        assert sorted(resumed.keys) == ['audio/audio_mig_2_large.mp3', 'audio/audio_mig_3_small.mp3']
+
+        checkpoint = s3_migration.load_checkpoint(conn, JOB)
+    finally:
+        conn.close()
+
+    assert checkpoint['done'] is True
+    assert checkpoint['migrated_count'] == 3
+    assert checkpoint['bytes_uploaded'] == sum(len(p) for p in audio_files.values())
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+
+import pytest
+
+import index
+import telegram_queue
+from db import get_connection
+from telegram_queue import SCHEMA
+
+TOKEN = 'test-token'
+SEND_PATH = f'/bot{TOKEN}/sendMessage'
+
+
+@pytest.fixture
+def bot_api(monkeypatch, http_stub, database_url):
+    '''Локальная замена Bot API и пустые очереди бота'''
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', TOKEN)
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_API_URL', http_stub.url)
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_WORKER_INLINE', True)
+    monkeypatch.setattr(telegram_queue, '_local', threading.local())
+    monkeypatch.setattr(telegram_queue, '_rate', {'global_next': 0.0, 'chats': {}})
+    monkeypatch.setattr(telegram_queue, '_stats', {key: 0 for key in telegram_queue._stats})
+    http_stub.bot_status = 200
+    http_stub.bot_delay = 0.0
+
+    def send_message(method, path, query, body):
+        time.sleep(http_stub.bot_delay)
+        if http_stub.bot_status != 200:
+            return http_stub.bot_status, {}, {'ok': False, 'description': 'Bad Gateway'}
+        return 200, {}, {'ok': True, 'result': {'message_id': len(http_stub.calls(SEND_PATH))}}
+
+    http_stub.routes[SEND_PATH] = send_message
+    clear_queues()
+    yield http_stub
+    clear_queues()
+
+
+def clear_queues():
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.telegram_updates')
+        cur.execute(f'DELETE FROM {SCHEMA}.telegram_outbox')
+    conn.commit()
+    conn.close()
+
+
+def query(sql, args=()):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, args)
+            return cur.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def webhook(update):
+    started = time.monotonic()
+    response = index.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'path': 'telegram'},
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(update)
+    }, None)
+    return response, time.monotonic() - started
+
+
+def text_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'chat': {'id': chat_id}, 'from': {'id': chat_id, 'first_name': 'Test'},
+                    'text': text}
+    }
+
+
+def sent_messages(stub):
+    return [json.loads(call['body']) for call in stub.calls(SEND_PATH)]
+
+
+def test_webhook_replies_within_inline_budget(bot_api):
+    response, elapsed = webhook(text_update(1001, 501, '/help'))
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'ok': True}
+    assert elapsed < telegram_queue.TELEGRAM_INLINE_BUDGET + 1
+    messages = sent_messages(bot_api)
+    assert [m['chat_id'] for m in messages] == [501]
+    assert 'Помощь' in messages[0]['text']
+    assert query(f'SELECT status FROM {SCHEMA}.telegram_updates WHERE update_id = 1001') == [('done',)]
+    assert query(f'SELECT status FROM {SCHEMA}.telegram_outbox') == [('sent',)]
+
+
+def test_redelivered_update_is_handled_once(bot_api):
+    update = text_update(1002, 502, '/start')
+    first, _ = webhook(update)
+    second, _ = webhook(update)
+
+    assert first['statusCode'] == second['statusCode'] == 200
+    assert len(sent_messages(bot_api)) == 1
+    assert query(f'SELECT COUNT(*) FROM {SCHEMA}.telegram_outbox') == [(1,)]
+    stats = telegram_queue.queue_stats()
+    assert stats['received'] == 1
+    assert stats['duplicates'] == 1
+
+
+def test_ack_is_bounded_by_inline_budget_when_bot_api_is_slow(monkeypatch, bot_api):
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_INLINE_BUDGET', 0.3)
+    bot_api.bot_delay = 0.5
+    conn = get_connection()
+    with conn.cursor() as cur:
+        for chat_id in (601, 602, 603):
+            telegram_queue.enqueue_message(cur, chat_id, 'queued earlier')
+    conn.commit()
+    conn.close()
+
+    response, elapsed = webhook(text_update(1003, 604, '/help'))
+
+    assert response['statusCode'] == 200
+    # Начатая отправка обрывается по бюджету, а не ждёт таймаута Bot API
+    assert elapsed < 0.3 + 0.15
+    assert len(sent_messages(bot_api)) == 1
+    rows = query(f"SELECT chat_id, attempts, last_error FROM {SCHEMA}.telegram_outbox "
+                 f"WHERE status = 'pending' ORDER BY id")
+    assert [row[0] for row in rows] == [601, 602, 603, 604]
+    assert rows[0][1] == 1 and 'timed out' in rows[0][2]
+    assert all(attempts == 0 for _, attempts, _ in rows[1:])
+
+
+def test_send_after_budget_is_retried_by_worker(monkeypatch, bot_api):
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_INLINE_BUDGET', 0.2)
+    bot_api.bot_delay = 0.4
+    webhook(text_update(1005, 605, '/help'))
+    assert query(f"SELECT status, attempts FROM {SCHEMA}.telegram_outbox") == [('pending', 1)]
+
+    bot_api.bot_delay = 0.0
+    # Окно чата после неудачной попытки тоже прошло
+    monkeypatch.setattr(telegram_queue, '_rate', {'global_next': 0.0, 'chats': {}})
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"UPDATE {SCHEMA}.telegram_outbox SET next_attempt_at = NOW()")
+    conn.commit()
+    conn.close()
+    report = telegram_queue.run_worker(index.handle_telegram_webhook, time_budget=5)
+
+    assert report['handled_messages'] == 1
+    assert query(f"SELECT status, attempts FROM {SCHEMA}.telegram_outbox") == [('sent', 2)]
+
+
+def test_webhook_acks_when_bot_api_fails(bot_api):
+    bot_api.bot_status = 502
+    response, _ = webhook(text_update(1004, 505, '/help'))
+
+    assert response['statusCode'] == 200
+    rows = query(f'SELECT status, attempts, last_error FROM {SCHEMA}.telegram_outbox')
+    assert len(rows) == 1
+    status, attempts, last_error = rows[0]
+    assert (status, attempts) == ('pending', 1)
+    assert last_error.startswith('502')
+
+
+def test_failing_update_does_not_block_later_ones(monkeypatch, bot_api):
+    monkeypatch.setattr(telegram_queue, 'TELEGRAM_UPDATE_MAX_ATTEMPTS', 2)
+    conn = get_connection()
+    for update_id in (2001, 2002, 2003):
+        telegram_queue.receive_update(conn, {'update_id': update_id})
+    handled = []
+
+    def handle(cursor, conn, payload):
+        if payload['update_id'] == 2001:
+            raise RuntimeError('broken update')
+        handled.append(payload['update_id'])
+
+    try:
+        first = telegram_queue.process_updates(conn, handle, time.monotonic() + 5)
+        assert first == 2
+        assert handled == [2002, 2003]
+        assert query(f'SELECT status, attempts FROM {SCHEMA}.telegram_updates WHERE update_id = 2001') == \
+            [('pending', 1)]
+
+        second = telegram_queue.process_updates(conn, handle, time.monotonic() + 5)
+    finally:
+        conn.close()
+
+    assert second == 0
+    assert query(f'SELECT status, attempts, last_error FROM {SCHEMA}.telegram_updates WHERE update_id = 2001') == \
+        [('failed', 2, 'broken update')]
+    assert telegram_queue.queue_stats()['dead_lettered'] == 1
@@ -0,0 +1,64 @@
+import base64
+import os
+
+import pytest
+
+import index
+from db import get_connection
+from media_store import SCHEMA, save_media
+
+CHUNK = 1000
+
+
+@pytest.fixture
+def media(monkeypatch, database_url):
+    '''Трек в 3,5 куска: в media_blobs и старой base64-записью в media_files.data'''
+    monkeypatch.setattr(index, 'TRACK_STREAM_CHUNK_BYTES', CHUNK)
+    payload = b'ID3' + os.urandom(CHUNK * 3 + CHUNK // 2 - 3)
+    conn = get_connection()
+    save_media(conn, 'audio_stream_test_blob', 'audio', payload, 'audio/mpeg')
+    with conn.cursor() as cur:
+        cur.execute(f'INSERT INTO {SCHEMA}.media_files (id, file_type, data) VALUES (%s, %s, %s)',
+                    ('audio_stream_test_legacy', 'audio',
+                     'data:audio/mpeg;base64,' + base64.b64encode(payload).decode('ascii')))
+    conn.commit()
+    yield payload
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {SCHEMA}.media_files WHERE id LIKE 'audio_stream_test_%%'")
+    conn.commit()
+    conn.close()
+
+
+def stream(file_key, headers=None):
+    return index.handler({
+        'httpMethod': 'GET',
+        'queryStringParameters': {'path': 'track-stream', 'file_key': file_key},
+        'headers': headers or {}
+    }, None)
+
+
+@pytest.mark.parametrize('file_key', ['audio_stream_test_blob', 'audio_stream_test_legacy'])
+def test_request_without_range_gets_whole_file(media, file_key):
+    # Так трек скачивают AlbumView и DownloadTrackButton: fetch без Range и blob() тела
+    response = stream(file_key)
+
+    assert response['statusCode'] == 200
+    assert 'Content-Range' not in response['headers']
+    assert response['headers']['Content-Length'] == str(len(media))
+    assert base64.b64decode(response['body']) == media
+
+
+@pytest.mark.parametrize('file_key', ['audio_stream_test_blob', 'audio_stream_test_legacy'])
+def test_range_request_gets_one_chunk(media, file_key):
+    response = stream(file_key, {'Range': 'bytes=1500-'})
+
+    assert response['statusCode'] == 206
+    assert response['headers']['Content-Range'] == f'bytes 1500-{1500 + CHUNK - 1}/{len(media)}'
+    assert base64.b64decode(response['body']) == media[1500:1500 + CHUNK]
+
+
+def test_unsatisfiable_range(media):
+    response = stream('audio_stream_test_blob', {'Range': f'bytes={len(media)}-'})
+
+    assert response['statusCode'] == 416
+    assert response['headers']['Content-Range'] == f'bytes */{len(media)}'
@@ -1,15 +1,24 @@
 import json
 import os
-import psycopg2
+from datetime import date
 from typing import Dict, Any
+from db import get_connection
+from visit_rollup import cached, visit_summary
+from visit_buffer import buffer_stats, flush_visits, record_visit
+from visitor_sketch import backfill_sketches
+from visit_partitions import apply_retention
+from response import compressed
 
 SCHEMA = 't_p39135821_musician_site_projec'
 
+@compressed
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Функция для отслеживания посещений сайта.
-    POST — записывает визит в базу данных.
-    GET — возвращает статистику посещений.
+    POST — ставит визит в буфер; в базу визиты пишутся пачками.
+    GET — возвращает статистику посещений; ?stats=1 — состояние буфера и спула;
+    ?backfill=1&after=YYYY-MM-DD — достраивает скетчи уникальных посетителей за прошлые дни;
+    ?retention=1[&dry_run=1] — архивирует и удаляет секции визитов старше срока хранения.
     '''
     method: str = event.get('httpMethod', 'GET')
 
@@ -35,25 +44,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
 
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
-
     if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        page_url = body_data.get('page_url', '/').replace("'", "''")
+        body_data = json.loads(event.get('body') or '{}')
+        page_url = body_data.get('page_url', '/')
 
         request_context = event.get('requestContext', {})
         identity = request_context.get('identity', {})
-        ip_address = identity.get('sourceIp', 'unknown').replace("'", "''")
-        user_agent = event.get('headers', {}).get('user-agent', 'unknown').replace("'", "''")
-
-        cur.execute(
-            f"INSERT INTO {SCHEMA}.site_visits (ip_address, user_agent, page_url) VALUES ('{ip_address}', '{user_agent}', '{page_url}')"
-        )
+        ip_address = identity.get('sourceIp', 'unknown')
+        user_agent = event.get('headers', {}).get('user-agent', 'unknown')
 
-        conn.commit()
-        cur.close()
-        conn.close()
+        # Соединение берётся только при сбросе буфера, а не на каждый просмотр страницы
+        record_visit(ip_address, user_agent, page_url)
 
         return {
             'statusCode': 200,
@@ -63,28 +64,66 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
 
     if method == 'GET':
-        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.site_visits")
-        total_visits = cur.fetchone()[0]
-
-        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.site_visits WHERE visited_at >= CURRENT_DATE")
-        today_visits = cur.fetchone()[0]
-
-        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.site_visits WHERE visited_at >= CURRENT_DATE - INTERVAL '7 days'")
-        week_visits = cur.fetchone()[0]
-
-        cur.close()
-        conn.close()
+        query_params = event.get('queryStringParameters') or {}
+        if query_params.get('stats') == '1':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(buffer_stats()),
+                'isBase64Encoded': False
+            }
+
+        if query_params.get('backfill') == '1':
+            # Скетчи уникальных за дни до их записи при приёме: вызывать, пока done != true
+            after = date.fromisoformat(query_params['after']) if query_params.get('after') else None
+            conn = get_connection()
+            try:
+                result = backfill_sketches(conn, after)
+            finally:
+                conn.close()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result),
+                'isBase64Encoded': False
+            }
+
+        if query_params.get('retention') == '1':
+            # Архивирование месяцев старше срока хранения: вызывать, пока done != true
+            conn = get_connection()
+            try:
+                result = apply_retention(conn, dry_run=query_params.get('dry_run') == '1')
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+            finally:
+                conn.close()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result),
+                'isBase64Encoded': False
+            }
+
+        flush_visits()
+        conn = get_connection()
+        try:
+            stats, _ = cached(('summary', 30), lambda: visit_summary(conn, 30))
+            summary = stats['summary']
+        finally:
+            conn.close()
 
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'total': total_visits, 'today': today_visits, 'week': week_visits}),
+            'body': json.dumps({'total': summary['total'], 'today': summary['today'], 'week': summary['week']}),
             'isBase64Encoded': False
         }
 
-    cur.close()
-    conn.close()
-
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import visit_buffer
+from db import get_connection
+
+SCHEMA = visit_buffer.SCHEMA
+PAGE = '/visit-buffer-test'
+BENCH_VISITS = 1000
+
+
+@pytest.fixture
+def buffer(monkeypatch, tmp_path, database_url):
+    '''Пустой буфер, свой спул и порог в 5 визитов'''
+    monkeypatch.setattr(visit_buffer, '_buffer', [])
+    monkeypatch.setattr(visit_buffer, '_stats', {key: 0 for key in visit_buffer._stats})
+    monkeypatch.setattr(visit_buffer, 'VISIT_SPOOL_PATH', str(tmp_path / 'spool.jsonl'))
+    monkeypatch.setattr(visit_buffer, 'VISIT_FLUSH_BATCH', 5)
+    monkeypatch.setattr(visit_buffer, 'VISIT_FLUSH_INTERVAL', 3600)
+    cleanup()
+    yield
+    cleanup()
+
+
+def cleanup():
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'DELETE FROM {SCHEMA}.site_visits WHERE page_url = %s', (PAGE,))
+    conn.commit()
+    conn.close()
+
+
+def stored():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.site_visits WHERE page_url = %s', (PAGE,))
+            return cur.fetchone()[0]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def visit():
+    return visit_buffer.record_visit('10.0.0.1', 'pytest', PAGE)
+
+
+def test_unflushed_visits_are_bounded_by_batch(buffer):
+    # Всё, что экземпляр может потерять при остановке, видно в buffered
+    for _ in range(4):
+        assert visit() is False
+    assert stored() == 0
+    assert visit_buffer.buffer_stats()['buffered'] == 4
+
+    assert visit() is True
+    assert stored() == 5
+    assert visit_buffer.buffer_stats()['buffered'] == 0
+
+
+def test_batch_of_one_writes_each_visit_in_its_own_call(monkeypatch, buffer):
+    monkeypatch.setattr(visit_buffer, 'VISIT_FLUSH_BATCH', 1)
+    for expected in (1, 2, 3):
+        assert visit() is True
+        assert stored() == expected
+    assert visit_buffer.buffer_stats()['flushes'] == 3
+
+
+def test_spooled_visits_are_replayed_when_database_returns(monkeypatch, buffer):
+    def unavailable():
+        raise OSError('connection refused')
+
+    monkeypatch.setattr(visit_buffer, 'get_connection', unavailable)
+    for _ in range(5):
+        visit()
+    assert visit_buffer.buffer_stats()['spooled'] == 5
+    assert visit_buffer.buffer_stats()['spool_bytes'] > 0
+
+    monkeypatch.setattr(visit_buffer, 'get_connection', get_connection)
+    for _ in range(5):
+        visit()
+    assert stored() == 10
+    stats = visit_buffer.buffer_stats()
+    assert (stats['replayed'], stats['spool_bytes']) == (5, 0)
+
+
+def visits_per_second(monkeypatch, batch):
+    monkeypatch.setattr(visit_buffer, 'VISIT_FLUSH_BATCH', batch)
+    started = time.perf_counter()
+    for _ in range(BENCH_VISITS):
+        visit()
+    visit_buffer.flush_visits()
+    return BENCH_VISITS / (time.perf_counter() - started)
+
+
+def test_batching_raises_insert_rate(monkeypatch, buffer):
+    unbatched = visits_per_second(monkeypatch, 1)
+    assert stored() == BENCH_VISITS
+    batched = visits_per_second(monkeypatch, 50)
+    assert stored() == 2 * BENCH_VISITS
+    assert visit_buffer.buffer_stats()['buffered'] == 0
+
+    print(f'\n[BENCH] {BENCH_VISITS} visits: batching off (VISIT_FLUSH_BATCH=1) {unbatched:.0f} inserts/s, '
+          f'batching on (VISIT_FLUSH_BATCH=50) {batched:.0f} inserts/s')
+    assert batched > unbatched
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import visit_rollup
+from db import get_connection
+
+SCHEMA = visit_rollup.SCHEMA
+VISITS = 200_000
+DAYS = 365
+RUNS = 5
+
+
+class Uncommitted:
+    '''Соединение, чей commit ничего не фиксирует: синтетические визиты и свёртка откатываются в конце'''
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@pytest.fixture
+def synthetic_visits(monkeypatch, database_url):
+    '''
+    VISITS визитов, равномерно за DAYS дней до сегодняшнего включительно, и пустая
+    свёртка — компактор сворачивает их с нуля. Всё в одной транзакции, которая откатывается
+    '''
+    monkeypatch.setattr(visit_rollup, '_state', {'last_compact': 0.0})
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT {SCHEMA}.ensure_visit_partitions(CURRENT_DATE - %s, CURRENT_DATE)', (DAYS,))
+        cur.execute(f'DELETE FROM {SCHEMA}.visit_daily_rollup')
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.site_visits (visited_at, ip_address, user_agent, page_url)
+            SELECT CURRENT_DATE - (n %% %s) * INTERVAL '1 day' + (n %% 86400) * INTERVAL '1 second' / 2,
+                   '10.0.0.' || (n %% 250), 'synthetic', '/synthetic-rollup'
+            FROM generate_series(1, %s) AS n
+        ''', (DAYS, VISITS))
+        cur.execute(f'ANALYZE {SCHEMA}.site_visits')
+    yield Uncommitted(conn)
+    conn.rollback()
+    conn.close()
+
+
+def counts_by_scan(conn):
+    '''Прежний GET track-visit: три COUNT по всем сырым визитам'''
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.site_visits')
+        total = cur.fetchone()[0]
+        cur.execute(f'SELECT COUNT(*) FROM {SCHEMA}.site_visits WHERE visited_at >= CURRENT_DATE')
+        today = cur.fetchone()[0]
+        cur.execute(f"SELECT COUNT(*) FROM {SCHEMA}.site_visits WHERE visited_at >= CURRENT_DATE - INTERVAL '7 days'")
+        week = cur.fetchone()[0]
+    return {'total': total, 'today': today, 'week': week}
+
+
+def counts_by_rollup(conn):
+    summary = visit_rollup.visit_summary(conn)['summary']
+    return {key: summary[key] for key in ('total', 'today', 'week')}
+
+
+def best_of(load, conn):
+    best = None
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        result = load(conn)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def test_rollup_answers_like_a_full_scan(synthetic_visits):
+    started = time.perf_counter()
+    assert visit_rollup.compact_visit_rollup(synthetic_visits, force=True) >= DAYS - 1
+    compact_time = time.perf_counter() - started
+
+    scanned, scan_time = best_of(counts_by_scan, synthetic_visits)
+    rolled, rollup_time = best_of(counts_by_rollup, synthetic_visits)
+    print(f'\n[BENCH] visit stats over {VISITS} visits in {DAYS} days: full scan {scan_time * 1000:.1f} ms, '
+          f'rollup + tail {rollup_time * 1000:.1f} ms (one-off compaction {compact_time * 1000:.0f} ms)')
+
+    assert rolled == scanned
+    assert scanned['total'] >= VISITS
+    assert rollup_time < scan_time
@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+from visitor_sketch import HLL_PRECISION, VISIT_HLL_ERROR, Sketch, fingerprint, merge_windows
+
+# Оценка HLL случайна относительно набора, так что сверяем с запасом в три стандартные ошибки
+TOLERANCE = 3 * VISIT_HLL_ERROR
+
+
+def visitors(start: int, count: int):
+    return [fingerprint(f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', f'Mozilla/5.0 test-{i % 7}')
+            for i in range(start, start + count)]
+
+
+def sketch_of(items) -> Sketch:
+    sketch = Sketch()
+    for item in items:
+        sketch.add(item)
+    return sketch
+
+
+def relative_error(estimate: int, exact: int) -> float:
+    return abs(estimate - exact) / exact
+
+
+def test_precision_matches_configured_error():
+    assert 1.04 / math.sqrt(1 << HLL_PRECISION) <= VISIT_HLL_ERROR
+
+
+@pytest.mark.parametrize('count', [50, 1000, 20000, 100000])
+def test_estimate_is_within_configured_error(count):
+    items = visitors(0, count)
+    assert len(set(items)) == count
+    assert relative_error(sketch_of(items).estimate(), count) <= TOLERANCE
+
+
+def test_repeat_visits_do_not_change_estimate():
+    items = visitors(0, 5000)
+    once = sketch_of(items)
+    thrice = sketch_of(items * 3)
+    assert thrice.registers == once.registers
+
+
+def test_merged_days_estimate_union():
+    # Два дня с пересечением: точный ответ — размер объединения, а не сумма
+    monday = visitors(0, 30000)
+    tuesday = visitors(20000, 30000)
+    exact = len(set(monday) | set(tuesday))
+    merged = sketch_of(monday).merge(sketch_of(tuesday))
+    assert relative_error(merged.estimate(), exact) <= TOLERANCE
+
+
+def test_serialized_sketch_round_trips():
+    sketch = sketch_of(visitors(0, 3000))
+    restored = Sketch.from_bytes(sketch.to_bytes())
+    assert restored.precision == sketch.precision
+    assert restored.registers == sketch.registers
+
+
+def test_reduced_precision_stays_within_its_own_error():
+    precision = HLL_PRECISION - 2
+    reduced = sketch_of(visitors(0, 40000)).reduce(precision)
+    # Понижение точности без потерь: те же регистры, что у скетча, сразу собранного при ней
+    direct = Sketch(precision)
+    for item in visitors(0, 40000):
+        direct.add(item)
+    assert reduced.precision == precision
+    assert reduced.registers == direct.registers
+    assert relative_error(reduced.estimate(), 40000) <= 3 * 1.04 / math.sqrt(1 << precision)
+
+
+def test_merge_windows_counts_nested_periods():
+    days = [visitors(day * 1000, 1500) for day in range(30)]
+    sketches = [sketch_of(items).to_bytes() for items in days]
+    ages = list(range(30))
+    windows = {'unique_today': 0, 'unique_week': 6, 'unique_month': 29}
+    result = merge_windows(ages, sketches, windows)
+    for name, window in windows.items():
+        exact = len(set().union(*days[:window + 1]))
+        assert relative_error(result[name], exact) <= TOLERANCE, name
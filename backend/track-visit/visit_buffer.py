@@ -0,0 +1,149 @@
+'''
+Business: Пакетная запись посещений: буфер в памяти тёплого экземпляра и спул-файл на случай недоступной БД
+Args: визит (ip, user-agent, страница); VISIT_FLUSH_BATCH, VISIT_FLUSH_INTERVAL, VISIT_SPOOL_PATH из окружения
+Returns: число записанных визитов при сбросе; состояние буфера и спула
+'''
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+from psycopg2.extras import execute_values
+from db import get_connection
+from visit_rollup import add_late_visits
+from visitor_sketch import add_visitors
+from visit_partitions import ensure_partitions
+
+SCHEMA = 't_p39135821_musician_site_projec'
+# Буфер и спул живут только в экземпляре функции и сбрасываются следующими вызовами.
+# Если платформа остановит экземпляр раньше, его визиты пропадут: не больше
+# VISIT_FLUSH_BATCH - 1 из буфера плюс спул, накопленный при недоступной БД.
+# Для статистики посещений это принятая цена меньшего числа соединений и коммитов;
+# VISIT_FLUSH_BATCH=1 пишет каждый визит сразу, в том же вызове
+VISIT_FLUSH_BATCH = int(os.environ.get('VISIT_FLUSH_BATCH', '50'))
+VISIT_FLUSH_INTERVAL = float(os.environ.get('VISIT_FLUSH_INTERVAL', '5'))
+VISIT_SPOOL_PATH = os.environ.get('VISIT_SPOOL_PATH', '/tmp/track-visit-spool.jsonl')
+VISIT_REPLAY_BATCH = int(os.environ.get('VISIT_REPLAY_BATCH', '1000'))
+
+Visit = Tuple[datetime, str, str, str]
+
+_buffer: List[Visit] = []
+_state: Dict[str, float] = {'last_flush': time.monotonic()}
+_stats: Dict[str, int] = {'recorded': 0, 'flushes': 0, 'flushed': 0, 'spooled': 0, 'replayed': 0}
+
+
+def record_visit(ip_address: str, user_agent: str, page_url: str) -> bool:
+    '''
+    Кладёт визит в буфер; в БД он уходит пачкой, когда набралось VISIT_FLUSH_BATCH
+    или прошло VISIT_FLUSH_INTERVAL. Возвращает True, если этот вызов сбросил буфер
+    '''
+    _buffer.append((datetime.now(timezone.utc), ip_address, user_agent, page_url))
+    _stats['recorded'] += 1
+    if len(_buffer) >= VISIT_FLUSH_BATCH or time.monotonic() - _state['last_flush'] >= VISIT_FLUSH_INTERVAL:
+        flush_visits()
+        return True
+    return False
+
+
+def _insert(cur, visits: List[Visit]) -> None:
+    execute_values(cur, f'''
+        INSERT INTO {SCHEMA}.site_visits (visited_at, ip_address, user_agent, page_url) VALUES %s
+    ''', visits, page_size=500)
+    add_late_visits(cur, [visit[0] for visit in visits])
+    add_visitors(cur, visits)
+
+
+def _spool(visits: List[Visit]) -> None:
+    with open(VISIT_SPOOL_PATH, 'a', encoding='utf-8') as spool:
+        for visited_at, ip_address, user_agent, page_url in visits:
+            spool.write(json.dumps([visited_at.isoformat(), ip_address, user_agent, page_url]) + '\n')
+    _stats['spooled'] += len(visits)
+
+
+def _replay_spool(conn) -> int:
+    '''
+    Дописывает в БД визиты, отложенные при её недоступности. Файл сначала
+    переименовывается, чтобы новые отказы писались в свежий спул
+    '''
+    replay_path = VISIT_SPOOL_PATH + '.replay'
+    if not os.path.exists(replay_path):
+        if not os.path.exists(VISIT_SPOOL_PATH):
+            return 0
+        os.replace(VISIT_SPOOL_PATH, replay_path)
+    replayed = 0
+    batch: List[Visit] = []
+    with open(replay_path, encoding='utf-8') as spool, conn.cursor() as cur:
+        for line in spool:
+            if not line.strip():
+                continue
+            visited_at, ip_address, user_agent, page_url = json.loads(line)
+            batch.append((datetime.fromisoformat(visited_at), ip_address, user_agent, page_url))
+            if len(batch) >= VISIT_REPLAY_BATCH:
+                _insert(cur, batch)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            _insert(cur, batch)
+            replayed += len(batch)
+    # Спул удаляется только после коммита: при сбое он будет проигран заново целиком
+    conn.commit()
+    os.remove(replay_path)
+    _stats['replayed'] += replayed
+    return replayed
+
+
+def flush_visits() -> int:
+    '''Один INSERT ... VALUES на весь буфер; при ошибке БД визиты уходят в спул'''
+    visits = _buffer[:]
+    del _buffer[:]
+    _state['last_flush'] = time.monotonic()
+    if not visits and not os.path.exists(VISIT_SPOOL_PATH) and not os.path.exists(VISIT_SPOOL_PATH + '.replay'):
+        return 0
+    try:
+        conn = get_connection()
+    except Exception as e:
+        print(f'[ERROR] Visit flush: database unavailable, spooling {len(visits)} visits: {e}')
+        if visits:
+            _spool(visits)
+        return 0
+    try:
+        # Секция следующего месяца должна появиться раньше первого визита в неё
+        ensure_partitions(conn)
+    except Exception as e:
+        conn.rollback()
+        print(f'[ERROR] Visit partition check failed: {e}')
+    try:
+        if visits:
+            with conn.cursor() as cur:
+                _insert(cur, visits)
+            conn.commit()
+            _stats['flushes'] += 1
+            _stats['flushed'] += len(visits)
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        print(f'[ERROR] Visit flush failed, spooling {len(visits)} visits: {e}')
+        _spool(visits)
+        return 0
+    try:
+        # База снова отвечает — заодно дописываем отложенное раньше
+        _replay_spool(conn)
+    except Exception as e:
+        conn.rollback()
+        print(f'[ERROR] Visit spool replay failed: {e}')
+    finally:
+        conn.close()
+    return len(visits)
+
+
+def buffer_stats() -> Dict[str, Any]:
+    spool_bytes = sum(os.path.getsize(p) for p in (VISIT_SPOOL_PATH, VISIT_SPOOL_PATH + '.replay') if os.path.exists(p))
+    return {
+        **_stats,
+        'buffered': len(_buffer),
+        'spool_bytes': spool_bytes,
+        'seconds_since_flush': round(time.monotonic() - _state['last_flush'], 3),
+        'flush_batch': VISIT_FLUSH_BATCH,
+        'flush_interval': VISIT_FLUSH_INTERVAL
+    }
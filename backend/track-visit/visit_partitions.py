@@ -0,0 +1,169 @@
+'''
+Business: Помесячные секции site_visits: создание наперёд, архивирование и удаление старых месяцев
+Args: conn — соединение с БД; VISIT_PARTITION_*, VISIT_RETENTION_MONTHS, VISIT_ARCHIVE_* и S3_* из окружения
+Returns: число созданных секций; отчёт о заархивированных секциях — строки, байты, куда выгружен архив
+'''
+
+import gzip
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List
+from psycopg2.extras import RealDictCursor
+from visit_rollup import compact_visit_rollup
+from visitor_sketch import backfill_sketches
+
+SCHEMA = 't_p39135821_musician_site_projec'
+VISIT_PARTITION_MONTHS_AHEAD = int(os.environ.get('VISIT_PARTITION_MONTHS_AHEAD', '3'))
+VISIT_PARTITION_CHECK_INTERVAL = float(os.environ.get('VISIT_PARTITION_CHECK_INTERVAL', '3600'))
+# Сырые визиты за месяц живут столько месяцев; дневная свёртка и скетчи остаются навсегда
+VISIT_RETENTION_MONTHS = int(os.environ.get('VISIT_RETENTION_MONTHS', '13'))
+VISIT_RETENTION_TIME_BUDGET = float(os.environ.get('VISIT_RETENTION_TIME_BUDGET', '20'))
+# Архив уходит в S3 (ключи AWS_* заданы) или в каталог VISIT_ARCHIVE_DIR
+VISIT_ARCHIVE_DIR = os.environ.get('VISIT_ARCHIVE_DIR', '')
+VISIT_ARCHIVE_PREFIX = os.environ.get('VISIT_ARCHIVE_PREFIX', 'archive/site_visits')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+
+_state: Dict[str, float] = {'last_check': 0.0}
+
+
+def ensure_partitions(conn, force: bool = False) -> int:
+    '''Секции с текущего месяца на VISIT_PARTITION_MONTHS_AHEAD вперёд; проверка не чаще раза в интервал'''
+    if not force and time.monotonic() - _state['last_check'] < VISIT_PARTITION_CHECK_INTERVAL:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT {SCHEMA}.ensure_visit_partitions(
+                CURRENT_DATE, (CURRENT_DATE + make_interval(months => %s))::date
+            )
+        ''', (VISIT_PARTITION_MONTHS_AHEAD,))
+        created = cur.fetchone()[0]
+    conn.commit()
+    _state['last_check'] = time.monotonic()
+    return created
+
+
+def expired_partitions(conn) -> List[Dict[str, Any]]:
+    '''
+    Секции старше срока хранения. Отсоединённые, но не удалённые (прошлый запуск
+    прервался после DETACH) тоже попадают сюда и доводятся до конца
+    '''
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            SELECT c.relname AS name,
+                   to_date(right(c.relname, 6), 'YYYYMM') AS month,
+                   i.inhparent IS NOT NULL AS attached,
+                   pg_total_relation_size(c.oid) AS bytes
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+            WHERE n.nspname = %s AND c.relkind = 'r'
+              AND c.relname ~ '^site_visits_[0-9]{{6}}$'
+              AND to_date(right(c.relname, 6), 'YYYYMM')
+                  < (date_trunc('month', CURRENT_DATE) - make_interval(months => %s))::date
+            ORDER BY month
+        ''', (SCHEMA, VISIT_RETENTION_MONTHS))
+        partitions = [dict(row) for row in cur.fetchall()]
+    conn.rollback()
+    return partitions
+
+
+def _archive_destination() -> str:
+    if os.environ.get('AWS_ACCESS_KEY_ID'):
+        return 's3'
+    if VISIT_ARCHIVE_DIR:
+        return 'dir'
+    raise ValueError('Archive destination not configured: set AWS_ACCESS_KEY_ID or VISIT_ARCHIVE_DIR')
+
+
+def _store_archive(path: str, name: str) -> str:
+    if _archive_destination() == 's3':
+        import boto3
+        client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+        # В архиве IP посетителей: случайный суффикс, чтобы ключ нельзя было угадать
+        key = f'{VISIT_ARCHIVE_PREFIX}/{name}-{secrets.token_hex(8)}.csv.gz'
+        client.upload_file(path, S3_BUCKET, key, ExtraArgs={'ContentType': 'application/gzip'})
+        return f's3://{S3_BUCKET}/{key}'
+    os.makedirs(VISIT_ARCHIVE_DIR, exist_ok=True)
+    target = os.path.join(VISIT_ARCHIVE_DIR, f'{name}.csv.gz')
+    shutil.move(path, target)
+    return target
+
+
+def archive_partition(conn, partition: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Отсоединяет секцию, выгружает её в CSV.gz и удаляет. До удаления дни месяца
+    гарантированно есть в свёртке и скетчах, поэтому статистика не меняется
+    '''
+    name = partition['name']
+    month = partition['month']
+    next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if partition['attached']:
+        backfill_sketches(conn, month - timedelta(days=1), float('inf'), until=next_month)
+        with conn.cursor() as cur:
+            cur.execute(f'ALTER TABLE {SCHEMA}.site_visits DETACH PARTITION {SCHEMA}.{name}')
+        conn.commit()
+
+    handle, path = tempfile.mkstemp(suffix='.csv.gz')
+    os.close(handle)
+    try:
+        with gzip.open(path, 'wb') as archive, conn.cursor() as cur:
+            cur.copy_expert(f'COPY {SCHEMA}.{name} TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+            rows = cur.rowcount
+        conn.rollback()
+        archive_bytes = os.path.getsize(path)
+        location = _store_archive(path, name)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    with conn.cursor() as cur:
+        cur.execute(f'DROP TABLE {SCHEMA}.{name}')
+    conn.commit()
+    return {
+        'partition': name,
+        'month': month.isoformat(),
+        'rows': rows,
+        'table_bytes': partition['bytes'],
+        'archive_bytes': archive_bytes,
+        'archive': location
+    }
+
+
+def apply_retention(conn, dry_run: bool = False,
+                    time_budget: float = VISIT_RETENTION_TIME_BUDGET) -> Dict[str, Any]:
+    '''
+    Архивирует секции старше VISIT_RETENTION_MONTHS, пока хватает времени;
+    done = false — вызвать ещё раз. dry_run только показывает, что будет удалено
+    '''
+    started = time.monotonic()
+    partitions = expired_partitions(conn)
+    if dry_run:
+        return {
+            'dry_run': True,
+            'retention_months': VISIT_RETENTION_MONTHS,
+            'partitions': [{**p, 'month': p['month'].isoformat()} for p in partitions]
+        }
+    _archive_destination()
+    ensure_partitions(conn, force=True)
+    # Месяцы старше срока хранения давно завершены: свёртка должна их покрывать до удаления
+    compact_visit_rollup(conn, force=True)
+    archived = []
+    for partition in partitions:
+        if archived and time.monotonic() - started >= time_budget:
+            break
+        archived.append(archive_partition(conn, partition))
+    return {
+        'dry_run': False,
+        'retention_months': VISIT_RETENTION_MONTHS,
+        'archived': archived,
+        'done': len(archived) == len(partitions)
+    }
@@ -0,0 +1,173 @@
+'''
+Business: Дневная свёртка посещений: завершённые дни хранятся в visit_daily_rollup
+Args: conn — соединение с БД; VISIT_ROLLUP_COMPACT_INTERVAL, VISIT_STATS_CACHE_TTL из окружения
+Returns: сводка today/week/month/total и unique_* с посуточным рядом; ряд за произвольный период по дням, неделям или месяцам
+'''
+
+import os
+import time
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple
+from psycopg2.extras import RealDictCursor
+from visitor_sketch import Sketch, merge_windows
+
+SCHEMA = 't_p39135821_musician_site_projec'
+VISIT_ROLLUP_COMPACT_INTERVAL = float(os.environ.get('VISIT_ROLLUP_COMPACT_INTERVAL', '300'))
+VISIT_STATS_CACHE_TTL = float(os.environ.get('VISIT_STATS_CACHE_TTL', '30'))
+VISIT_RANGE_GRANULARITIES = ('day', 'week', 'month')
+
+_state: Dict[str, float] = {'last_compact': 0.0}
+_cache: Dict[Tuple, Tuple[float, Any]] = {}
+
+# Все дни: свёрнутые из visit_daily_rollup плюс сырые строки после последнего
+# свёрнутого дня. Хвост читается по idx_visits_date и обычно равен одному дню;
+# граница — скалярный подзапрос, чтобы лишние секции site_visits отсекались при выполнении
+VISIT_DAYS = f'''
+    WITH mark AS (
+        SELECT COALESCE(MAX(day) + 1, DATE '1970-01-01') AS day FROM {SCHEMA}.visit_daily_rollup
+    ), days AS (
+        SELECT day, visits FROM {SCHEMA}.visit_daily_rollup
+        UNION ALL
+        SELECT DATE(v.visited_at) AS day, COUNT(*) AS visits
+        FROM {SCHEMA}.site_visits v
+        WHERE v.visited_at >= (SELECT day FROM mark)
+        GROUP BY DATE(v.visited_at)
+    )
+'''
+
+
+def compact_visit_rollup(conn, force: bool = False) -> int:
+    '''
+    Сворачивает завершённые дни после последнего свёрнутого, включая дни
+    без посещений — чтобы граница хвоста всегда сдвигалась до вчера
+    '''
+    if not force and time.monotonic() - _state['last_compact'] < VISIT_ROLLUP_COMPACT_INTERVAL:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            WITH bounds AS (
+                SELECT COALESCE(
+                    MAX(day) + 1,
+                    (SELECT DATE(MIN(visited_at)) FROM {SCHEMA}.site_visits),
+                    CURRENT_DATE
+                ) AS start
+                FROM {SCHEMA}.visit_daily_rollup
+            )
+            INSERT INTO {SCHEMA}.visit_daily_rollup (day, visits, updated_at)
+            SELECT d.day::date, COUNT(v.id), NOW()
+            FROM bounds, generate_series(bounds.start, CURRENT_DATE - 1, INTERVAL '1 day') AS d(day)
+            LEFT JOIN {SCHEMA}.site_visits v
+                ON v.visited_at >= d.day AND v.visited_at < d.day + INTERVAL '1 day'
+                AND v.visited_at >= (SELECT start FROM bounds) AND v.visited_at < CURRENT_DATE
+            GROUP BY d.day
+            ON CONFLICT (day) DO UPDATE SET visits = EXCLUDED.visits, updated_at = NOW()
+        ''')
+        compacted = cur.rowcount
+    conn.commit()
+    _state['last_compact'] = time.monotonic()
+    return compacted
+
+
+def add_late_visits(cur, visited_at: List[Any]) -> None:
+    '''
+    Досчитывает в свёртку визиты за уже свёрнутые дни (сброс буфера после
+    полуночи, проигрывание спула): compact_visit_rollup к этим дням не вернётся
+    '''
+    cur.execute(f'''
+        INSERT INTO {SCHEMA}.visit_daily_rollup (day, visits, updated_at)
+        SELECT d.day, COUNT(*), NOW()
+        FROM (SELECT DATE(t.visited_at::timestamp) AS day FROM unnest(%s::timestamptz[]) AS t(visited_at)) d
+        WHERE d.day <= (SELECT MAX(day) FROM {SCHEMA}.visit_daily_rollup)
+        GROUP BY d.day
+        ON CONFLICT (day) DO UPDATE
+        SET visits = {SCHEMA}.visit_daily_rollup.visits + EXCLUDED.visits, updated_at = NOW()
+    ''', (visited_at,))
+
+
+def cached(key: Tuple, loader: Callable[[], Any]) -> Tuple[Any, bool]:
+    '''Результат на VISIT_STATS_CACHE_TTL секунд; второй элемент — было ли попадание'''
+    now = time.monotonic()
+    entry = _cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1], True
+    value = loader()
+    # Ключей немного (период и диапазоны), но просроченные всё равно вычищаются
+    for stale in [k for k, v in _cache.items() if v[0] <= now]:
+        del _cache[stale]
+    _cache[key] = (now + VISIT_STATS_CACHE_TTL, value)
+    return value, False
+
+
+def visit_summary(conn, days: int = 30) -> Dict[str, Any]:
+    '''
+    Одним запросом: окна как раньше (сегодня, неделя и 30 дней от начала
+    дня, всё время) и посуточный ряд за days дней, новые сверху
+    '''
+    compact_visit_rollup(conn)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            {VISIT_DAYS}
+            SELECT COALESCE(SUM(visits) FILTER (WHERE day >= CURRENT_DATE), 0) AS today,
+                   COALESCE(SUM(visits) FILTER (WHERE day >= CURRENT_DATE - 7), 0) AS week,
+                   COALESCE(SUM(visits) FILTER (WHERE day >= CURRENT_DATE - 30), 0) AS month,
+                   COALESCE(SUM(visits), 0) AS total,
+                   (
+                       SELECT COALESCE(json_agg(json_build_object('date', d.day::text, 'visits', d.visits)
+                                                ORDER BY d.day DESC), '[]'::json)
+                       FROM (
+                           SELECT day, SUM(visits) AS visits FROM days
+                           WHERE day >= CURRENT_DATE - %s
+                           GROUP BY day
+                           HAVING SUM(visits) > 0
+                       ) d
+                   ) AS daily,
+                   ARRAY(SELECT CURRENT_DATE - s.day FROM {SCHEMA}.visit_daily_sketches s
+                         WHERE s.day >= CURRENT_DATE - 30 ORDER BY s.day) AS sketch_ages,
+                   ARRAY(SELECT s.sketch FROM {SCHEMA}.visit_daily_sketches s
+                         WHERE s.day >= CURRENT_DATE - 30 ORDER BY s.day) AS sketches
+            FROM days
+        ''', (days,))
+        row = cur.fetchone()
+    summary = {k: int(row[k]) for k in ('today', 'week', 'month', 'total')}
+    # Уникальных за окно не сложить из дневных чисел — сливаются скетчи дней (не больше 31)
+    summary.update(merge_windows(row['sketch_ages'], row['sketches'],
+                                 {'unique_today': 0, 'unique_week': 7, 'unique_month': 30}))
+    return {'summary': summary, 'daily': row['daily']}
+
+
+def visit_range(conn, date_from: date, date_to: date, granularity: str = 'day') -> Dict[str, Any]:
+    '''
+    Ряд за [date_from, date_to] по дням, неделям или месяцам. Суммируются
+    строки свёртки, поэтому длина периода на стоимость почти не влияет.
+    Уникальные посетители — по слитым скетчам каждого периода и всего диапазона
+    '''
+    if granularity not in VISIT_RANGE_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(VISIT_RANGE_GRANULARITIES)}")
+    if date_from > date_to:
+        raise ValueError('from must not be after to')
+    compact_visit_rollup(conn)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f'''
+            {VISIT_DAYS}
+            SELECT date_trunc(%s, day)::date AS period, SUM(visits) AS visits
+            FROM days
+            WHERE day BETWEEN %s AND %s
+            GROUP BY 1
+            ORDER BY 1
+        ''', (granularity, date_from, date_to))
+        series = [{'period': str(row['period']), 'visits': int(row['visits'])} for row in cur.fetchall()]
+        cur.execute(f'''
+            SELECT date_trunc(%s, day)::date AS period, sketch
+            FROM {SCHEMA}.visit_daily_sketches
+            WHERE day BETWEEN %s AND %s
+        ''', (granularity, date_from, date_to))
+        periods: Dict[str, Sketch] = {}
+        for row in cur.fetchall():
+            key = str(row['period'])
+            periods[key] = periods.get(key, Sketch()).merge(Sketch.from_bytes(row['sketch']))
+    total = Sketch()
+    for point in series:
+        sketch = periods.get(point['period'], Sketch())
+        point['unique'] = sketch.estimate()
+        total = total.merge(sketch)
+    return {'series': series, 'unique': total.estimate()}
@@ -0,0 +1,175 @@
+'''
+Business: Уникальные посетители по дням в HyperLogLog-скетчах: компактный bytea, слияние за любой период
+Args: VISIT_HLL_ERROR — допустимая относительная ошибка оценки; отпечаток посетителя — ip и user-agent
+Returns: add_visitors — визиты в скетчи их дней; merge_windows и Sketch.estimate — оценка уникальных за период
+'''
+
+import hashlib
+import math
+import os
+import time
+import zlib
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from psycopg2.extras import execute_values
+
+SCHEMA = 't_p39135821_musician_site_projec'
+VISIT_HLL_ERROR = float(os.environ.get('VISIT_HLL_ERROR', '0.02'))
+# Стандартная ошибка HLL ≈ 1.04 / sqrt(m): берётся наименьшее m = 2^p с нужной точностью
+HLL_PRECISION = min(max(math.ceil(math.log2((1.04 / VISIT_HLL_ERROR) ** 2)), 4), 16)
+
+
+def fingerprint(ip_address: str, user_agent: str) -> bytes:
+    return f'{ip_address}\x00{user_agent}'.encode('utf-8')
+
+
+class Sketch:
+    '''Регистры HyperLogLog по байту на регистр; хеш — 64 бита blake2b'''
+
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytearray] = None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, item: bytes) -> None:
+        h = int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), 'big')
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def reduce(self, precision: int) -> 'Sketch':
+        '''
+        Понижает точность: скетчи, записанные при другом VISIT_HLL_ERROR,
+        сливаются с новыми по меньшей из точностей
+        '''
+        if precision >= self.precision:
+            return self
+        shift = self.precision - precision
+        registers = bytearray(1 << precision)
+        for index, value in enumerate(self.registers):
+            if not value:
+                continue
+            # Отброшенные биты индекса становятся старшими битами остатка хеша
+            low = index & ((1 << shift) - 1)
+            rank = shift - low.bit_length() + 1 if low else value + shift
+            if rank > registers[index >> shift]:
+                registers[index >> shift] = rank
+        return Sketch(precision, registers)
+
+    def merge(self, other: 'Sketch') -> 'Sketch':
+        precision = min(self.precision, other.precision)
+        left, right = self.reduce(precision), other.reduce(precision)
+        return Sketch(precision, bytearray(map(max, left.registers, right.registers)))
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # На малых числах точнее линейный счёт по пустым регистрам
+        if raw <= 2.5 * m and zeros:
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_bytes(self) -> bytes:
+        # У небольшого сайта большая часть регистров нулевая — zlib сжимает скетч в разы
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: Any) -> 'Sketch':
+        data = bytes(data)
+        return cls(data[0], bytearray(zlib.decompress(data[1:])))
+
+
+def merge_windows(ages: List[int], sketches: List[Any], windows: Dict[str, int]) -> Dict[str, int]:
+    '''
+    Оценки для вложенных окон «последние N дней» за один проход: скетчи дней
+    сливаются от сегодняшнего к старым, оценка снимается на границе каждого окна
+    '''
+    days = sorted(zip(ages, sketches), key=lambda pair: pair[0])
+    result: Dict[str, int] = {}
+    merged = Sketch()
+    position = 0
+    for name, window in sorted(windows.items(), key=lambda item: item[1]):
+        while position < len(days) and days[position][0] <= window:
+            merged = merged.merge(Sketch.from_bytes(days[position][1]))
+            position += 1
+        result[name] = merged.estimate()
+    return result
+
+
+def _merge_into_days(cur, sketches: Dict[date, Sketch]) -> None:
+    '''
+    Сливает скетчи с сохранёнными. Пустые строки вставляются заранее, чтобы
+    FOR UPDATE сериализовал параллельные сбросы и ни один не затёр другой
+    '''
+    days = sorted(sketches)
+    execute_values(cur, f'''
+        INSERT INTO {SCHEMA}.visit_daily_sketches (day, sketch) VALUES %s
+        ON CONFLICT (day) DO NOTHING
+    ''', [(day, Sketch().to_bytes()) for day in days])
+    cur.execute(f'''
+        SELECT day, sketch FROM {SCHEMA}.visit_daily_sketches
+        WHERE day = ANY(%s) ORDER BY day FOR UPDATE
+    ''', (days,))
+    for day, stored in cur.fetchall():
+        sketches[day] = sketches[day].merge(Sketch.from_bytes(stored))
+    execute_values(cur, f'''
+        UPDATE {SCHEMA}.visit_daily_sketches s
+        SET sketch = v.sketch, updated_at = NOW()
+        FROM (VALUES %s) AS v(day, sketch)
+        WHERE s.day = v.day
+    ''', [(day, sketches[day].to_bytes()) for day in days], template='(%s::date, %s::bytea)')
+
+
+def add_visitors(cur, visits: List[Tuple[Any, ...]]) -> None:
+    '''
+    Добавляет визиты (время, ip, user-agent, ...) в скетчи их дней. День считает
+    Postgres — так же, как DATE(visited_at) в статистике
+    '''
+    cur.execute('''
+        SELECT DATE(t.visited_at::timestamp)
+        FROM unnest(%s::timestamptz[]) WITH ORDINALITY AS t(visited_at, n)
+        ORDER BY t.n
+    ''', ([visit[0] for visit in visits],))
+    sketches: Dict[date, Sketch] = {}
+    for (day,), visit in zip(cur.fetchall(), visits):
+        sketches.setdefault(day, Sketch()).add(fingerprint(visit[1], visit[2]))
+    if sketches:
+        _merge_into_days(cur, sketches)
+
+
+def backfill_sketches(conn, after: Optional[date] = None, time_budget: float = 20.0,
+                      until: Optional[date] = None) -> Dict[str, Any]:
+    '''
+    Строит скетчи дней, прошедших до появления записи при приёме, по одному дню
+    за транзакцию, до until не включительно. Слияние идемпотентно, поэтому уже
+    посчитанные дни не портятся
+    '''
+    started = time.monotonic()
+    processed = 0
+    with conn.cursor() as cur:
+        while time.monotonic() - started < time_budget:
+            cur.execute(f'''
+                SELECT DATE(MIN(visited_at)) FROM {SCHEMA}.site_visits
+                WHERE visited_at >= %s AND visited_at < %s
+            ''', (after + timedelta(days=1) if after else date(1970, 1, 1), until or date.max))
+            day = cur.fetchone()[0]
+            if day is None:
+                conn.rollback()
+                return {'days': processed, 'next_after': None, 'done': True}
+            cur.execute(f'''
+                SELECT DISTINCT ip_address, user_agent FROM {SCHEMA}.site_visits
+                WHERE visited_at >= %s AND visited_at < %s
+            ''', (day, day + timedelta(days=1)))
+            sketch = Sketch()
+            for ip_address, user_agent in cur:
+                sketch.add(fingerprint(ip_address or '', user_agent or ''))
+            _merge_into_days(cur, {day: sketch})
+            conn.commit()
+            processed += 1
+            after = day
+    return {'days': processed, 'next_after': after.isoformat() if after else None, 'done': False}
@@ -5,11 +5,18 @@ Returns: HTTP-ответ с данными альбомов/треков или
 '''
 
 import json
-import os
-import psycopg2
+import base64
+import hashlib
+from datetime import datetime
 from psycopg2.extras import RealDictCursor
+from db import get_connection
+from play_counter import get_live_counts, record_event
+from response import compressed
 
 SCHEMA = 't_p39135821_musician_site_projec'
+# NULL в track_order и created_at сортируется как эти значения — так же, как в индексах V0056
+NULL_ORDER = 0
+NULL_TIME = datetime(1970, 1, 1)
 CORS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
@@ -17,17 +24,62 @@ CORS = {
 }
 
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    return get_connection()
 
 def ok(data, status=200):
     return {'statusCode': status, 'headers': {'Content-Type': 'application/json', **CORS}, 'body': json.dumps(data, default=str)}
 
+def ok_conditional(data, if_none_match):
+    # ETag по содержимому: клиент с актуальной копией получает 304 без тела
+    body = json.dumps(data, default=str)
+    etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+    headers = {
+        'Content-Type': 'application/json',
+        'Cache-Control': 'public, max-age=0, must-revalidate',
+        'ETag': etag,
+        'Access-Control-Expose-Headers': 'ETag',
+        **CORS,
+    }
+    candidates = [c.strip()[2:] if c.strip().startswith('W/') else c.strip() for c in (if_none_match or '').split(',')]
+    if etag in candidates or '*' in candidates:
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'body': body}
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except ValueError:
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != size or None in values:
+        raise ValueError('invalid cursor')
+    return values
+
+def page_limit(params, default, maximum=100):
+    try:
+        return max(1, min(int(params.get('limit') or default), maximum))
+    except ValueError:
+        raise ValueError('invalid limit')
+
 def err(msg, status=400):
     return {'statusCode': status, 'headers': {'Content-Type': 'application/json', **CORS}, 'body': json.dumps({'error': msg})}
 
+def bump_catalog_version(cur):
+    # Общий с music-api счётчик: по нему функции сбрасывают кеш каталога
+    cur.execute(f'''
+        INSERT INTO {SCHEMA}.catalog_version (id, version, updated_at) VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE SET version = {SCHEMA}.catalog_version.version + 1, updated_at = NOW()
+    ''')
+
 def is_admin(token):
     return token and token.startswith('admin_')
 
+@compressed
 def handler(event: dict, context) -> dict:
     method = event.get('httpMethod', 'GET')
     if method == 'OPTIONS':
@@ -35,6 +87,7 @@ def handler(event: dict, context) -> dict:
 
     headers = event.get('headers', {})
     token = headers.get('X-Authorization') or headers.get('x-authorization')
+    if_none_match = headers.get('If-None-Match') or headers.get('if-none-match')
     params = event.get('queryStringParameters') or {}
     path = params.get('path', '')
 
@@ -46,19 +99,9 @@ def handler(event: dict, context) -> dict:
             return err('track_id required')
         conn = get_db()
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                tid = str(track_id).replace("'", "''")
-                cur.execute(f'''
-                    INSERT INTO {SCHEMA}.track_stats (track_id, plays_count, last_played_at, created_at, updated_at)
-                    VALUES ('{tid}', 1, NOW(), NOW(), NOW())
-                    ON CONFLICT (track_id)
-                    DO UPDATE SET plays_count = {SCHEMA}.track_stats.plays_count + 1,
-                                  last_played_at = NOW(), updated_at = NOW()
-                    RETURNING plays_count
-                ''')
-                result = cur.fetchone()
-                conn.commit()
-                return ok({'plays_count': result['plays_count']})
+            # Событие уходит в play_events, в track_stats его переносит пакетный сброс
+            record_event(conn, str(track_id), 'play')
+            return ok({'plays_count': get_live_counts(conn, str(track_id))['plays_count']})
         finally:
             conn.close()
 
@@ -72,50 +115,112 @@ def handler(event: dict, context) -> dict:
                     FROM {SCHEMA}.albums
                     ORDER BY created_at DESC
                 ''')
-                return ok([dict(a) for a in cur.fetchall()])
+                return ok_conditional([dict(a) for a in cur.fetchall()], if_none_match)
         finally:
             conn.close()
 
     # GET /tracks — публичный список треков альбома
+    # С параметром cursor (пустой — первая страница) отвечает {items, next_cursor}
     if method == 'GET' and path == 'tracks':
         album_id = params.get('album_id')
         if not album_id:
             return err('album_id required')
+        paginate = 'cursor' in params
+        try:
+            after = decode_cursor(params.get('cursor'), 3) if paginate else None
+            limit = page_limit(params, 50) if paginate else None
+        except ValueError as e:
+            return err(str(e))
         conn = get_db()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                aid = album_id.replace("'", "''")
+                where = 't.album_id = %s'
+                args = [album_id]
+                if after:
+                    where += " AND (COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id)" \
+                             " > (%s, %s::timestamp, %s)"
+                    args.extend(after)
+                if paginate:
+                    args.append(limit + 1)
                 cur.execute(f'''
                     SELECT t.id, t.title, t.duration, t.file, t.price, t.cover,
-                           t.label, t.genre, t.album_id, t.created_at,
-                           COALESCE(ts.plays_count, 0) as plays_count
+                           t.label, t.genre, t.album_id, t.created_at, t.track_order,
+                           COALESCE(ts.plays_count, 0) + COALESCE(ps.plays_count, 0) as plays_count
                     FROM {SCHEMA}.tracks t
                     LEFT JOIN {SCHEMA}.track_stats ts ON t.id = ts.track_id
-                    WHERE t.album_id = '{aid}'
-                    ORDER BY t.track_order ASC, t.created_at ASC
-                ''')
-                return ok([dict(t) for t in cur.fetchall()])
+                    LEFT JOIN {SCHEMA}.pending_track_stats ps ON t.id = ps.track_id
+                    WHERE {where}
+                    ORDER BY COALESCE(t.track_order, 0), COALESCE(t.created_at, TIMESTAMP 'epoch'), t.id
+                    {'LIMIT %s' if paginate else ''}
+                ''', args)
+                tracks = [dict(t) for t in cur.fetchall()]
+                if not paginate:
+                    return ok_conditional(tracks, if_none_match)
+                next_cursor = None
+                if len(tracks) > limit:
+                    tracks = tracks[:limit]
+                    last = tracks[-1]
+                    next_cursor = encode_cursor([
+                        NULL_ORDER if last['track_order'] is None else last['track_order'],
+                        last['created_at'] or NULL_TIME, last['id']
+                    ])
+                return ok_conditional({'items': tracks, 'next_cursor': next_cursor}, if_none_match)
         finally:
             conn.close()
 
     # GET /tracks/top — публичный топ треков
+    # С параметром cursor отвечает {items, next_cursor}, ключ — позиция в track_leaderboard
     if method == 'GET' and path == 'tracks/top':
-        limit = min(int(params.get('limit', 10)), 50)
+        paginate = 'cursor' in params
+        try:
+            limit = page_limit(params, 10, 50)
+            after = decode_cursor(params.get('cursor'), 3) if paginate else None
+        except ValueError as e:
+            return err(str(e))
         conn = get_db()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # Рейтинг читается по индексу idx_track_leaderboard_global, к трекам
+                # и альбомам присоединяется только выбранная страница
+                where = ''
+                args = []
+                if after:
+                    where = "WHERE (lb.plays_count, COALESCE(lb.created_at, TIMESTAMP 'epoch'), lb.track_id)" \
+                            " < (%s, %s::timestamp, %s)"
+                    args.extend(after)
+                args.append(limit + 1 if paginate else limit)
                 cur.execute(f'''
+                    WITH top AS (
+                        SELECT lb.track_id, lb.plays_count, lb.created_at
+                        FROM {SCHEMA}.track_leaderboard lb
+                        {where}
+                        ORDER BY lb.plays_count DESC, COALESCE(lb.created_at, TIMESTAMP 'epoch') DESC, lb.track_id DESC
+                        LIMIT %s
+                    )
                     SELECT t.id, t.title, t.duration, t.file, t.price, t.cover,
                            t.label, t.genre, t.album_id, t.created_at,
-                           COALESCE(ts.plays_count, 0) as plays_count,
+                           top.plays_count + COALESCE(ps.plays_count, 0) as plays_count,
+                           top.plays_count as rank_plays,
+                           COALESCE(top.created_at, TIMESTAMP 'epoch') as rank_created_at,
                            a.title as album_title
-                    FROM {SCHEMA}.tracks t
-                    LEFT JOIN {SCHEMA}.track_stats ts ON t.id = ts.track_id
+                    FROM top
+                    JOIN {SCHEMA}.tracks t ON t.id = top.track_id
+                    LEFT JOIN {SCHEMA}.pending_track_stats ps ON t.id = ps.track_id
                     LEFT JOIN {SCHEMA}.albums a ON t.album_id = a.id
-                    ORDER BY COALESCE(ts.plays_count, 0) DESC, t.created_at DESC
-                    LIMIT {limit}
-                ''')
-                return ok([dict(t) for t in cur.fetchall()])
+                    ORDER BY top.plays_count DESC, COALESCE(top.created_at, TIMESTAMP 'epoch') DESC, top.track_id DESC
+                ''', args)
+                tracks = [dict(t) for t in cur.fetchall()]
+                next_cursor = None
+                if paginate and len(tracks) > limit:
+                    tracks = tracks[:limit]
+                    last = tracks[-1]
+                    next_cursor = encode_cursor([last['rank_plays'], last['rank_created_at'], last['id']])
+                for track in tracks:
+                    track.pop('rank_plays')
+                    track.pop('rank_created_at')
+                if not paginate:
+                    return ok(tracks)
+                return ok({'items': tracks, 'next_cursor': next_cursor})
         finally:
             conn.close()
 
@@ -142,8 +247,10 @@ def handler(event: dict, context) -> dict:
                     VALUES (gen_random_uuid()::text, '{title}', '{artist}', '{cover}', {price}, '{description}', NOW())
                     RETURNING id, title, artist, cover, price, description, created_at
                 ''')
+                album = dict(cur.fetchone())
+                bump_catalog_version(cur)
                 conn.commit()
-                return ok(dict(cur.fetchone()), 201)
+                return ok(album, 201)
 
             # PUT /albums?id=... — обновить альбом
             if method == 'PUT' and path == 'albums':
@@ -168,6 +275,7 @@ def handler(event: dict, context) -> dict:
                 row = cur.fetchone()
                 if not row:
                     return err('album not found', 404)
+                bump_catalog_version(cur)
                 conn.commit()
                 return ok(dict(row))
 
@@ -179,6 +287,7 @@ def handler(event: dict, context) -> dict:
                 cur.execute(f"DELETE FROM {SCHEMA}.albums WHERE id = '{album_id}'")
                 if cur.rowcount == 0:
                     return err('album not found', 404)
+                bump_catalog_version(cur)
                 conn.commit()
                 return ok({'message': 'deleted'})
 
@@ -200,8 +309,10 @@ def handler(event: dict, context) -> dict:
                     VALUES (gen_random_uuid()::text, '{album_id}', '{title}', '{duration}', '{file_}', '{cover}', {price}, '{label}', '{genre}', NOW())
                     RETURNING id, album_id, title, duration, file, cover, price, label, genre, created_at
                 ''')
+                track = dict(cur.fetchone())
+                bump_catalog_version(cur)
                 conn.commit()
-                return ok(dict(cur.fetchone()), 201)
+                return ok(track, 201)
 
             # PUT /tracks?id=... — обновить трек
             if method == 'PUT' and path == 'tracks':
@@ -228,6 +339,7 @@ def handler(event: dict, context) -> dict:
                 row = cur.fetchone()
                 if not row:
                     return err('track not found', 404)
+                bump_catalog_version(cur)
                 conn.commit()
                 return ok(dict(row))
 
@@ -239,12 +351,14 @@ def handler(event: dict, context) -> dict:
                 cur.execute(f"DELETE FROM {SCHEMA}.tracks WHERE id = '{track_id}'")
                 if cur.rowcount == 0:
                     return err('track not found', 404)
+                bump_catalog_version(cur)
                 conn.commit()
                 return ok({'message': 'deleted'})
 
             # DELETE /stats/reset — сбросить статистику
             if method == 'DELETE' and path == 'stats/reset':
-                cur.execute(f'TRUNCATE TABLE {SCHEMA}.track_stats')
+                cur.execute(f'TRUNCATE TABLE {SCHEMA}.track_stats, {SCHEMA}.play_events')
+                bump_catalog_version(cur)
                 conn.commit()
                 return ok({'message': 'stats reset'})
 
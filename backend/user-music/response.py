@@ -0,0 +1,152 @@
+'''
+Business: Сжатие ответов функции по Accept-Encoding (brotli или gzip)
+Args: RESPONSE_COMPRESS_MIN_BYTES, RESPONSE_GZIP_LEVEL, RESPONSE_BROTLI_QUALITY из окружения
+Returns: compressed — обёртка handler; ответ с base64-телом, Content-Encoding и Vary
+'''
+
+import base64
+import functools
+import gzip
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+_stats: Dict[str, Any] = {
+    'compressed': 0,
+    'skipped_small': 0,
+    'bytes_in': 0,
+    'bytes_out': 0,
+    'cpu_ms': 0.0
+}
+
+
+def _header(headers: Dict[str, str], name: str) -> Optional[str]:
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    '''Выбирает br или gzip с учётом q-значений; q=0 означает запрет'''
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    wildcard = accepted.get('*', 0.0)
+    candidates: List[str] = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    best_q = 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    # mtime=0 — одинаковое тело даёт одинаковые байты при каждом вызове
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def _add_vary(headers: Dict[str, str]) -> None:
+    vary = _header(headers, 'vary')
+    if vary is None:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        for key in list(headers):
+            if key.lower() == 'vary':
+                headers[key] = f'{vary}, Accept-Encoding'
+
+
+def compress_response(event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Сжимает текстовое тело ответа, если клиент это поддерживает и тело больше
+    порога. Бинарные (уже base64) и частичные ответы не трогает
+    '''
+    headers = response.get('headers')
+    body = response.get('body')
+    if not isinstance(headers, dict) or not isinstance(body, str) or response.get('isBase64Encoded'):
+        return response
+    content_type = (_header(headers, 'content-type') or '').lower()
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return response
+    if _header(headers, 'content-encoding') or response.get('statusCode') == 206:
+        return response
+
+    # Представление зависит от Accept-Encoding даже тогда, когда сжатие не выбрано
+    _add_vary(headers)
+    raw = body.encode('utf-8')
+    if len(raw) < RESPONSE_COMPRESS_MIN_BYTES:
+        if raw:
+            _stats['skipped_small'] += 1
+        return response
+
+    request_headers = event.get('headers') or {}
+    encoding = choose_encoding(_header(request_headers, 'accept-encoding'))
+    if not encoding:
+        return response
+
+    started = time.process_time()
+    packed = compress_body(raw, encoding)
+    _stats['cpu_ms'] += (time.process_time() - started) * 1000
+    if len(packed) >= len(raw):
+        return response
+
+    _stats['compressed'] += 1
+    _stats['bytes_in'] += len(raw)
+    _stats['bytes_out'] += len(packed)
+    headers['Content-Encoding'] = encoding
+    etag = _header(headers, 'etag')
+    # Сжатое представление не побайтно равно исходному — ETag становится слабым
+    if etag and not etag.startswith('W/'):
+        for key in list(headers):
+            if key.lower() == 'etag':
+                headers[key] = 'W/' + etag
+    response['body'] = base64.b64encode(packed).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def compressed(handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''Декоратор для handler: каждый ответ проходит через compress_response'''
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        return compress_response(event, handler(event, context))
+    return wrapper
+
+
+def compression_stats() -> Dict[str, Any]:
+    bytes_in = _stats['bytes_in']
+    return {
+        **_stats,
+        'cpu_ms': round(_stats['cpu_ms'], 3),
+        'bytes_saved': bytes_in - _stats['bytes_out'],
+        'ratio': round(_stats['bytes_out'] / bytes_in, 3) if bytes_in else None,
+        'encoding_available': ['br', 'gzip'] if brotli is not None else ['gzip'],
+        'min_bytes': RESPONSE_COMPRESS_MIN_BYTES,
+        'gzip_level': RESPONSE_GZIP_LEVEL,
+        'brotli_quality': RESPONSE_BROTLI_QUALITY
+    }
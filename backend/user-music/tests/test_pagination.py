@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import index
+from db import get_connection
+
+SCHEMA = index.SCHEMA
+ALBUM_ID = 'um_page_test_album'
+# (id, track_order, created_at): NULL в обоих ключах и одинаковые значения
+TRACKS = [
+    ('um_page_test_t1', 1, '2024-01-01 10:00'),
+    ('um_page_test_t2', None, '2024-01-01 10:00'),
+    ('um_page_test_t3', 1, None),
+    ('um_page_test_t4', None, None),
+    ('um_page_test_t5', 2, '2024-01-02 10:00'),
+    ('um_page_test_t6', None, None),
+]
+
+
+@pytest.fixture
+def album(database_url):
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cleanup(cur)
+        cur.execute(f"INSERT INTO {SCHEMA}.albums (id, title, artist) VALUES (%s, 'Test', 'Test')", (ALBUM_ID,))
+        for track_id, track_order, created_at in TRACKS:
+            cur.execute(f'''
+                INSERT INTO {SCHEMA}.tracks (id, album_id, title, duration, track_order, created_at)
+                VALUES (%s, %s, %s, '3:00', %s, %s)
+            ''', (track_id, ALBUM_ID, track_id, track_order, created_at))
+        # Один трек с прослушиваниями, остальные делят нулевой счётчик
+        cur.execute(f'''
+            INSERT INTO {SCHEMA}.track_stats (track_id, plays_count) VALUES ('um_page_test_t5', 1000000)
+        ''')
+    conn.commit()
+    yield
+    with conn.cursor() as cur:
+        cleanup(cur)
+    conn.commit()
+    conn.close()
+
+
+def cleanup(cur):
+    cur.execute(f"DELETE FROM {SCHEMA}.track_stats WHERE track_id LIKE 'um_page_test_%%'")
+    cur.execute(f"DELETE FROM {SCHEMA}.tracks WHERE id LIKE 'um_page_test_%%'")
+    cur.execute(f"DELETE FROM {SCHEMA}.albums WHERE id LIKE 'um_page_test_%%'")
+
+
+def walk(path, limit, **params):
+    '''Все страницы подряд по next_cursor'''
+    seen = []
+    page_cursor = ''
+    for _ in range(1000):
+        response = index.handler({
+            'httpMethod': 'GET',
+            'queryStringParameters': {'path': path, 'cursor': page_cursor, 'limit': str(limit), **params},
+            'headers': {}
+        }, None)
+        assert response['statusCode'] == 200
+        page = json.loads(response['body'])
+        seen.extend(item['id'] for item in page['items'])
+        page_cursor = page['next_cursor']
+        if not page_cursor:
+            return seen
+    raise AssertionError('pagination did not terminate')
+
+
+def test_album_tracks_with_nulls_are_all_paged(album):
+    expected = ['um_page_test_t4', 'um_page_test_t6', 'um_page_test_t2',
+                'um_page_test_t3', 'um_page_test_t1', 'um_page_test_t5']
+    for limit in (1, 2, 4):
+        assert walk('tracks', limit, album_id=ALBUM_ID) == expected
+
+
+def test_top_tracks_with_null_dates_are_all_paged(album):
+    top = [track_id for track_id in walk('tracks/top', 3) if track_id.startswith('um_page_test_')]
+    assert sorted(top) == sorted(track_id for track_id, _, _ in TRACKS)
+    assert top[0] == 'um_page_test_t5'
+    assert len(top) == len(set(top))
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+
+import psycopg2
+import pytest
+
+import index
+import play_counter
+from db import get_connection
+
+SCHEMA = play_counter.SCHEMA
+TRACK_ID = 'load_test_track'
+PLAYS = 100
+
+
+@pytest.fixture
+def track(monkeypatch, database_url):
+    # Порог сброса выше нагрузки: все прослушивания остаются в play_events до явного сброса
+    monkeypatch.setattr(play_counter, 'PLAY_FLUSH_BATCH', PLAYS * 10)
+    monkeypatch.setattr(play_counter, 'PLAY_FLUSH_INTERVAL', 3600)
+    monkeypatch.setattr(play_counter, '_state', {'since_flush': 0, 'last_flush': time.monotonic()})
+    conn = get_connection()
+    with conn.cursor() as cur:
+        cleanup(cur)
+        cur.execute(f"INSERT INTO {SCHEMA}.tracks (id, title, duration) VALUES (%s, 'Load test', '3:00')",
+                    (TRACK_ID,))
+    conn.commit()
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cur:
+        cleanup(cur)
+    conn.commit()
+    conn.close()
+
+
+def cleanup(cur):
+    cur.execute(f'DELETE FROM {SCHEMA}.play_events WHERE track_id = %s', (TRACK_ID,))
+    cur.execute(f'DELETE FROM {SCHEMA}.track_stats WHERE track_id = %s', (TRACK_ID,))
+    cur.execute(f'DELETE FROM {SCHEMA}.tracks WHERE id = %s', (TRACK_ID,))
+
+
+def concurrently(play):
+    '''PLAYS потоков стартуют одновременно'''
+    results = []
+    barrier = threading.Barrier(PLAYS)
+
+    def run():
+        barrier.wait()
+        results.append(play())
+
+    threads = [threading.Thread(target=run) for _ in range(PLAYS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def post_play():
+    response = index.handler({
+        'httpMethod': 'POST',
+        'queryStringParameters': {'path': 'track/play'},
+        'headers': {},
+        'body': json.dumps({'track_id': TRACK_ID})
+    }, None)
+    return response['statusCode']
+
+
+UPSERT_PLAY = f'''
+    INSERT INTO {SCHEMA}.track_stats (track_id, plays_count, last_played_at) VALUES (%s, 1, NOW())
+    ON CONFLICT (track_id) DO UPDATE
+    SET plays_count = {SCHEMA}.track_stats.plays_count + 1, last_played_at = NOW()
+'''
+APPEND_PLAY = f"INSERT INTO {SCHEMA}.play_events (track_id, kind) VALUES (%s, 'play')"
+
+
+def free_connections(conn) -> int:
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT current_setting('max_connections')::int - current_setting('superuser_reserved_connections')::int
+                   - (SELECT COUNT(*) FROM pg_stat_activity)
+        ''')
+        free = cur.fetchone()[0]
+    conn.rollback()
+    return free
+
+
+def per_instance(conn, sql):
+    '''
+    Экземпляры функции со своими соединениями, как под нагрузкой на платформе:
+    пул одного экземпляра ограничил бы конкуренцию DB_POOL_MAX. Экземпляров столько,
+    сколько пустит сервер, но не больше PLAYS; прослушивания делятся между ними поровну
+    '''
+    instances = max(1, min(PLAYS, free_connections(conn) - 5))
+    connections = [psycopg2.connect(os.environ['DATABASE_URL']) for _ in range(instances)]
+    barrier = threading.Barrier(instances)
+
+    def run(instance_conn, plays):
+        barrier.wait()
+        with instance_conn.cursor() as cur:
+            for _ in range(plays):
+                cur.execute(sql, (TRACK_ID,))
+                instance_conn.commit()
+
+    threads = [threading.Thread(target=run, args=(c, PLAYS // instances + (i < PLAYS % instances)))
+               for i, c in enumerate(connections)]
+    try:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return instances, PLAYS / (time.perf_counter() - started)
+    finally:
+        for instance_conn in connections:
+            instance_conn.close()
+
+
+def counts(conn):
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT plays_count FROM {SCHEMA}.track_stats WHERE track_id = %s', (TRACK_ID,))
+        stored = cur.fetchone()
+        cur.execute(f'SELECT plays_count FROM {SCHEMA}.pending_track_stats WHERE track_id = %s', (TRACK_ID,))
+        pending = cur.fetchone()
+    conn.rollback()
+    return (stored[0] if stored else 0), (pending[0] if pending else 0)
+
+
+def test_concurrent_plays_of_one_track_are_counted_write_behind(track):
+    statuses = concurrently(post_play)
+    assert statuses == [200] * PLAYS
+    # Ни одно прослушивание не трогало строку track_stats, все ждут сброса
+    assert counts(track) == (0, PLAYS)
+    assert play_counter.get_live_counts(track, TRACK_ID)['plays_count'] == PLAYS
+    track.rollback()
+
+    assert play_counter.flush_events(track) == PLAYS
+    assert counts(track) == (PLAYS, 0)
+
+
+def test_appending_plays_outpaces_hot_row_upsert(track):
+    instances, upsert_rate = per_instance(track, UPSERT_PLAY)
+    assert counts(track) == (PLAYS, 0)
+
+    instances, append_rate = per_instance(track, APPEND_PLAY)
+    assert counts(track) == (PLAYS, PLAYS)
+    assert play_counter.flush_events(track) == PLAYS
+    assert counts(track) == (2 * PLAYS, 0)
+
+    print(f'\n[BENCH] {PLAYS} plays of one track from {instances} concurrent connections: '
+          f'hot-row upsert {upsert_rate:.0f} plays/s, play_events append {append_rate:.0f} plays/s')
+    assert append_rate > upsert_rate
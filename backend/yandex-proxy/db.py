@@ -0,0 +1,142 @@
+'''
+Business: Пул соединений с Postgres, общий для тёплых вызовов функции
+Args: DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_PING_AFTER, DB_POOL_TIMEOUT из окружения
+Returns: get_connection() — соединение из пула; close() возвращает его обратно
+'''
+
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional
+import psycopg2
+from psycopg2 import extensions, pool
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '4'))
+# Соединение, простоявшее дольше этого, проверяется SELECT 1 перед выдачей
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+# Сколько ждать свободного соединения, когда все DB_POOL_MAX уже выданы
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+_pool: Optional[pool.ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool не ждёт и сразу бросает PoolError, поэтому очередь держит семафор
+_checkout_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_released_at: Dict[int, float] = {}
+_stats: Dict[str, Any] = {
+    'checkouts': 0,
+    'reconnects': 0,
+    'last_checkout_ms': 0.0,
+    'max_checkout_ms': 0.0,
+    'total_checkout_ms': 0.0,
+    'timeouts': 0
+}
+
+
+class PooledConnection:
+    '''Обёртка над соединением: close() возвращает его в пул, а не закрывает'''
+
+    def __init__(self, db_pool: pool.ThreadedConnectionPool, conn, checkout_ms: float):
+        self._conn = conn
+        self.checkout_ms = checkout_ms
+        # Соединение вернётся в пул, даже если обработчик упал и не вызвал close().
+        # Пул запоминается здесь: глобальный _pool к этому моменту мог смениться
+        self._finalizer = weakref.finalize(self, _release, db_pool, conn)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def close(self) -> None:
+        self._finalizer()
+
+
+def get_pool() -> pool.ThreadedConnectionPool:
+    global _pool
+    current = _pool
+    if current is not None and not current.closed:
+        return current
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            database_url = os.environ.get('DATABASE_URL')
+            if not database_url:
+                raise Exception('DATABASE_URL not found')
+            _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, database_url)
+        return _pool
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    released_at = _released_at.get(id(conn))
+    # Свежее соединение только что прошло handshake, пинговать его незачем
+    if released_at is None or time.monotonic() - released_at < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _release(db_pool: pool.ThreadedConnectionPool, conn) -> None:
+    try:
+        if db_pool.closed:
+            _released_at.pop(id(conn), None)
+            if not conn.closed:
+                conn.close()
+            return
+        broken = bool(conn.closed)
+        if not broken and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            _released_at.pop(id(conn), None)
+        else:
+            _released_at[id(conn)] = time.monotonic()
+        db_pool.putconn(conn, close=broken)
+    finally:
+        _checkout_slots.release()
+
+
+def get_connection(cursor_factory=None) -> PooledConnection:
+    started = time.monotonic()
+    if not _checkout_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        _stats['timeouts'] += 1
+        raise Exception(f'Database connection pool exhausted: no free connection in {DB_POOL_TIMEOUT:g}s')
+    try:
+        db_pool = get_pool()
+        for _ in range(DB_POOL_MAX + 1):
+            conn = db_pool.getconn()
+            if _is_healthy(conn):
+                break
+            _released_at.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+            _stats['reconnects'] += 1
+        else:
+            raise Exception('No healthy database connection available')
+    except Exception:
+        _checkout_slots.release()
+        raise
+
+    conn.cursor_factory = cursor_factory
+    checkout_ms = (time.monotonic() - started) * 1000
+    _stats['checkouts'] += 1
+    _stats['last_checkout_ms'] = round(checkout_ms, 3)
+    _stats['max_checkout_ms'] = round(max(_stats['max_checkout_ms'], checkout_ms), 3)
+    _stats['total_checkout_ms'] += checkout_ms
+    return PooledConnection(db_pool, conn, checkout_ms)
+
+
+def pool_stats() -> Dict[str, Any]:
+    checkouts = _stats['checkouts']
+    return {
+        **_stats,
+        'avg_checkout_ms': round(_stats['total_checkout_ms'] / checkouts, 3) if checkouts else 0.0,
+        'total_checkout_ms': round(_stats['total_checkout_ms'], 3),
+        'pool_max': DB_POOL_MAX
+    }
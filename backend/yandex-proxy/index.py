@@ -1,9 +1,10 @@
 import json
-import urllib.request
-import urllib.parse
 import urllib.error
+from link_cache import YANDEX_BATCH_MAX, cache_stats, resolve, resolve_many
+from response import compressed
 
 
+@compressed
 def handler(event: dict, context) -> dict:
     """Прокси для получения прямой ссылки на аудиофайл с Яндекс.Диска"""
 
@@ -12,7 +13,7 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type',
                 'Access-Control-Max-Age': '86400'
             },
@@ -22,6 +23,37 @@ def handler(event: dict, context) -> dict:
     params = event.get('queryStringParameters') or {}
     public_url = params.get('url', '')
 
+    if params.get('stats') == '1':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(cache_stats())
+        }
+
+    # POST {"urls": [...]} — все ссылки альбома за один вызов функции
+    if event.get('httpMethod') == 'POST':
+        try:
+            urls = json.loads(event.get('body') or '{}').get('urls')
+        except (ValueError, AttributeError):
+            urls = None
+        if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u for u in urls):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'urls must be a non-empty list of strings'})
+            }
+        if len(urls) > YANDEX_BATCH_MAX:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'At most {YANDEX_BATCH_MAX} urls per request'})
+            }
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'results': resolve_many(urls)})
+        }
+
     if not public_url:
         return {
             'statusCode': 400,
@@ -30,12 +62,7 @@ def handler(event: dict, context) -> dict:
         }
 
     try:
-        api_url = f"https://cloud-api.yandex.net/v1/disk/public/resources/download?public_key={urllib.parse.quote(public_url)}"
-        req = urllib.request.Request(api_url, headers={'User-Agent': 'Mozilla/5.0'})
-
-        with urllib.request.urlopen(req, timeout=15) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            direct_url = data.get('href')
+        direct_url = resolve(public_url)
 
         if not direct_url:
             return {
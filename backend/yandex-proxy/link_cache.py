@@ -0,0 +1,367 @@
+'''
+Business: Кеш прямых ссылок Яндекс.Диска: память процесса и, по желанию, Postgres
+Args: YANDEX_API_URL, YANDEX_CACHE_TTL, YANDEX_CACHE_MAX_ENTRIES, YANDEX_CACHE_PG, YANDEX_BATCH_* из окружения
+Returns: resolve(public_url) — прямая ссылка; resolve_many — пачка ссылок; cache_stats() — попадания и задержки
+'''
+
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+YANDEX_API_URL = os.environ.get('YANDEX_API_URL', 'https://cloud-api.yandex.net/v1/disk/public/resources/download')
+YANDEX_TIMEOUT = float(os.environ.get('YANDEX_TIMEOUT', '15'))
+# Ссылка без собственного срока жизни хранится не дольше YANDEX_CACHE_TTL
+YANDEX_CACHE_TTL = float(os.environ.get('YANDEX_CACHE_TTL', '600'))
+YANDEX_CACHE_MAX_ENTRIES = int(os.environ.get('YANDEX_CACHE_MAX_ENTRIES', '2048'))
+# Запас до истечения ссылки: клиент должен успеть начать скачивание
+YANDEX_EXPIRY_MARGIN = float(os.environ.get('YANDEX_EXPIRY_MARGIN', '60'))
+YANDEX_CACHE_PG = os.environ.get('YANDEX_CACHE_PG', '1') == '1' and bool(os.environ.get('DATABASE_URL'))
+YANDEX_BATCH_WORKERS = int(os.environ.get('YANDEX_BATCH_WORKERS', '8'))
+YANDEX_BATCH_MAX = int(os.environ.get('YANDEX_BATCH_MAX', '50'))
+YANDEX_BATCH_DEADLINE = float(os.environ.get('YANDEX_BATCH_DEADLINE', '10'))
+
+SCHEMA = 't_p39135821_musician_site_projec'
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_local = threading.local()
+_executor: Optional[ThreadPoolExecutor] = None
+_cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+_inflight: Dict[str, Future] = {}
+_stats: Dict[str, int] = {
+    'memory_hits': 0,
+    'db_hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'upstream_errors': 0,
+    'evictions': 0
+}
+_latency: Dict[str, Any] = {
+    'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    'count': 0,
+    'sum_ms': 0.0,
+    'max_ms': 0.0
+}
+
+
+def link_expiry(href: str, now: float) -> float:
+    '''Срок из параметра expires в ссылке (unix-время), но не дальше YANDEX_CACHE_TTL'''
+    expires = now + YANDEX_CACHE_TTL
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(href).query)
+    try:
+        expires = min(expires, float(query['expires'][0]) - YANDEX_EXPIRY_MARGIN)
+    except (KeyError, IndexError, ValueError):
+        pass
+    return expires
+
+
+def _observe_latency(elapsed_ms: float) -> None:
+    index = len(LATENCY_BUCKETS_MS)
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            index = i
+            break
+    with _lock:
+        _latency['buckets'][index] += 1
+        _latency['count'] += 1
+        _latency['sum_ms'] += elapsed_ms
+        _latency['max_ms'] = max(_latency['max_ms'], elapsed_ms)
+
+
+def _api_connection() -> http.client.HTTPConnection:
+    '''Keep-alive соединение с API на поток: TLS-рукопожатие не повторяется от запроса к запросу'''
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        parsed = urllib.parse.urlparse(YANDEX_API_URL)
+        connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        conn = connection_class(parsed.netloc, timeout=YANDEX_TIMEOUT)
+        _local.conn = conn
+    return conn
+
+
+def _drop_connection() -> None:
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def fetch_href(public_url: str) -> Optional[str]:
+    '''Запрос к API Яндекса; ответ не 200 поднимается как HTTPError'''
+    api_url = f"{YANDEX_API_URL}?public_key={urllib.parse.quote(public_url)}"
+    target = urllib.parse.urlparse(api_url)
+    started = time.monotonic()
+    try:
+        for attempt in range(2):
+            conn = _api_connection()
+            try:
+                conn.request('GET', f'{target.path}?{target.query}', headers={'User-Agent': 'Mozilla/5.0'})
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                _drop_connection()
+                # Сервер мог закрыть простаивающее соединение — одна попытка на новом
+                if attempt or isinstance(e, TimeoutError):
+                    raise
+        if response.will_close:
+            _drop_connection()
+    finally:
+        _observe_latency((time.monotonic() - started) * 1000)
+    if response.status != 200:
+        raise urllib.error.HTTPError(api_url, response.status, response.reason, response.headers, io.BytesIO(body))
+    return json.loads(body.decode('utf-8')).get('href')
+
+
+def _memory_get(public_url: str, now: float) -> Optional[str]:
+    entry = _cache.get(public_url)
+    if entry is None:
+        return None
+    if entry[1] <= now:
+        del _cache[public_url]
+        return None
+    _cache.move_to_end(public_url)
+    return entry[0]
+
+
+def _memory_put(public_url: str, href: str, expires: float) -> None:
+    _cache[public_url] = (href, expires)
+    _cache.move_to_end(public_url)
+    while len(_cache) > YANDEX_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+        _stats['evictions'] += 1
+
+
+def _db_get(public_url: str) -> Optional[Tuple[str, float]]:
+    if not YANDEX_CACHE_PG:
+        return None
+    from db import get_connection
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT href, EXTRACT(EPOCH FROM expires_at) FROM {SCHEMA}.yandex_link_cache
+                WHERE public_url = %s AND expires_at > NOW()
+            ''', (public_url,))
+            row = cur.fetchone()
+        conn.rollback()
+    finally:
+        conn.close()
+    return (row[0], float(row[1])) if row else None
+
+
+def _db_put(public_url: str, href: str, expires: float) -> None:
+    if not YANDEX_CACHE_PG:
+        return
+    from db import get_connection
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                INSERT INTO {SCHEMA}.yandex_link_cache (public_url, href, expires_at, updated_at)
+                VALUES (%s, %s, to_timestamp(%s), NOW())
+                ON CONFLICT (public_url) DO UPDATE
+                SET href = EXCLUDED.href, expires_at = EXCLUDED.expires_at, updated_at = NOW()
+            ''', (public_url, href, expires))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _db_get_many(public_urls: List[str]) -> Dict[str, Tuple[str, float]]:
+    if not YANDEX_CACHE_PG or not public_urls:
+        return {}
+    from db import get_connection
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT public_url, href, EXTRACT(EPOCH FROM expires_at) FROM {SCHEMA}.yandex_link_cache
+                WHERE public_url = ANY(%s) AND expires_at > NOW()
+            ''', (public_urls,))
+            rows = cur.fetchall()
+        conn.rollback()
+    finally:
+        conn.close()
+    return {row[0]: (row[1], float(row[2])) for row in rows}
+
+
+def _db_put_many(links: Dict[str, Tuple[str, float]]) -> None:
+    if not YANDEX_CACHE_PG or not links:
+        return
+    from db import get_connection
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                INSERT INTO {SCHEMA}.yandex_link_cache (public_url, href, expires_at, updated_at)
+                SELECT u.public_url, u.href, to_timestamp(u.expires), NOW()
+                FROM unnest(%s::text[], %s::text[], %s::float8[]) AS u(public_url, href, expires)
+                ON CONFLICT (public_url) DO UPDATE
+                SET href = EXCLUDED.href, expires_at = EXCLUDED.expires_at, updated_at = NOW()
+            ''', (list(links), [v[0] for v in links.values()], [v[1] for v in links.values()]))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _lookup(public_url: str, db_tier: bool = True) -> Optional[str]:
+    try:
+        cached = _db_get(public_url) if db_tier else None
+    except Exception as e:
+        # Второй уровень — ускорение, а не зависимость: без БД идём в API напрямую
+        print(f'[ERROR] Link cache read failed: {e}')
+        cached = None
+    if cached and cached[1] > time.time():
+        with _lock:
+            _stats['db_hits'] += 1
+            _memory_put(public_url, cached[0], cached[1])
+        return cached[0]
+
+    with _lock:
+        _stats['misses'] += 1
+    try:
+        href = fetch_href(public_url)
+    except Exception:
+        with _lock:
+            _stats['upstream_errors'] += 1
+        raise
+    if href:
+        expires = link_expiry(href, time.time())
+        with _lock:
+            _memory_put(public_url, href, expires)
+        if db_tier:
+            try:
+                _db_put(public_url, href, expires)
+            except Exception as e:
+                print(f'[ERROR] Link cache write failed: {e}')
+    return href
+
+
+def resolve(public_url: str, db_tier: bool = True) -> Optional[str]:
+    '''
+    Прямая ссылка по публичной. Одновременные запросы одного URL ждут
+    единственный вызов API вместо того, чтобы делать свой. С db_tier=False
+    Postgres не трогается — так делает resolve_many, читающий и пишущий его за всю пачку
+    '''
+    with _lock:
+        href = _memory_get(public_url, time.time())
+        if href is not None:
+            _stats['memory_hits'] += 1
+            return href
+        future = _inflight.get(public_url)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[public_url] = future
+        else:
+            _stats['coalesced'] += 1
+    if not leader:
+        return future.result()
+
+    try:
+        href = _lookup(public_url, db_tier)
+        future.set_result(href)
+        return href
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(public_url, None)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=YANDEX_BATCH_WORKERS, thread_name_prefix='yandex-resolve')
+        return _executor
+
+
+def resolve_many(public_urls: List[str], deadline: float = YANDEX_BATCH_DEADLINE) -> Dict[str, Dict[str, Any]]:
+    '''
+    Разрешает пачку ссылок параллельно в общем пуле потоков. Postgres читается
+    одним запросом до похода в API и пишется одним upsert-ом после: потоки пула
+    соединений с БД не берут. Что не успело к сроку, получает ошибку timeout;
+    запрос доводится в фоне и попадает в кеш процесса для следующего вызова.
+    В Postgres такой результат не пишется: если экземпляр остановят раньше, он
+    просто теряется, и следующий вызов спросит API заново
+    '''
+    urls = list(dict.fromkeys(public_urls))
+    hrefs: Dict[str, Optional[str]] = {}
+    now = time.time()
+    with _lock:
+        for url in urls:
+            href = _memory_get(url, now)
+            if href is not None:
+                _stats['memory_hits'] += 1
+                hrefs[url] = href
+    missing = [url for url in urls if url not in hrefs]
+    try:
+        cached = _db_get_many(missing)
+    except Exception as e:
+        print(f'[ERROR] Link cache read failed: {e}')
+        cached = {}
+    with _lock:
+        for url, (href, expires) in cached.items():
+            if expires > now:
+                _stats['db_hits'] += 1
+                _memory_put(url, href, expires)
+                hrefs[url] = href
+
+    executor = _get_executor()
+    futures = {url: executor.submit(resolve, url, False) for url in urls if url not in hrefs}
+    wait(futures.values(), timeout=deadline)
+    results: Dict[str, Dict[str, Any]] = {}
+    fetched: Dict[str, Tuple[str, float]] = {}
+    for url in urls:
+        future = futures.get(url)
+        if future is None:
+            results[url] = {'url': hrefs[url]}
+        elif not future.done():
+            results[url] = {'error': 'timeout'}
+        elif future.exception() is not None:
+            error = future.exception()
+            if isinstance(error, urllib.error.HTTPError):
+                results[url] = {'error': f'Yandex API error: {error.code}', 'status': error.code}
+            else:
+                results[url] = {'error': str(error)}
+        elif future.result():
+            results[url] = {'url': future.result()}
+            fetched[url] = (future.result(), link_expiry(future.result(), time.time()))
+        else:
+            results[url] = {'error': 'Direct URL not found in response', 'status': 404}
+    try:
+        _db_put_many(fetched)
+    except Exception as e:
+        print(f'[ERROR] Link cache write failed: {e}')
+    return results
+
+
+def cache_stats() -> Dict[str, Any]:
+    with _lock:
+        hits = _stats['memory_hits'] + _stats['db_hits'] + _stats['coalesced']
+        total = hits + _stats['misses']
+        bounds = [str(b) for b in LATENCY_BUCKETS_MS] + ['+Inf']
+        return {
+            **_stats,
+            'entries': len(_cache),
+            'inflight': len(_inflight),
+            'hit_ratio': round(hits / total, 4) if total else None,
+            'db_tier': YANDEX_CACHE_PG,
+            'upstream_latency_ms': {
+                'buckets': dict(zip(bounds, _latency['buckets'])),
+                'count': _latency['count'],
+                'avg': round(_latency['sum_ms'] / _latency['count'], 3) if _latency['count'] else None,
+                'max': round(_latency['max_ms'], 3)
+            }
+        }
@@ -0,0 +1,170 @@
+import threading
+import time
+import urllib.error
+
+import pytest
+
+import link_cache
+
+API_PATH = '/v1/disk/public/resources/download'
+
+
+@pytest.fixture
+def yandex(monkeypatch, http_stub):
+    '''Локальная замена API Яндекс.Диска; кеш, статистика и соединения — с чистого листа'''
+    monkeypatch.setattr(link_cache, 'YANDEX_API_URL', f'{http_stub.url}{API_PATH}')
+    monkeypatch.setattr(link_cache, 'YANDEX_CACHE_PG', False)
+    monkeypatch.setattr(link_cache, '_local', threading.local())
+    monkeypatch.setattr(link_cache, '_executor', None)
+    monkeypatch.setattr(link_cache, '_cache', link_cache.OrderedDict())
+    monkeypatch.setattr(link_cache, '_inflight', {})
+    monkeypatch.setattr(link_cache, '_stats', {key: 0 for key in link_cache._stats})
+    http_stub.links = {}
+    http_stub.delays = {}
+
+    def route(method, path, query, body):
+        public_key = query['public_key'][0]
+        time.sleep(http_stub.delays.get(public_key, 0))
+        if public_key not in http_stub.links:
+            return 404, {}, {'error': 'DiskNotFoundError'}
+        return 200, {}, {'href': http_stub.links[public_key], 'method': 'GET'}
+
+    http_stub.routes[API_PATH] = route
+    yield http_stub
+    if link_cache._executor is not None:
+        link_cache._executor.shutdown(wait=True)
+
+
+def upstream_calls(stub, public_url=None):
+    return [c for c in stub.calls(API_PATH) if public_url is None or c['query']['public_key'][0] == public_url]
+
+
+def test_link_expiry_honours_expires_param_and_ttl(monkeypatch):
+    monkeypatch.setattr(link_cache, 'YANDEX_CACHE_TTL', 600)
+    monkeypatch.setattr(link_cache, 'YANDEX_EXPIRY_MARGIN', 60)
+    now = 1_700_000_000.0
+    assert link_cache.link_expiry(f'https://dl.test/f?expires={int(now) + 300}&x=1', now) == now + 240
+    # Срок дальше TTL обрезается до TTL, ссылка без срока живёт TTL
+    assert link_cache.link_expiry(f'https://dl.test/f?expires={int(now) + 86400}', now) == now + 600
+    assert link_cache.link_expiry('https://dl.test/f', now) == now + 600
+    assert link_cache.link_expiry('https://dl.test/f?expires=soon', now) == now + 600
+
+
+def test_cached_link_is_served_without_upstream_call(yandex):
+    yandex.links['https://disk.test/a'] = 'https://dl.test/a'
+    assert link_cache.resolve('https://disk.test/a') == 'https://dl.test/a'
+    assert link_cache.resolve('https://disk.test/a') == 'https://dl.test/a'
+    assert len(upstream_calls(yandex)) == 1
+    assert link_cache.cache_stats()['memory_hits'] == 1
+
+
+def test_link_close_to_expiry_is_not_reused(monkeypatch, yandex):
+    monkeypatch.setattr(link_cache, 'YANDEX_EXPIRY_MARGIN', 60)
+    # Ссылка истекает через 30 с — меньше запаса, клиент не успеет ею воспользоваться
+    yandex.links['https://disk.test/b'] = f'https://dl.test/b?expires={int(time.time()) + 30}'
+    link_cache.resolve('https://disk.test/b')
+    link_cache.resolve('https://disk.test/b')
+    assert len(upstream_calls(yandex)) == 2
+
+
+def test_link_is_refetched_after_ttl(monkeypatch, yandex):
+    monkeypatch.setattr(link_cache, 'YANDEX_CACHE_TTL', 0.2)
+    yandex.links['https://disk.test/c'] = 'https://dl.test/c1'
+    assert link_cache.resolve('https://disk.test/c') == 'https://dl.test/c1'
+    yandex.links['https://disk.test/c'] = 'https://dl.test/c2'
+    assert link_cache.resolve('https://disk.test/c') == 'https://dl.test/c1'
+    time.sleep(0.3)
+    assert link_cache.resolve('https://disk.test/c') == 'https://dl.test/c2'
+    assert len(upstream_calls(yandex)) == 2
+
+
+def test_concurrent_lookups_are_coalesced(yandex):
+    yandex.links['https://disk.test/d'] = 'https://dl.test/d'
+    yandex.delays['https://disk.test/d'] = 0.3
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(link_cache.resolve('https://disk.test/d')))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['https://dl.test/d'] * 10
+    assert len(upstream_calls(yandex)) == 1
+    stats = link_cache.cache_stats()
+    assert stats['misses'] == 1
+    assert stats['coalesced'] + stats['memory_hits'] == 9
+
+
+def test_coalesced_waiters_share_upstream_error(yandex):
+    yandex.delays['https://disk.test/missing'] = 0.2
+    errors = []
+
+    def lookup():
+        try:
+            link_cache.resolve('https://disk.test/missing')
+        except urllib.error.HTTPError as e:
+            errors.append(e.code)
+
+    threads = [threading.Thread(target=lookup) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [404] * 5
+    assert len(upstream_calls(yandex)) == 1
+
+
+def test_batch_reports_timeout_and_finishes_in_background(yandex):
+    for name in ('fast', 'slow'):
+        yandex.links[f'https://disk.test/{name}'] = f'https://dl.test/{name}'
+    yandex.delays['https://disk.test/slow'] = 0.8
+    started = time.monotonic()
+    results = link_cache.resolve_many(
+        ['https://disk.test/fast', 'https://disk.test/slow', 'https://disk.test/missing', 'https://disk.test/fast'],
+        deadline=0.3
+    )
+    assert time.monotonic() - started < 0.7
+    assert results == {
+        'https://disk.test/fast': {'url': 'https://dl.test/fast'},
+        'https://disk.test/slow': {'error': 'timeout'},
+        'https://disk.test/missing': {'error': 'Yandex API error: 404', 'status': 404}
+    }
+    # Опоздавший запрос доводится в фоне и попадает в кеш
+    time.sleep(0.8)
+    assert link_cache.resolve('https://disk.test/slow') == 'https://dl.test/slow'
+    assert len(upstream_calls(yandex, 'https://disk.test/slow')) == 1
+
+
+@pytest.fixture
+def yandex_pg(monkeypatch, yandex, database_url):
+    import db
+    monkeypatch.setattr(link_cache, 'YANDEX_CACHE_PG', True)
+    conn = db.get_connection()
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {link_cache.SCHEMA}.yandex_link_cache WHERE public_url LIKE 'https://disk.test/%%'")
+    conn.commit()
+    conn.close()
+    yield yandex
+
+
+def test_batch_reads_and_writes_db_tier_once(monkeypatch, yandex_pg):
+    import db
+    urls = [f'https://disk.test/track{i}' for i in range(20)]
+    for i, url in enumerate(urls):
+        yandex_pg.links[url] = f'https://dl.test/track{i}'
+    # Потоков больше, чем соединений в пуле: раньше каждый брал своё и ловил exhausted
+    monkeypatch.setattr(link_cache, 'YANDEX_BATCH_WORKERS', db.DB_POOL_MAX * 2)
+
+    checkouts = db.pool_stats()['checkouts']
+    results = link_cache.resolve_many(urls)
+    assert all(results[url] == {'url': yandex_pg.links[url]} for url in urls)
+    assert db.pool_stats()['checkouts'] - checkouts == 2
+
+    # Новый экземпляр функции: память пуста, всё приходит из Postgres одним запросом
+    monkeypatch.setattr(link_cache, '_cache', link_cache.OrderedDict())
+    checkouts = db.pool_stats()['checkouts']
+    again = link_cache.resolve_many(urls)
+    assert again == results
+    assert db.pool_stats()['checkouts'] - checkouts == 1
+    assert link_cache.cache_stats()['db_hits'] == 20
+    assert len(upstream_calls(yandex_pg)) == 20
@@ -0,0 +1,11 @@
+-- Счётчик версии каталога: увеличивается при каждом изменении альбомов и треков,
+-- по нему функции сбрасывают свой кеш каталога
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.catalog_version (
+    id INTEGER PRIMARY KEY DEFAULT 1,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p39135821_musician_site_projec.catalog_version (id, version)
+VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
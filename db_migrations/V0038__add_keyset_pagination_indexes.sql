@@ -0,0 +1,9 @@
+-- Составные индексы под keyset-пагинацию каталога
+CREATE INDEX IF NOT EXISTS idx_albums_created_id
+    ON t_p39135821_musician_site_projec.albums (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_tracks_created_id
+    ON t_p39135821_musician_site_projec.tracks (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_tracks_album_order
+    ON t_p39135821_musician_site_projec.tracks (album_id, track_order, created_at, id);
@@ -0,0 +1,3 @@
+-- Храним data несжатым вне строки, чтобы substring() в track-stream читал
+-- только нужные TOAST-чанки, а не распаковывал весь файл (действует для новых записей)
+ALTER TABLE t_p39135821_musician_site_projec.media_files ALTER COLUMN data SET STORAGE EXTERNAL;
@@ -0,0 +1,13 @@
+-- Байты медиафайлов храним в bytea с явной длиной и MIME-типом вместо base64 в TEXT.
+-- Старые записи остаются в data и переводятся в content конвертером music-api (?path=convert-media)
+ALTER TABLE t_p39135821_musician_site_projec.media_files ALTER COLUMN data DROP NOT NULL;
+ALTER TABLE t_p39135821_musician_site_projec.media_files ADD COLUMN IF NOT EXISTS content BYTEA;
+ALTER TABLE t_p39135821_musician_site_projec.media_files ADD COLUMN IF NOT EXISTS byte_length BIGINT;
+ALTER TABLE t_p39135821_musician_site_projec.media_files ADD COLUMN IF NOT EXISTS mime_type VARCHAR(100);
+
+-- Без сжатия и вне строки: substring() по content читает только нужные TOAST-чанки
+ALTER TABLE t_p39135821_musician_site_projec.media_files ALTER COLUMN content SET STORAGE EXTERNAL;
+
+-- Очередь конвертера: ещё не переведённые записи
+CREATE INDEX IF NOT EXISTS idx_media_files_legacy
+    ON t_p39135821_musician_site_projec.media_files (id) WHERE content IS NULL;
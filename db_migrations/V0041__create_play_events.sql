@@ -0,0 +1,19 @@
+-- Append-only журнал прослушиваний и скачиваний: запись без блокировки строки track_stats.
+-- События пакетно переносятся в track_stats одним upsert-ом и удаляются
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.play_events (
+    id BIGSERIAL PRIMARY KEY,
+    track_id VARCHAR(255) NOT NULL,
+    kind VARCHAR(10) NOT NULL DEFAULT 'play',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_play_events_track_id
+    ON t_p39135821_musician_site_projec.play_events (track_id);
+
+-- Ещё не перенесённые в track_stats события, для «живых» счётчиков при чтении
+CREATE OR REPLACE VIEW t_p39135821_musician_site_projec.pending_track_stats AS
+SELECT track_id,
+       COUNT(*) FILTER (WHERE kind = 'play') AS plays_count,
+       COUNT(*) FILTER (WHERE kind = 'download') AS downloads_count
+FROM t_p39135821_musician_site_projec.play_events
+GROUP BY track_id;
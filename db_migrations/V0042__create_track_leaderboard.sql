@@ -0,0 +1,89 @@
+-- Рейтинг треков по прослушиваниям, поддерживаемый триггерами.
+-- Топ-N читается index-only scan по составному индексу вместо сортировки
+-- всего каталога по выражению COALESCE(plays_count, 0)
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.track_leaderboard (
+    track_id VARCHAR(50) PRIMARY KEY,
+    user_id BIGINT,
+    plays_count BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_track_leaderboard_global
+    ON t_p39135821_musician_site_projec.track_leaderboard (plays_count DESC, created_at DESC, track_id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_track_leaderboard_user
+    ON t_p39135821_musician_site_projec.track_leaderboard (user_id, plays_count DESC, created_at DESC, track_id DESC);
+
+INSERT INTO t_p39135821_musician_site_projec.track_leaderboard (track_id, user_id, plays_count, created_at)
+SELECT t.id, t.user_id, COALESCE(ts.plays_count, 0), t.created_at
+FROM t_p39135821_musician_site_projec.tracks t
+LEFT JOIN t_p39135821_musician_site_projec.track_stats ts ON ts.track_id = t.id
+ON CONFLICT (track_id) DO NOTHING;
+
+-- Изменение счётчика в track_stats (пакетный сброс play_events) обновляет одну строку рейтинга
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.sync_leaderboard_from_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE t_p39135821_musician_site_projec.track_leaderboard
+        SET plays_count = 0
+        WHERE track_id = OLD.track_id;
+        RETURN OLD;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.track_id IS DISTINCT FROM NEW.track_id THEN
+        UPDATE t_p39135821_musician_site_projec.track_leaderboard
+        SET plays_count = 0
+        WHERE track_id = OLD.track_id;
+    END IF;
+    UPDATE t_p39135821_musician_site_projec.track_leaderboard
+    SET plays_count = COALESCE(NEW.plays_count, 0)
+    WHERE track_id = NEW.track_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.reset_leaderboard()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE t_p39135821_musician_site_projec.track_leaderboard SET plays_count = 0 WHERE plays_count <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Новые, удалённые и переназначенные треки
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.sync_leaderboard_from_tracks()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        DELETE FROM t_p39135821_musician_site_projec.track_leaderboard WHERE track_id = OLD.id;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    INSERT INTO t_p39135821_musician_site_projec.track_leaderboard (track_id, user_id, plays_count, created_at)
+    VALUES (
+        NEW.id,
+        NEW.user_id,
+        COALESCE((SELECT plays_count FROM t_p39135821_musician_site_projec.track_stats WHERE track_id = NEW.id), 0),
+        NEW.created_at
+    )
+    ON CONFLICT (track_id) DO UPDATE
+    SET user_id = EXCLUDED.user_id, plays_count = EXCLUDED.plays_count, created_at = EXCLUDED.created_at;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_track_stats_leaderboard ON t_p39135821_musician_site_projec.track_stats;
+CREATE TRIGGER trg_track_stats_leaderboard
+    AFTER INSERT OR DELETE OR UPDATE OF plays_count, track_id ON t_p39135821_musician_site_projec.track_stats
+    FOR EACH ROW EXECUTE FUNCTION t_p39135821_musician_site_projec.sync_leaderboard_from_stats();
+
+DROP TRIGGER IF EXISTS trg_track_stats_leaderboard_truncate ON t_p39135821_musician_site_projec.track_stats;
+CREATE TRIGGER trg_track_stats_leaderboard_truncate
+    AFTER TRUNCATE ON t_p39135821_musician_site_projec.track_stats
+    FOR EACH STATEMENT EXECUTE FUNCTION t_p39135821_musician_site_projec.reset_leaderboard();
+
+DROP TRIGGER IF EXISTS trg_tracks_leaderboard ON t_p39135821_musician_site_projec.tracks;
+CREATE TRIGGER trg_tracks_leaderboard
+    AFTER INSERT OR DELETE OR UPDATE OF id, user_id, created_at ON t_p39135821_musician_site_projec.tracks
+    FOR EACH ROW EXECUTE FUNCTION t_p39135821_musician_site_projec.sync_leaderboard_from_tracks();
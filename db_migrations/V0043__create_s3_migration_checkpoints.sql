@@ -0,0 +1,12 @@
+-- Позиция переноса media_files в S3 между вызовами migrate-to-s3:
+-- прерванный по таймауту проход продолжается с last_id
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.s3_migration_checkpoints (
+    job VARCHAR(50) PRIMARY KEY,
+    last_id VARCHAR(255) NOT NULL DEFAULT '',
+    migrated_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    bytes_uploaded BIGINT NOT NULL DEFAULT 0,
+    done BOOLEAN NOT NULL DEFAULT FALSE,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,46 @@
+-- Содержимое медиафайлов по sha256: одинаковые байты хранятся один раз.
+-- media_files становится указателем id -> content_hash, refcount считает указатели
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.media_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    content BYTEA NOT NULL,
+    byte_length BIGINT NOT NULL,
+    mime_type VARCHAR(100),
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE t_p39135821_musician_site_projec.media_blobs ALTER COLUMN content SET STORAGE EXTERNAL;
+
+ALTER TABLE t_p39135821_musician_site_projec.media_files ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_media_files_content_hash
+    ON t_p39135821_musician_site_projec.media_files (content_hash) WHERE content_hash IS NOT NULL;
+
+-- Очередь сборщика: блобы, на которые не ссылается ни один медиафайл
+CREATE INDEX IF NOT EXISTS idx_media_blobs_unreferenced
+    ON t_p39135821_musician_site_projec.media_blobs (sha256) WHERE refcount <= 0;
+
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.sync_media_blob_refcount()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') AND OLD.content_hash IS NOT NULL THEN
+        UPDATE t_p39135821_musician_site_projec.media_blobs
+        SET refcount = refcount - 1
+        WHERE sha256 = OLD.content_hash;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    IF NEW.content_hash IS NOT NULL THEN
+        UPDATE t_p39135821_musician_site_projec.media_blobs
+        SET refcount = refcount + 1
+        WHERE sha256 = NEW.content_hash;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_media_files_blob_refcount ON t_p39135821_musician_site_projec.media_files;
+CREATE TRIGGER trg_media_files_blob_refcount
+    AFTER INSERT OR DELETE OR UPDATE OF content_hash ON t_p39135821_musician_site_projec.media_files
+    FOR EACH ROW EXECUTE FUNCTION t_p39135821_musician_site_projec.sync_media_blob_refcount();
@@ -0,0 +1,29 @@
+-- Порционная загрузка файлов в file-upload: сессия и принятые куски.
+-- Куски собираются в media_blobs на стороне БД при finalize
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.upload_sessions (
+    id VARCHAR(50) PRIMARY KEY,
+    filename VARCHAR(255) NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    total_bytes BIGINT NOT NULL,
+    sha256 CHAR(64),
+    received_bytes BIGINT NOT NULL DEFAULT 0,
+    next_chunk INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(20) NOT NULL DEFAULT 'open',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at
+    ON t_p39135821_musician_site_projec.upload_sessions (updated_at) WHERE status = 'open';
+
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.upload_chunks (
+    upload_id VARCHAR(50) NOT NULL REFERENCES t_p39135821_musician_site_projec.upload_sessions (id) ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    byte_offset BIGINT NOT NULL,
+    byte_length INTEGER NOT NULL,
+    content BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (upload_id, chunk_index)
+);
+
+ALTER TABLE t_p39135821_musician_site_projec.upload_chunks ALTER COLUMN content SET STORAGE EXTERNAL;
@@ -0,0 +1,10 @@
+-- Второй уровень кеша yandex-proxy: прямые ссылки Яндекс.Диска, общие для всех экземпляров функции
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.yandex_link_cache (
+    public_url TEXT PRIMARY KEY,
+    href TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_yandex_link_cache_expires_at
+    ON t_p39135821_musician_site_projec.yandex_link_cache (expires_at);
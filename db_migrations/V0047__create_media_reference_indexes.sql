@@ -0,0 +1,31 @@
+-- id медиафайла из значения ссылочной колонки: само id, ссылка вида ?path=media&id=...
+-- или URL загрузки file-upload .../uploads/<id>.<ext>. Выражения проиндексированы,
+-- поэтому сборщик сирот в media_files проверяет ссылки через NOT EXISTS по индексу
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.media_ref_id(value TEXT)
+RETURNS TEXT AS $$
+    SELECT CASE
+        WHEN value IS NULL OR value = '' THEN NULL
+        WHEN value !~ '^https?://' THEN value
+        WHEN value ~ '[?&]id=' THEN substring(value from '[?&]id=([^&#]+)')
+        WHEN value ~ '/uploads/' THEN split_part(substring(value from '/uploads/([^/?#]+)'), '.', 1)
+        ELSE NULL
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS idx_tracks_file_media_ref
+    ON t_p39135821_musician_site_projec.tracks (t_p39135821_musician_site_projec.media_ref_id(file));
+
+CREATE INDEX IF NOT EXISTS idx_tracks_cover_media_ref
+    ON t_p39135821_musician_site_projec.tracks (t_p39135821_musician_site_projec.media_ref_id(cover));
+
+CREATE INDEX IF NOT EXISTS idx_albums_cover_media_ref
+    ON t_p39135821_musician_site_projec.albums (t_p39135821_musician_site_projec.media_ref_id(cover));
+
+CREATE INDEX IF NOT EXISTS idx_users_avatar_media_ref
+    ON t_p39135821_musician_site_projec.users (t_p39135821_musician_site_projec.media_ref_id(avatar_url));
+
+CREATE INDEX IF NOT EXISTS idx_artist_profiles_banner_media_ref
+    ON t_p39135821_musician_site_projec.artist_profiles (t_p39135821_musician_site_projec.media_ref_id(banner_url));
+
+CREATE INDEX IF NOT EXISTS idx_media_files_created_at
+    ON t_p39135821_musician_site_projec.media_files (created_at);
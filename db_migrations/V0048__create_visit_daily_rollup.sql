@@ -0,0 +1,14 @@
+-- Посещения по дням: завершённые дни сворачиваются из site_visits в одну строку.
+-- Статистика читает свёртку и докидывает только «хвост» сырых строк после последнего свёрнутого дня
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.visit_daily_rollup (
+    day DATE PRIMARY KEY,
+    visits BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p39135821_musician_site_projec.visit_daily_rollup (day, visits, updated_at)
+SELECT DATE(visited_at), COUNT(*), NOW()
+FROM t_p39135821_musician_site_projec.site_visits
+WHERE visited_at < CURRENT_DATE
+GROUP BY DATE(visited_at)
+ON CONFLICT (day) DO UPDATE SET visits = EXCLUDED.visits, updated_at = NOW();
@@ -0,0 +1,7 @@
+-- Уникальные посетители по дням: HyperLogLog-скетч отпечатков (ip + user-agent).
+-- sketch — байт точности и сжатые zlib регистры; скетчи дней сливаются в оценку за любой период
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.visit_daily_sketches (
+    day DATE PRIMARY KEY,
+    sketch BYTEA NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,92 @@
+-- site_visits становится секционированной по месяцам: запросы с диапазоном по visited_at
+-- читают только нужные секции, а старые месяцы отсоединяются и архивируются целиком
+ALTER TABLE t_p39135821_musician_site_projec.site_visits RENAME TO site_visits_unpartitioned;
+ALTER INDEX t_p39135821_musician_site_projec.idx_visits_date RENAME TO idx_visits_date_unpartitioned;
+ALTER SEQUENCE t_p39135821_musician_site_projec.site_visits_id_seq OWNED BY NONE;
+
+-- Ключ секционирования обязан входить в первичный ключ
+CREATE TABLE t_p39135821_musician_site_projec.site_visits (
+    id INTEGER NOT NULL DEFAULT nextval('t_p39135821_musician_site_projec.site_visits_id_seq'),
+    visited_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ip_address VARCHAR(45),
+    user_agent TEXT,
+    page_url TEXT,
+    PRIMARY KEY (id, visited_at)
+) PARTITION BY RANGE (visited_at);
+
+CREATE INDEX idx_visits_date ON t_p39135821_musician_site_projec.site_visits (visited_at);
+
+ALTER SEQUENCE t_p39135821_musician_site_projec.site_visits_id_seq
+    OWNED BY t_p39135821_musician_site_projec.site_visits.id;
+
+-- Секции site_visits_YYYYMM для месяцев с first_month по last_month; существующие пропускаются,
+-- поэтому track-visit может вызывать функцию конкурентно и сколько угодно раз
+CREATE OR REPLACE FUNCTION t_p39135821_musician_site_projec.ensure_visit_partitions(first_month DATE, last_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', first_month)::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'site_visits_' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(format('t_p39135821_musician_site_projec.%I', partition_name)) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE t_p39135821_musician_site_projec.%I PARTITION OF t_p39135821_musician_site_projec.site_visits FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, (month_start + INTERVAL '1 month')::date
+                );
+                created := created + 1;
+            EXCEPTION WHEN duplicate_table THEN
+                NULL;
+            END;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Строки без visited_at не подходят ни под одну секцию. Чтобы они не пропали вместе со старой
+-- таблицей, им ставится время ближайшего предыдущего по id посещения (или первого, если раньше
+-- ничего нет). Свёртка visit_daily_rollup их не учитывала и за прошлые дни не пересчитывается
+UPDATE t_p39135821_musician_site_projec.site_visits_unpartitioned u
+SET visited_at = COALESCE(
+    filled.previous_at,
+    (SELECT MIN(visited_at) FROM t_p39135821_musician_site_projec.site_visits_unpartitioned),
+    CURRENT_TIMESTAMP
+)
+FROM (
+    SELECT id, MAX(visited_at) OVER (ORDER BY id) AS previous_at
+    FROM t_p39135821_musician_site_projec.site_visits_unpartitioned
+) filled
+WHERE u.id = filled.id AND u.visited_at IS NULL;
+
+-- Секции покрывают все перенесённые строки, включая даты из будущего, и три месяца вперёд
+SELECT t_p39135821_musician_site_projec.ensure_visit_partitions(
+    COALESCE((SELECT MIN(visited_at)::date FROM t_p39135821_musician_site_projec.site_visits_unpartitioned), CURRENT_DATE),
+    GREATEST(
+        (SELECT MAX(visited_at)::date FROM t_p39135821_musician_site_projec.site_visits_unpartitioned),
+        (CURRENT_DATE + INTERVAL '3 months')::date
+    )
+);
+
+INSERT INTO t_p39135821_musician_site_projec.site_visits (id, visited_at, ip_address, user_agent, page_url)
+SELECT id, visited_at, ip_address, user_agent, page_url
+FROM t_p39135821_musician_site_projec.site_visits_unpartitioned;
+
+-- Старая таблица удаляется, только если перенесено всё до строки
+DO $$
+DECLARE
+    old_rows BIGINT;
+    new_rows BIGINT;
+BEGIN
+    SELECT COUNT(*) INTO old_rows FROM t_p39135821_musician_site_projec.site_visits_unpartitioned;
+    SELECT COUNT(*) INTO new_rows FROM t_p39135821_musician_site_projec.site_visits;
+    IF old_rows <> new_rows THEN
+        RAISE EXCEPTION 'site_visits partitioning copied % of % rows', new_rows, old_rows;
+    END IF;
+END;
+$$;
+
+DROP TABLE t_p39135821_musician_site_projec.site_visits_unpartitioned;
@@ -0,0 +1,32 @@
+-- Входящие обновления бота: вебхук только сохраняет их и сразу отвечает Telegram.
+-- update_id — ключ: повторная доставка того же обновления не обрабатывается второй раз
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.telegram_updates (
+    update_id BIGINT PRIMARY KEY,
+    payload JSONB NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_updates_pending
+    ON t_p39135821_musician_site_projec.telegram_updates (update_id) WHERE status = 'pending';
+
+-- Исходящие вызовы Bot API: пишутся в одной транзакции с обработкой обновления,
+-- отправляются воркером с ограничением частоты и повторами
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.telegram_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    method VARCHAR(64) NOT NULL DEFAULT 'sendMessage',
+    payload JSONB NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_outbox_pending
+    ON t_p39135821_musician_site_projec.telegram_outbox (next_attempt_at, id) WHERE status = 'pending';
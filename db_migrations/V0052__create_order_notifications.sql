@@ -0,0 +1,13 @@
+-- Уведомления владельцу о заказах с сайта: пишутся в одной транзакции с заказом,
+-- диспетчер сводит накопившиеся в дайджест и передаёт в telegram_outbox
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.order_notifications (
+    id BIGSERIAL PRIMARY KEY,
+    order_id VARCHAR(255) NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    dispatched_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_notifications_pending
+    ON t_p39135821_musician_site_projec.order_notifications (id) WHERE status = 'pending';
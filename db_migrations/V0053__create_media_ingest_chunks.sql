@@ -0,0 +1,10 @@
+-- Куски файла, скачиваемого по URL в music-api: копятся в транзакции загрузки
+-- и один раз собираются в media_blobs через string_agg, без переписывания растущего bytea
+CREATE TABLE IF NOT EXISTS t_p39135821_musician_site_projec.media_ingest_chunks (
+    media_id VARCHAR(255) NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content BYTEA NOT NULL,
+    PRIMARY KEY (media_id, chunk_index)
+);
+
+ALTER TABLE t_p39135821_musician_site_projec.media_ingest_chunks ALTER COLUMN content SET STORAGE EXTERNAL;
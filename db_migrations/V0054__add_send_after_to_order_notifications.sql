@@ -0,0 +1,4 @@
+-- Окно дайджеста хранится в самой записи: уведомление уходит первым разбором очереди
+-- после send_after (в вебхуке, при заказе или по расписанию), без ожидания в потоке
+ALTER TABLE t_p39135821_musician_site_projec.order_notifications
+    ADD COLUMN IF NOT EXISTS send_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
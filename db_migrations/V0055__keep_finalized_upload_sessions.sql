@@ -0,0 +1,7 @@
+-- Завершённая загрузка остаётся в upload_sessions со статусом finalized, чтобы
+-- повторный finalize (клиент не дождался ответа) вернул тот же результат.
+-- Просроченные сессии чистятся в любом статусе, поэтому индекс без условия
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_upload_sessions_updated_at;
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at
+    ON t_p39135821_musician_site_projec.upload_sessions (updated_at);
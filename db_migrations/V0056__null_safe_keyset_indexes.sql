@@ -0,0 +1,22 @@
+-- Ключи keyset-пагинации берутся через COALESCE: строка с NULL в track_order или
+-- created_at раньше не проходила условие курсора и пропадала после первой страницы.
+-- Индексы V0038 и V0042 пересоздаются по тем же выражениям, что в ORDER BY и WHERE
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_albums_created_id;
+CREATE INDEX IF NOT EXISTS idx_albums_created_id
+    ON t_p39135821_musician_site_projec.albums (COALESCE(created_at, TIMESTAMP 'epoch') DESC, id DESC);
+
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_tracks_created_id;
+CREATE INDEX IF NOT EXISTS idx_tracks_created_id
+    ON t_p39135821_musician_site_projec.tracks (COALESCE(created_at, TIMESTAMP 'epoch') DESC, id DESC);
+
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_tracks_album_order;
+CREATE INDEX IF NOT EXISTS idx_tracks_album_order
+    ON t_p39135821_musician_site_projec.tracks (album_id, COALESCE(track_order, 0), COALESCE(created_at, TIMESTAMP 'epoch'), id);
+
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_track_leaderboard_global;
+CREATE INDEX IF NOT EXISTS idx_track_leaderboard_global
+    ON t_p39135821_musician_site_projec.track_leaderboard (plays_count DESC, COALESCE(created_at, TIMESTAMP 'epoch') DESC, track_id DESC);
+
+DROP INDEX IF EXISTS t_p39135821_musician_site_projec.idx_track_leaderboard_user;
+CREATE INDEX IF NOT EXISTS idx_track_leaderboard_user
+    ON t_p39135821_musician_site_projec.track_leaderboard (user_id, plays_count DESC, COALESCE(created_at, TIMESTAMP 'epoch') DESC, track_id DESC);
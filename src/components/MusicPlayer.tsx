@@ -1,7 +1,7 @@
 import React, { useRef, useEffect } from 'react';
 import { Track } from '@/types';
 import { incrementPlays } from '@/utils/trackStats';
-import { convertYandexDiskUrl } from '@/utils/yandexDisk';
+import { convertYandexDiskUrl, prefetchYandexDiskUrls } from '@/utils/yandexDisk';
 import FloatingPlayer from '@/components/player/FloatingPlayer';
 import PlayerCard from '@/components/player/PlayerCard';
 
@@ -109,6 +109,11 @@ const MusicPlayer: React.FC<MusicPlayerProps> = ({
     }
   }, [volume, isMuted]);
 
+  useEffect(() => {
+    // Ссылки всего списка разрешаются одним вызовом прокси вместо вызова на каждый трек
+    prefetchYandexDiskUrls(tracks.map(track => track.file));
+  }, [tracks]);
+
   useEffect(() => {
     const audio = audioRef.current;
     if (audio && currentTrack?.file) {
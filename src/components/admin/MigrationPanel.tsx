@@ -77,16 +77,40 @@ const MigrationPanel: React.FC = () => {
     }
   };
 
-  const handleCleanupAudio = async () => {
-    if (!confirm('Удалить 115 неиспользуемых аудиофайлов из базы данных?\n\nЭто освободит ~20 МБ. Действие необратимо.')) {
-      return;
+  const runCleanup = async (dryRun: boolean) => {
+    // Сервер обходит media_files пачками в пределах времени вызова: продолжаем с next_after до конца
+    let after = '';
+    let audio = 0;
+    let images = 0;
+    let bytes = 0;
+    for (;;) {
+      const params = new URLSearchParams({ path: 'cleanup-audio', after });
+      if (dryRun) params.set('dry_run', '1');
+      const res = await fetch(`${MUSIC_API_URL}?${params}`, { method: 'DELETE' });
+      const data = await res.json();
+      audio += data.orphans_audio || 0;
+      images += data.orphans_image || 0;
+      bytes += data.orphan_bytes || 0;
+      if (data.done || !data.next_after || data.next_after === after) break;
+      after = data.next_after;
     }
+    return { audio, images, bytes };
+  };
+
+  const handleCleanupAudio = async () => {
     setIsCleaningAudio(true);
     setCleanupResult(null);
     try {
-      const res = await fetch(`${MUSIC_API_URL}?path=cleanup-audio`, { method: 'DELETE' });
-      const data = await res.json();
-      setCleanupResult(data);
+      const found = await runCleanup(true);
+      const megabytes = (found.bytes / 1024 / 1024).toFixed(1);
+      if (!confirm(`Удалить ${found.audio} аудио и ${found.images} картинок, на которые нет ссылок?\n\nЭто освободит ~${megabytes} МБ. Действие необратимо.`)) {
+        return;
+      }
+      const removed = await runCleanup(false);
+      setCleanupResult({
+        deleted: removed.audio + removed.images,
+        message: `Удалено ${removed.audio} аудио и ${removed.images} картинок`
+      });
     } catch (error) {
       setCleanupResult({ deleted: 0, message: 'Ошибка: ' + error });
     } finally {
@@ -76,6 +76,50 @@ export async function convertYandexDiskUrl(publicUrl: string): Promise<string> {
   }
 }
 
+/**
+ * Получает прямые ссылки для всех треков списка одним запросом к прокси
+ * и кладёт их в кеш, чтобы воспроизведение не ждало отдельного вызова
+ * @param publicUrls - ссылки треков; не относящиеся к Яндекс.Диску пропускаются
+ */
+export async function prefetchYandexDiskUrls(publicUrls: string[]): Promise<void> {
+  const now = Date.now();
+  const pending = Array.from(new Set(publicUrls.filter(url => {
+    if (!url || !isYandexDiskUrl(url)) return false;
+    const cached = urlCache.get(url);
+    return !cached || (now - cached.timestamp) >= CACHE_DURATION;
+  })));
+
+  if (pending.length === 0) {
+    return;
+  }
+
+  try {
+    const response = await fetch(PROXY_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ urls: pending.slice(0, 50) })
+    });
+
+    if (!response.ok) {
+      throw new Error(`Proxy error: ${response.status}`);
+    }
+
+    const data = await response.json();
+    let resolved = 0;
+    Object.entries(data.results || {}).forEach(([publicUrl, result]) => {
+      const directUrl = (result as { url?: string }).url;
+      if (directUrl) {
+        urlCache.set(publicUrl, { proxyUrl: directUrl, timestamp: now });
+        resolved++;
+      }
+    });
+
+    console.log(`✅ [YandexDisk] Получено ${resolved} прямых ссылок одним запросом`);
+  } catch (error) {
+    console.error('❌ [YandexDisk] Ошибка пакетного получения ссылок:', error);
+  }
+}
+
 /**
  * Очищает весь кеш URL
  */